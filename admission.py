@@ -0,0 +1,238 @@
+"""
+Admission control for expensive routes (agent runs, flight searches).
+
+Each `AdmissionController` caps concurrent requests globally and per user.
+Requests over the cap wait in a bounded FIFO queue. Once the queue (or the
+user's share of it) is full, or a request has waited longer than the queue
+timeout, it is shed immediately with `429 Too Many Requests` and a
+`Retry-After` hint, so tail latency stays bounded under overload instead of
+every request slowing down.
+
+`AdmissionMiddleware` applies controllers to (method, path) pairs at the ASGI
+layer. That covers sync and async handlers alike, and it holds the slot until
+a streamed response has been fully sent.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import orjson
+
+import auth_tokens
+import metrics
+
+ADMISSION_IN_FLIGHT = metrics.Gauge("admission_in_flight", "Requests holding an admission slot.", ("pool",))
+ADMISSION_QUEUE_DEPTH = metrics.Gauge("admission_queue_depth", "Requests waiting for an admission slot.", ("pool",))
+ADMISSION_SHED = metrics.Counter("admission_shed_total", "Requests rejected with 429 by reason.", ("pool", "reason"))
+ADMISSION_WAIT = metrics.Histogram("admission_wait_seconds", "Time spent queued before admission.", ("pool",))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global + per-user concurrency limiter with a bounded wait queue (single event loop)."""
+
+    def __init__(self, name: str, max_concurrent: int, per_user: int, max_queue: int,
+                 per_user_queue: int = None, queue_timeout: float = 10.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.per_user_queue = per_user_queue if per_user_queue is not None else max(1, max_queue // 4)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.shed = 0
+        self._active_by_user = {}
+        self._queued_by_user = {}
+        self._waiters = deque()  # (user, future)
+        self._avg_service = 1.0  # EWMA of slot hold time, seconds
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.name,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "shed": self.shed,
+            "max_concurrent": self.max_concurrent,
+            "per_user": self.per_user,
+            "max_queue": self.max_queue,
+        }
+
+    def _can_run(self, user) -> bool:
+        return self.active < self.max_concurrent and self._active_by_user.get(user, 0) < self.per_user
+
+    def _grant(self, user):
+        self.active += 1
+        self._active_by_user[user] = self._active_by_user.get(user, 0) + 1
+        ADMISSION_IN_FLIGHT.set(self.active, pool=self.name)
+
+    def _retry_after(self) -> int:
+        backlog = len(self._waiters) + 1
+        return max(1, min(60, math.ceil(self._avg_service * backlog / self.max_concurrent)))
+
+    def _reject(self, reason: str):
+        self.shed += 1
+        ADMISSION_SHED.inc(pool=self.name, reason=reason)
+        raise AdmissionRejected(reason, self._retry_after())
+
+    async def acquire(self, user):
+        # only bypass the queue when nobody who could run is already waiting
+        if self._can_run(user) and not any(self._can_run(u) for u, _ in self._waiters):
+            self._grant(user)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+        if self._queued_by_user.get(user, 0) >= self.per_user_queue:
+            self._reject("user_queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (user, future)
+        self._waiters.append(waiter)
+        self._queued_by_user[user] = self._queued_by_user.get(user, 0) + 1
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters), pool=self.name)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return  # granted just as the timeout fired; keep the slot
+            self._dequeue(waiter)
+            self._reject("queue_timeout")
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release(user)  # client went away after the slot was granted
+            else:
+                self._dequeue(waiter)
+            raise
+        finally:
+            ADMISSION_WAIT.observe(time.perf_counter() - start, pool=self.name)
+
+    def _dequeue(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        self._drop_queued(waiter[0])
+        waiter[1].cancel()
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters), pool=self.name)
+
+    def _drop_queued(self, user):
+        left = self._queued_by_user.get(user, 0) - 1
+        if left > 0:
+            self._queued_by_user[user] = left
+        else:
+            self._queued_by_user.pop(user, None)
+
+    def release(self, user, held_for: float = None):
+        self.active -= 1
+        left = self._active_by_user.get(user, 0) - 1
+        if left > 0:
+            self._active_by_user[user] = left
+        else:
+            self._active_by_user.pop(user, None)
+        if held_for is not None:
+            self._avg_service = 0.8 * self._avg_service + 0.2 * held_for
+
+        # hand freed capacity to the oldest waiters whose user is under their cap
+        for waiter in list(self._waiters):
+            if self.active >= self.max_concurrent:
+                break
+            w_user, future = waiter
+            if future.done() or not self._can_run(w_user):
+                continue
+            self._waiters.remove(waiter)
+            self._drop_queued(w_user)
+            self._grant(w_user)
+            future.set_result(None)
+        ADMISSION_IN_FLIGHT.set(self.active, pool=self.name)
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters), pool=self.name)
+
+    @asynccontextmanager
+    async def slot(self, user):
+        await self.acquire(user)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(user, time.perf_counter() - start)
+
+
+def _env_controller(name: str, max_concurrent: int, per_user: int, max_queue: int, queue_timeout: float):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return AdmissionController(
+        name=name,
+        max_concurrent=int(os.getenv(prefix + "MAX_CONCURRENT", max_concurrent)),
+        per_user=int(os.getenv(prefix + "PER_USER", per_user)),
+        max_queue=int(os.getenv(prefix + "MAX_QUEUE", max_queue)),
+        queue_timeout=float(os.getenv(prefix + "QUEUE_TIMEOUT", queue_timeout)),
+    )
+
+
+agent_controller = _env_controller("agent", max_concurrent=8, per_user=2, max_queue=32, queue_timeout=20)
+search_controller = _env_controller("search", max_concurrent=32, per_user=4, max_queue=128, queue_timeout=10)
+
+
+def user_key(scope) -> str:
+    """
+    Identify the caller by the subject of a verified access token (bearer header
+    or access_token cookie), else by client address. Client-supplied ids are not
+    trusted, so a caller cannot spread requests over other users' shares.
+    """
+    token = None
+    for name, value in scope.get("headers") or []:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            token = value[7:].decode("latin-1").strip()
+            break
+        if name == b"cookie" and token is None:
+            for part in value.decode("latin-1").split(";"):
+                key, _, val = part.strip().partition("=")
+                if key == "access_token" and val:
+                    token = val
+    claims = auth_tokens.verify_access_token(token) if token else None
+    if claims:
+        return "user:" + claims["sub"]
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """Apply admission controllers to exact (method, path) pairs."""
+
+    def __init__(self, app, rules: dict):
+        self.app = app
+        self.rules = rules
+
+    async def __call__(self, scope, receive, send):
+        controller = None
+        if scope["type"] == "http":
+            controller = self.rules.get((scope["method"], scope["path"]))
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        user = user_key(scope)
+        try:
+            async with controller.slot(user):
+                await self.app(scope, receive, send)
+        except AdmissionRejected as e:
+            body = orjson.dumps({"detail": "Server busy, please retry later", "reason": e.reason, "retryAfter": e.retry_after})
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(e.retry_after).encode()),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
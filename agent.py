@@ -1,4 +1,4 @@
-from db import write_parsed_email_to_db
+from db import write_parsed_email_to_db, upsert_flight_results, fetch_recent_flights
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, START, END
@@ -8,12 +8,15 @@ import os
 import sys
 import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from langgraph.checkpoint.memory import InMemorySaver  
 from langchain_core.runnables import RunnableConfig
 from langgraph.store.memory import InMemoryStore  
+import metrics
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from AISO_Hackathon.fetch_flight_data import fetch_flight_data_from_serpapi
+from AISO_Hackathon.fetch_flight_data import fetch_flight_data_from_serpapi, iter_flight_batches_from_serpapi
 
 # -------------------------------
 # Load environment
@@ -25,6 +28,70 @@ print("🔑 OpenAI API Key Loaded:", bool(OPENAI_API_KEY))
 # -------------------------------
 # Dummy / Helper functions
 # -------------------------------
+# Seconds to wait for SerpAPI before answering from stored results instead
+UPSTREAM_TIMEOUT = float(os.getenv("FLIGHT_UPSTREAM_TIMEOUT", 15))
+
+_upstream_executor = ThreadPoolExecutor(max_workers=int(os.getenv("FLIGHT_UPSTREAM_WORKERS", 8)), thread_name_prefix="serpapi")
+# single writer: persistence never delays a response and writes stay ordered
+_persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flight-persist")
+
+
+def _persist_flights(flights):
+    """Queue parsed flights for a bulk upsert into the flights table."""
+    if not flights:
+        return
+
+    def _write():
+        try:
+            upsert_flight_results(flights)
+        except Exception as e:
+            print(f"⚠️ Could not persist {len(flights)} flights: {e}")
+
+    _persist_executor.submit(_write)
+
+
+def _fetch_flights_with_fallback(departure_id, arrival_id, outbound_date, return_date, currency):
+    """
+    Fetch from SerpAPI, waiting at most UPSTREAM_TIMEOUT seconds.
+
+    Fresh results are persisted. When the upstream call fails, is slow or comes
+    back empty, recent stored results for the same route and date are served
+    instead; a slow call still persists its results once it completes.
+    """
+    def _fetch():
+        flights = fetch_flight_data_from_serpapi(
+            departure_id=departure_id,
+            arrival_id=arrival_id,
+            outbound_date=outbound_date,
+            return_date=return_date,
+            currency=currency,
+            sort_by=1,
+            parse_only_essentials=True
+        )
+        _persist_flights(flights)
+        return flights
+
+    future = _upstream_executor.submit(_fetch)
+    try:
+        flights = future.result(timeout=UPSTREAM_TIMEOUT)
+        if flights:
+            return flights
+        print("📭 No flights fetched from API; trying stored results.")
+    except FutureTimeout:
+        print(f"🐢 SerpAPI slower than {UPSTREAM_TIMEOUT}s; serving stored results.")
+    except Exception as e:
+        print(f"❌ Flight data fetch failed: {e}; trying stored results.")
+
+    try:
+        stored = fetch_recent_flights(departure_id, arrival_id, outbound_date)
+    except Exception as e:
+        print(f"❌ Could not read stored flights: {e}")
+        return []
+    if currency:
+        stored = [f for f in stored if f.get("currency") == currency]
+    print(f"🗄️ Serving {len(stored)} stored flights for {departure_id} → {arrival_id} on {outbound_date}.")
+    return stored
+
 
 
 def fetch_flight_data_wrapper(preferences: dict):
@@ -67,51 +134,19 @@ def fetch_flight_data_wrapper(preferences: dict):
     budget = merged.get("budget", 9999)
 
     # ---- Fetch all available flights ----
-    try:
-        all_flights = fetch_flight_data_from_serpapi(
-            departure_id=departure_id,
-            arrival_id=arrival_id,
-            outbound_date=outbound_dt.strftime("%Y-%m-%d"),
-            return_date=return_date,
-            currency=currency,
-            sort_by=1,
-            parse_only_essentials=True
-        )
-    except Exception as e:
-        print(f"❌ Flight data fetch failed: {e}")
-        return []
+    all_flights = _fetch_flights_with_fallback(
+        departure_id, arrival_id, outbound_dt.strftime("%Y-%m-%d"), return_date, currency
+    )
 
     if not all_flights:
         print("📭 No flights fetched from API.")
         return []
 
     # ---- Filter flights based on preferences ----
-    filtered_flights = []
-    for f in all_flights:
-        try:
-            # Core validations
-            if f.get("departure") and f["departure"].upper() != departure_id.upper():
-                continue
-            if f.get("arrival") and f["arrival"].upper() != arrival_id.upper():
-                continue
-
-            # Budget filter
-            if f.get("price") and float(f["price"]) > float(budget):
-                continue
-
-            # Optional: date window filter
-            flight_date = f.get("departure_date") or f.get("date")
-            if flight_date:
-                try:
-                    fdate = datetime.strptime(flight_date.split("T")[0], "%Y-%m-%d")
-                    if fdate < outbound_dt or fdate > outbound_dt + timedelta(days=int(merged["days"])):
-                        continue
-                except:
-                    pass  # skip malformed dates
-
-            filtered_flights.append(f)
-        except Exception as inner_err:
-            print(f"⚠️ Error filtering a flight: {inner_err}")
+    filtered_flights = [
+        f for f in all_flights
+        if _flight_matches_preferences(f, [departure_id], [arrival_id], budget, outbound_dt, merged.get("days"))
+    ]
 
     # ---- Handle case: no suitable flights ----
     if not filtered_flights:
@@ -123,6 +158,95 @@ def fetch_flight_data_wrapper(preferences: dict):
     print(f"✅ Found {len(sorted_flights)} suitable flights.")
     return sorted_flights
 
+def _flight_matches_preferences(f: dict, departure_ids, arrival_ids, budget, outbound_dt, days) -> bool:
+    """Return True if a parsed flight satisfies the route, budget and date window."""
+    from datetime import datetime, timedelta
+
+    try:
+        # Core validations
+        if f.get("departure") and f["departure"].upper() not in {d.upper() for d in departure_ids}:
+            return False
+        if f.get("arrival") and f["arrival"].upper() not in {a.upper() for a in arrival_ids}:
+            return False
+
+        # Budget filter
+        if f.get("price") and float(f["price"]) > float(budget):
+            return False
+
+        # Optional: date window filter
+        flight_date = f.get("departure_date") or f.get("date")
+        if flight_date:
+            try:
+                fdate = datetime.strptime(flight_date.split("T")[0], "%Y-%m-%d")
+                if fdate < outbound_dt or fdate > outbound_dt + timedelta(days=int(days)):
+                    return False
+            except:
+                pass  # skip malformed dates
+
+        return True
+    except Exception as inner_err:
+        print(f"⚠️ Error filtering a flight: {inner_err}")
+        return False
+
+
+def _as_list(value) -> list:
+    """Accept a list or a comma-separated string ("AMS,RTM") and return a clean list."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+def iter_flight_data_wrapper(preferences: dict):
+    """
+    Streaming counterpart of `fetch_flight_data_wrapper`.
+
+    Expands multi-airport preferences (lists or comma-separated IATA codes) and
+    date grids (`dates`: list of outbound dates) into individual SerpAPI searches
+    and yields the flights of each upstream batch as soon as it has been parsed
+    and filtered. Batches are unsorted; ranking is left to the caller.
+    """
+    from datetime import datetime, timedelta
+
+    merged = {**(preferences or {})}
+    days = int(merged.get("days") or 10)
+    budget = merged.get("budget") or 9999
+    currency = merged.get("currency") or "USD"
+
+    departure_ids = _as_list(merged.get("departure_airport"))
+    arrival_ids = _as_list(merged.get("arrival_airport"))
+
+    outbound_dates = []
+    for raw in _as_list(merged.get("dates")) or [merged.get("date") or merged.get("outbound_date")]:
+        try:
+            outbound_dates.append(datetime.strptime(raw, "%Y-%m-%d"))
+        except Exception:
+            print(f"⚠️ Invalid date {raw!r} in preferences, skipping")
+    if not outbound_dates:
+        print("⚠️ Invalid or missing date in preferences, using default 2025-12-25")
+        outbound_dates = [datetime(2025, 12, 25)]
+
+    searches = [
+        (dep, arr, d.strftime("%Y-%m-%d"), (d + timedelta(days=days)).strftime("%Y-%m-%d"))
+        for d in outbound_dates
+        for dep in departure_ids
+        for arr in arrival_ids
+    ]
+    window_start = min(outbound_dates)
+    window_days = days + (max(outbound_dates) - window_start).days
+
+    print(f"✈️ Streaming {len(searches)} flight searches...")
+    for batch in iter_flight_batches_from_serpapi(searches, currency=currency, sort_by=1):
+        _persist_flights(batch)
+        filtered = [
+            f for f in batch
+            if _flight_matches_preferences(f, departure_ids, arrival_ids, budget, window_start, window_days)
+        ]
+        if filtered:
+            yield filtered
+
+
 # -------------------------------
 # LangGraph State
 # -------------------------------
@@ -136,6 +260,50 @@ class MessagesState(TypedDict):
 llm = ChatOpenAI(model="gpt-5", temperature=0.3,
                  base_url="https://fj7qg3jbr3.execute-api.eu-west-1.amazonaws.com/v1")
 
+def _invoke_llm(prompt: str, operation: str) -> str:
+    """Call the chat model and record latency, outcome and token usage for `operation`."""
+    start = time.perf_counter()
+    try:
+        response = llm.invoke([HumanMessage(content=prompt)])
+    except Exception:
+        metrics.LLM_REQUESTS.inc(operation=operation, outcome="error")
+        raise
+    finally:
+        metrics.LLM_LATENCY.observe(time.perf_counter() - start, operation=operation)
+    metrics.LLM_REQUESTS.inc(operation=operation, outcome="ok")
+    usage = getattr(response, "usage_metadata", None) or {}
+    metrics.LLM_TOKENS.inc(usage.get("input_tokens", 0), operation=operation, kind="input")
+    metrics.LLM_TOKENS.inc(usage.get("output_tokens", 0), operation=operation, kind="output")
+    return response.content
+
+def classify_email(email: dict) -> dict:
+    """
+    Ask the LLM whether an email is a meeting/event invitation and extract its details.
+
+    Raises:
+        json.JSONDecodeError: The model did not answer with valid JSON.
+    """
+    text = f"{email.get('header', '')} {email.get('body', '')}".strip()
+
+    # Use LLM to detect & parse invitation emails
+    prompt = f"""
+Decide if the following email is a meeting/event invitation.
+If it is, extract event details. Return valid JSON only in this format:
+
+{{
+  "is_invitation": true|false,
+  "event_title": "<title>",
+  "event_location": "<location or city if mentioned>",
+  "event_time": "<time/date if available>"
+}}
+
+Email content:
+{text}
+"""
+    response = _invoke_llm(prompt, "parse_email")
+    cleaned = re.sub(r'```json\s*|\s*```', '', response).strip()
+    return json.loads(cleaned)
+
 # -------------------------------
 # Node Definitions
 # -------------------------------
@@ -154,7 +322,7 @@ def parse_user_emails_node(state: MessagesState):
     parses only those, updates the DB flag, and returns parsed invitations.
     """
     try:
-        from db import fetch_user_emails_from_db, write_parsed_email_to_db
+        from db import iter_user_emails_from_db, ParsedInvitationWriter
     except Exception as e:
         print(f"❌ Failed to import DB functions: {e}")
         return {"parsed_invitations": []}
@@ -164,48 +332,43 @@ def parse_user_emails_node(state: MessagesState):
         print("⚠️ No email entered. Skipping email parsing.")
         return {"parsed_invitations": []}
 
-    # Fetch all emails for the user
-    try:
-        emails = fetch_user_emails_from_db(user_email)
-    except Exception as db_error:
-        print(f"❌ Database fetch error: {db_error}")
-        return {"parsed_invitations": []}
-
-    if not emails:
-        print("📭 No emails found for this user.")
-        return {"parsed_invitations": []}
-
-    print(f"📬 Found {len(emails)} emails. Checking for invitations...")
+    # Stream the user's emails (server-side cursor) so memory stays flat for any mailbox size
+    emails = iter_user_emails_from_db(user_email)
+    print("📬 Checking emails for invitations...")
 
     parsed_invitations = []
+    seen = 0
+    queued = 0
+    # parsed invitations are written in batches while the LLM works through the mailbox
+    writer = ParsedInvitationWriter()
 
-    for email in emails:
+    while True:
         try:
-            text = f"{email.get('header', '')} {email.get('body', '')}".strip()
-
-            # Use LLM to detect & parse invitation emails
-            prompt = f"""
-Decide if the following email is a meeting/event invitation.
-If it is, extract event details. Return valid JSON only in this format:
-
-{{
-  "is_invitation": true|false,
-  "event_title": "<title>",
-  "event_location": "<location or city if mentioned>",
-  "event_time": "<time/date if available>"
-}}
-
-Email content:
-{text}
-"""
-            response = llm.invoke([HumanMessage(content=prompt)]).content
-            cleaned = re.sub(r'```json\s*|\s*```', '', response).strip()
-            parsed = json.loads(cleaned)
+            email = next(emails, None)
+        except Exception as db_error:
+            print(f"❌ Database fetch error: {db_error}")
+            break
+        if email is None:
+            break
+        seen += 1
+        if email.get("parsed"):
+            # parsed at ingestion (calendar invite) or in an earlier run: no LLM call needed
+            parsed_invitations.append({**email["parsed"], "emailid": email.get("emailid")})
+            continue
+        if email.get("classified"):
+            # the background classifier already decided this is not an invitation
+            continue
+        if email.get("queued"):
+            # the background classifier has it (pending or running); don't pay for a second LLM call
+            queued += 1
+            continue
+        try:
+            parsed = classify_email(email)
 
             # Only process if LLM determined it is an invitation
             if parsed.get("is_invitation"):
                 parsed["emailid"] = email.get("emailid")
-                write_parsed_email_to_db(email.get("emailid"), parsed)
+                writer.add((email.get("emailid"), parsed))
 
                 parsed_invitations.append(parsed)
                 print(f"✅ Parsed invitation: {parsed.get('event_title', 'No Title')}")
@@ -218,6 +381,14 @@ Email content:
         except Exception as e:
             print(f"⚠️ Error processing email {email.get('emailid')}: {e}")
 
+    writer.close()
+    if queued:
+        print(f"⏳ {queued} emails are still queued for background classification; they will appear once classified.")
+
+    if not seen:
+        print("📭 No emails found for this user.")
+        return {"parsed_invitations": []}
+
     print(parsed_invitations[:3])
 
     print(f"✅ Completed parsing. Total invitations parsed: {len(parsed_invitations)}")
@@ -248,6 +419,7 @@ def flight_data_node(state: MessagesState):
 def compute_best_flight(state: MessagesState):
     flights = state.get("flights", [])
     if not flights:
+        metrics.AGENT_RANKINGS.inc(outcome="no_flights")
         best_flight_dict = {"best_flight": []}
         chain.update_state(config, best_flight_dict, as_node="compute_best_flight")
         return best_flight_dict
@@ -297,7 +469,7 @@ Return ONLY valid JSON (no markdown) with this exact structure:
 """
 
     try:
-        response = llm.invoke([HumanMessage(content=prompt)]).content
+        response = _invoke_llm(prompt, "rank_flights")
         cleaned = re.sub(r'```json\s*|\s*```', '', response).strip()
         best_flights = json.loads(cleaned)
 
@@ -307,6 +479,7 @@ Return ONLY valid JSON (no markdown) with this exact structure:
         elif not isinstance(best_flights, list):
             raise ValueError("Unexpected JSON format returned from LLM")
 
+        metrics.AGENT_RANKINGS.inc(outcome="llm")
         print(f"✅ Best 3 flights found:")
         for i, f in enumerate(best_flights, start=1):
             print(f"  {i}. {f.get('airline', 'N/A')} - ${f.get('price', 'N/A')} - {f.get('duration', 'N/A')} - {f.get('route', 'N/A')}")
@@ -318,6 +491,7 @@ Return ONLY valid JSON (no markdown) with this exact structure:
         best_flights = sorted_flights[:3]
         for f in best_flights:
             f["reason"] = "Fallback: Cheapest available option"
+        metrics.AGENT_RANKINGS.inc(outcome="fallback")
 
     best_flight_dict = {"best_flight": best_flights}
     chain.update_state(config, best_flight_dict, as_node="compute_best_flight")
@@ -420,11 +594,13 @@ def run_flight_finder_agent_with_preferences(preferences: dict):
         "user_choice": "yes"
     }
 
+    start = time.perf_counter()
     try:
         # ✅ invoke from START (LangGraph automatically continues)
         final_state = chain.invoke(initial_state, config=config)
 
         print("✅ LangGraph chain executed successfully.")
+        metrics.AGENT_RUNS.inc(outcome="ok")
         return {
             "status": "ok",
             "best_flight": final_state.get("best_flight", []),
@@ -433,7 +609,10 @@ def run_flight_finder_agent_with_preferences(preferences: dict):
 
     except Exception as e:
         print(f"❌ Error running LangGraph chain: {e}")
+        metrics.AGENT_RUNS.inc(outcome="error")
         return {"status": "error", "message": str(e)}
+    finally:
+        metrics.AGENT_RUN_LATENCY.observe(time.perf_counter() - start)
 
     """
     🚀 Runs the entire LangGraph flight-finding workflow automatically
@@ -515,7 +694,7 @@ Return a JSON object with this structure:
 }}
 """
     try:
-        response = llm.invoke([HumanMessage(content=prompt)]).content
+        response = _invoke_llm(prompt, "reasoning")
         cleaned = re.sub(r'```json\s*|\s*```', '', response).strip()
         reasoning_json = json.loads(cleaned)
         return reasoning_json
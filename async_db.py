@@ -0,0 +1,260 @@
+"""
+Async data-access layer on asyncpg for the FastAPI routes.
+
+Queries run on a process-wide asyncpg pool created at app startup, so handlers
+are plain `async def` and never occupy the threadpool. asyncpg prepares every
+statement on first use and caches it per connection (`statement_cache_size`),
+so repeated queries skip parsing and planning.
+"""
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+from cachetools import TTLCache
+
+import metrics
+
+_pool = None
+
+# sessionid -> user row. Entries live at most SESSION_CACHE_TTL seconds, which bounds
+# how long another process's session delete can go unnoticed here. The lock is for
+# the session sweeper thread, which invalidates entries from outside the event loop.
+_session_cache = TTLCache(
+    maxsize=int(os.getenv("SESSION_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("SESSION_CACHE_TTL", 30)),
+)
+_session_cache_lock = threading.Lock()
+
+
+async def init_pool():
+    """Create the asyncpg pool (no-op if one is already installed)."""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            database=os.getenv("DB_NAME"),
+            port=int(os.getenv("DB_PORT", 5432)),
+            min_size=int(os.getenv("ASYNC_DB_POOL_MIN", 2)),
+            max_size=int(os.getenv("ASYNC_DB_POOL_MAX", 20)),
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256)),
+            max_inactive_connection_lifetime=float(os.getenv("ASYNC_DB_MAX_IDLE", 300)),
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("async DB pool is not initialised; call async_db.init_pool() at startup")
+    return _pool
+
+
+@asynccontextmanager
+async def connection():
+    """Borrow a pooled connection, recording how long acquisition took."""
+    start = time.perf_counter()
+    try:
+        conn = await get_pool().acquire(timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)))
+    except Exception:
+        metrics.DB_CONNECT_ERRORS.inc()
+        raise
+    finally:
+        metrics.DB_CONNECT_LATENCY.observe(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        await get_pool().release(conn)
+
+
+async def _run(method: str, query: str, *args):
+    async with connection() as conn:
+        op = metrics.sql_operation(query)
+        start = time.perf_counter()
+        try:
+            return await getattr(conn, method)(query, *args)
+        finally:
+            metrics.DB_QUERIES.inc(operation=op)
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - start, operation=op)
+
+
+async def _fetch(query: str, *args) -> List[Dict[str, Any]]:
+    return [dict(r) for r in await _run("fetch", query, *args)]
+
+
+async def _fetchrow(query: str, *args) -> Optional[Dict[str, Any]]:
+    row = await _run("fetchrow", query, *args)
+    return dict(row) if row else None
+
+
+# -------------------------------
+# Users
+# -------------------------------
+async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    return await _fetchrow("SELECT userid, email, name, password FROM users WHERE email = $1", email)
+
+
+async def create_user(email: str, name: str, password: str) -> Optional[int]:
+    """Insert a user; returns the new userid, or None if the email is taken."""
+    row = await _fetchrow(
+        "INSERT INTO users (email, name, password) VALUES ($1, $2, $3) ON CONFLICT (email) DO NOTHING RETURNING userid",
+        email, name, password,
+    )
+    return row["userid"] if row else None
+
+
+async def update_password(userid: int, new_hash: str, old_value: str) -> bool:
+    """Swap in a re-hashed password unless the row changed since it was read."""
+    status = await _run(
+        "execute",
+        "UPDATE users SET password = $2 WHERE userid = $1 AND password = $3",
+        userid, new_hash, old_value,
+    )
+    return status != "UPDATE 0"
+
+
+# -------------------------------
+# Emails
+# -------------------------------
+async def fetch_user_emails(user_email: str) -> List[Dict[str, Any]]:
+    return await _fetch(
+        """
+        SELECT e.emailid, e.sender, e.header, e.body
+        FROM emails e
+        JOIN users u ON e.userid = u.userid
+        WHERE u.email = $1
+        """,
+        user_email,
+    )
+
+
+async def fetch_parsed_invitations(userid: int) -> List[Dict[str, Any]]:
+    return await _fetch(
+        """
+        SELECT e.emailid, e.sender, e.header, e.body, p.event_title, p.event_location, p.event_time
+        FROM emails e
+        LEFT JOIN parsed_invitations p ON p.emailid = e.emailid
+        WHERE e.userid = $1 AND e.is_invitation = true
+        """,
+        userid,
+    )
+
+
+async def insert_email(userid: int, sender: str, header: str, body: str) -> int:
+    row = await _fetchrow(
+        "INSERT INTO emails (sender, header, body, userid) VALUES ($1, $2, $3, $4) RETURNING emailid",
+        sender, header, body, userid,
+    )
+    return row["emailid"]
+
+
+# -------------------------------
+# Sessions
+# -------------------------------
+async def create_session(userid: int, expires_at) -> int:
+    row = await _fetchrow(
+        "INSERT INTO sessions (userid, expires_at) VALUES ($1, $2) RETURNING sessionid",
+        userid, expires_at,
+    )
+    return row["sessionid"]
+
+
+def _session_live(user) -> bool:
+    expires_at = user.get("expires_at")
+    return expires_at is None or expires_at > datetime.now(timezone.utc)
+
+
+async def get_user_by_session(sessionid: int) -> Optional[Dict[str, Any]]:
+    """
+    Resolve a live session to its user, from the in-process cache when possible.
+    Expired sessions resolve to None; deleting them is left to the background sweeper.
+    """
+    with _session_cache_lock:
+        cached = _session_cache.get(sessionid)
+    if cached is not None and _session_live(cached):
+        metrics.record_cache("sessions", hit=True)
+        return dict(cached)
+    metrics.record_cache("sessions", hit=False)
+
+    user = await _fetchrow(
+        """
+        SELECT u.userid, u.name, u.email, s.expires_at
+        FROM sessions s JOIN users u ON s.userid = u.userid
+        WHERE s.sessionid = $1 AND (s.expires_at IS NULL OR s.expires_at > now())
+        """,
+        sessionid,
+    )
+    with _session_cache_lock:
+        if user is None:
+            _session_cache.pop(sessionid, None)
+        else:
+            _session_cache[sessionid] = user
+    return dict(user) if user else None
+
+
+def invalidate_session(sessionid: int):
+    with _session_cache_lock:
+        _session_cache.pop(sessionid, None)
+
+
+async def rotate_session(sessionid: int, userid: int, expires_at) -> Optional[Dict[str, Any]]:
+    """
+    Replace a live session with a new one in a single statement.
+
+    Returns the new session's `sessionid` with its user's `userid`, `name` and
+    `email`, or None if the session was expired, revoked or already rotated (so
+    a replayed refresh token cannot be used twice) or the user no longer exists.
+    """
+    invalidate_session(sessionid)
+    return await _fetchrow(
+        """
+        WITH old AS (
+            DELETE FROM sessions
+            WHERE sessionid = $1 AND userid = $2 AND (expires_at IS NULL OR expires_at > now())
+            RETURNING userid
+        ),
+        new AS (
+            INSERT INTO sessions (userid, expires_at) SELECT userid, $3 FROM old RETURNING sessionid, userid
+        )
+        SELECT new.sessionid, u.userid, u.name, u.email
+        FROM new JOIN users u ON u.userid = new.userid
+        """,
+        sessionid, userid, expires_at,
+    )
+
+
+async def delete_session(sessionid: int):
+    invalidate_session(sessionid)
+    await _run("execute", "DELETE FROM sessions WHERE sessionid = $1", sessionid)
+
+
+# -------------------------------
+# Flights
+# -------------------------------
+async def fetch_user_flights(userid: int) -> List[Dict[str, Any]]:
+    return await _fetch(
+        "SELECT flightid, departure, arrival, currency, price, airline FROM flights WHERE userid = $1",
+        userid,
+    )
+
+
+async def insert_flight(userid: int, departure: str, arrival: str, currency: str, price, airline: str) -> int:
+    row = await _fetchrow(
+        """
+        INSERT INTO flights (userid, departure, arrival, currency, price, airline)
+        VALUES ($1, $2, $3, $4, $5, $6) RETURNING flightid
+        """,
+        userid, departure, arrival, currency, price, airline,
+    )
+    return row["flightid"]
@@ -0,0 +1,95 @@
+"""
+Stateless signed-token authentication (PyJWT).
+
+Login issues a short-lived access token carrying the user id, email, session
+id and expiry, signed with HS256, and a longer-lived refresh token that
+references the same row in the `sessions` table. Refreshing checks that row
+and rotates it. Authenticated routes also check that the access token's
+session is still live, through `async_db`'s in-process session cache, so they
+usually skip the database and logout takes effect within the cache TTL.
+"""
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional
+
+import jwt
+from fastapi import Cookie, Header, HTTPException
+
+import async_db
+
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", 15 * 60))
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL_SECONDS", 30 * 24 * 3600))
+
+JWT_SECRET = os.getenv("JWT_SECRET")
+if not JWT_SECRET:
+    # tokens will not survive a restart or validate across replicas
+    print("⚠️ JWT_SECRET not set; using a random per-process signing key")
+    JWT_SECRET = secrets.token_urlsafe(48)
+
+
+class TokenError(Exception):
+    """The token is missing, malformed, expired, or of the wrong type."""
+
+
+def _encode(claims: Dict[str, Any], ttl: int) -> str:
+    now = int(time.time())
+    return jwt.encode({**claims, "iat": now, "exp": now + ttl}, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def issue_access_token(user: Dict[str, Any], sessionid: Optional[int] = None) -> str:
+    claims = {"sub": str(user["userid"]), "email": user.get("email"), "name": user.get("name"), "typ": "access"}
+    if sessionid is not None:
+        claims["sid"] = sessionid
+    return _encode(claims, ACCESS_TOKEN_TTL)
+
+
+def issue_refresh_token(userid: int, sessionid: int) -> str:
+    return _encode({"sub": str(userid), "sid": sessionid, "typ": "refresh"}, REFRESH_TOKEN_TTL)
+
+
+def decode_token(token: str, expected_type: str) -> Dict[str, Any]:
+    """Verify signature, expiry and token type; returns the claims."""
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "sub"]})
+    except jwt.PyJWTError as e:
+        raise TokenError(str(e))
+    if claims.get("typ") != expected_type:
+        raise TokenError(f"expected a {expected_type} token")
+    return claims
+
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    """Claims of a valid access token, or None."""
+    try:
+        return decode_token(token, "access")
+    except TokenError:
+        return None
+
+
+def _bearer(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return None
+
+
+async def current_user(
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = Cookie(None),
+) -> Dict[str, Any]:
+    """
+    FastAPI dependency: the authenticated user from `Authorization: Bearer` or
+    the access_token cookie, provided the token's session is still live.
+    """
+    token = _bearer(authorization) or access_token
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = decode_token(token, "access")
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}", headers={"WWW-Authenticate": "Bearer"})
+    user = await async_db.get_user_by_session(int(claims["sid"])) if claims.get("sid") is not None else None
+    if user is None or str(user["userid"]) != claims["sub"]:
+        raise HTTPException(status_code=401, detail="Session expired or revoked", headers={"WWW-Authenticate": "Bearer"})
+    return {"userid": user["userid"], "email": user["email"], "name": user["name"]}
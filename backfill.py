@@ -0,0 +1,262 @@
+"""
+Resumable historical mailbox backfill.
+
+Pages through `users.messages.list` for a Gmail search query and/or labels.
+Each page is fetched with batched requests (metadata triage first, then full
+bodies for candidates only; see gmail_api.py) and stored through
+`db.insert_emails_bulk`, which also queues the mail for classification.
+
+One thread lists pages and several worker threads fetch and store them in
+parallel. Every Gmail call is charged to a shared quota limiter, sized below
+Gmail's 250 units/user/second. The page token is checkpointed in
+`gmail_backfill_state` once every page before it has been stored. After an
+interruption, running the same command resumes from that point, and ids that
+are already stored are skipped before any fetch.
+
+Usage:
+    python backfill.py --query "after:2023/01/01 before:2024/01/01"
+    python backfill.py --label INBOX --workers 8 --quota 200
+    python backfill.py --query "subject:invitation" --max-messages 5000
+    python backfill.py --query "..." --restart      # drop the checkpoint and start over
+"""
+import argparse
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import db
+import gmail_api
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", 4))
+BACKFILL_QUOTA_UNITS = float(os.getenv("BACKFILL_QUOTA_UNITS", 200))
+BACKFILL_PAGE_SIZE = min(500, int(os.getenv("BACKFILL_PAGE_SIZE", 500)))
+BACKFILL_PROGRESS_INTERVAL = float(os.getenv("BACKFILL_PROGRESS_INTERVAL", 5))
+
+LIST_FIELDS = "messages/id,nextPageToken,resultSizeEstimate"
+
+
+def job_key(email_address: str, query: str, label_ids) -> str:
+    raw = "\x1f".join([email_address, query or "", ",".join(sorted(label_ids or []))])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def store_rows(rows) -> int:
+    """Bulk-insert fetched rows; calendar invites go to parsed_invitations in the same transaction."""
+    if not rows:
+        return 0
+    return len(db.insert_emails_bulk(rows))
+
+
+class _Checkpointer:
+    """Moves the stored page token forward only past a contiguous run of finished pages."""
+
+    def __init__(self, backfill, state):
+        self.backfill = backfill
+        self.page_token = state["page_token"] if state else None
+        self.pages_done = state["pages_done"] if state else 0
+        self.messages_done = state["messages_done"] if state else 0
+        self._next = 0
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def page_finished(self, index: int, next_token, stored: int):
+        with self._lock:
+            self._finished[index] = (next_token, stored)
+            if self._next not in self._finished:
+                return
+            while self._next in self._finished:
+                token, n = self._finished.pop(self._next)
+                self._next += 1
+                self.pages_done += 1
+                self.messages_done += n
+                self.page_token = token
+            b = self.backfill
+            db.save_gmail_backfill_state(
+                b.key, b.email_address, b.query, ",".join(b.label_ids), self.page_token,
+                self.pages_done, self.messages_done, completed=self.page_token is None and b.listing_done,
+            )
+
+
+class Backfill:
+    def __init__(self, email_address="me", query="", label_ids=None, workers=BACKFILL_WORKERS,
+                 quota_units=BACKFILL_QUOTA_UNITS, max_messages=None, service_factory=None):
+        self.email_address = email_address
+        self.query = query or ""
+        self.label_ids = list(label_ids or [])
+        self.workers = workers
+        self.limiter = gmail_api.QuotaLimiter(quota_units)
+        self.max_messages = max_messages
+        self.service_factory = service_factory or gmail_api.get_service
+        self.key = job_key(email_address, self.query, self.label_ids)
+
+        self.listing_done = False
+        self.capped = False  # stopped at max_messages with more mail left to list
+        self.listed = 0
+        self.skipped = 0
+        self.stored = 0
+        self.estimate = None
+        self.errors = []
+        self._stop = threading.Event()
+        self._counts_lock = threading.Lock()
+
+    # -------------------------------
+    # Stages
+    # -------------------------------
+    def _list_pages(self, pages: queue.Queue, start_token):
+        service = self.service_factory()
+        token, index = start_token, 0
+        try:
+            while not self._stop.is_set():
+                self.limiter.acquire(gmail_api.LIST_QUOTA_UNITS)
+                resp = service.users().messages().list(
+                    userId="me",
+                    q=self.query or None,
+                    labelIds=self.label_ids or None,
+                    maxResults=BACKFILL_PAGE_SIZE,
+                    pageToken=token,
+                    fields=LIST_FIELDS,
+                ).execute()
+                ids = [m["id"] for m in resp.get("messages", [])]
+                if self.estimate is None:
+                    self.estimate = resp.get("resultSizeEstimate")
+                next_token = resp.get("nextPageToken")
+                truncated = False
+                if self.max_messages is not None and self.listed + len(ids) >= self.max_messages:
+                    if self.listed + len(ids) > self.max_messages:
+                        # resume by re-listing this page; its stored ids are skipped before fetching
+                        ids = ids[: self.max_messages - self.listed]
+                        next_token, truncated = token, True
+                    self.capped = truncated or next_token is not None
+                self.listed += len(ids)
+                if next_token is None and not truncated:
+                    self.listing_done = True
+                pages.put((index, ids, next_token))
+                index += 1
+                token = next_token
+                if self.listing_done or self.capped:
+                    break
+        except Exception as e:
+            self.errors.append(e)
+            self._stop.set()
+        finally:
+            for _ in range(self.workers):
+                pages.put(None)
+
+    def _work(self, pages: queue.Queue, checkpoint: _Checkpointer):
+        # a worker must keep draining `pages` whatever fails, or the lister blocks on the full queue
+        try:
+            service = self.service_factory()
+        except Exception as e:
+            self.errors.append(e)
+            self._stop.set()
+        while True:
+            item = pages.get()
+            if item is None:
+                return
+            if self._stop.is_set():
+                continue  # drain without storing; the checkpoint stays before this page
+            index, ids, next_token = item
+            try:
+                new_ids = db.filter_new_gmail_ids(ids)
+                rows = gmail_api.fetch_email_rows(service, new_ids, self.limiter)
+                stored = store_rows(rows)
+                with self._counts_lock:
+                    self.skipped += len(ids) - len(new_ids)
+                    self.stored += stored
+                checkpoint.page_finished(index, next_token, stored)
+            except Exception as e:
+                print(f"❌ Page {index} failed: {type(e).__name__}: {e}")
+                self.errors.append(e)
+                self._stop.set()
+
+    def _report(self, started: float):
+        while not self._stop.wait(BACKFILL_PROGRESS_INTERVAL):
+            self._print_progress(started)
+
+    def _print_progress(self, started: float):
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        done = self.stored + self.skipped
+        total = f"/~{self.estimate}" if self.estimate else ""
+        print(f"📦 listed {self.listed}{total} | stored {self.stored} | already had {self.skipped} "
+              f"| {done / elapsed:.1f} msg/s | {elapsed:.0f}s")
+
+    # -------------------------------
+    # Driver
+    # -------------------------------
+    def run(self) -> bool:
+        """Run (or resume) the backfill; returns True once the whole range is stored."""
+        state = db.get_gmail_backfill_state(self.key)
+        if state and state["completed"]:
+            print(f"✅ Backfill already complete ({state['messages_done']} messages); use --restart to run again")
+            return True
+        if state:
+            print(f"⏯️ Resuming after {state['pages_done']} pages / {state['messages_done']} messages")
+
+        checkpoint = _Checkpointer(self, state)
+        pages = queue.Queue(maxsize=self.workers * 2)
+        started = time.perf_counter()
+
+        threads = [threading.Thread(target=self._list_pages, args=(pages, checkpoint.page_token), name="backfill-lister")]
+        threads += [
+            threading.Thread(target=self._work, args=(pages, checkpoint), name=f"backfill-worker-{i}")
+            for i in range(self.workers)
+        ]
+        reporter = threading.Thread(target=self._report, args=(started,), name="backfill-progress", daemon=True)
+        for t in threads:
+            t.start()
+        reporter.start()
+
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\n⏸️ Interrupted; finishing in-flight pages and saving the checkpoint...")
+            self._stop.set()
+            for t in threads:
+                t.join()
+        self._stop.set()
+
+        self._print_progress(started)
+        complete = not self.errors and self.listing_done and checkpoint.page_token is None
+        if complete:
+            db.save_gmail_backfill_state(
+                self.key, self.email_address, self.query, ",".join(self.label_ids), None,
+                checkpoint.pages_done, checkpoint.messages_done, completed=True,
+            )
+            print(f"✅ Backfill complete: {checkpoint.messages_done} messages stored in {checkpoint.pages_done} pages")
+        elif self.capped and not self.errors:
+            print(f"⏸️ Stopped at --max-messages {self.max_messages}; run the same command to continue "
+                  f"({checkpoint.pages_done} pages / {checkpoint.messages_done} messages so far)")
+        else:
+            print(f"💾 Checkpoint saved after {checkpoint.pages_done} pages; run the same command to resume")
+        return complete
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Backfill historical Gmail messages into PostgreSQL.")
+    parser.add_argument("--email", default="me", help="Mailbox address (checkpoint key)")
+    parser.add_argument("--query", default="", help="Gmail search query, e.g. 'after:2023/01/01'")
+    parser.add_argument("--label", action="append", dest="labels", help="Label id to include (repeatable)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="Parallel page workers")
+    parser.add_argument("--quota", type=float, default=BACKFILL_QUOTA_UNITS,
+                        help="Gmail quota units per second to use (per-user limit is 250)")
+    parser.add_argument("--max-messages", type=int,
+                        help="Stop after this many messages; the next run continues from there")
+    parser.add_argument("--restart", action="store_true", help="Discard the checkpoint and start from the newest mail")
+    args = parser.parse_args(argv)
+
+    backfill = Backfill(args.email, args.query, args.labels, args.workers, args.quota, args.max_messages)
+    if args.restart:
+        db.delete_gmail_backfill_state(backfill.key)
+    return 0 if backfill.run() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Load-test harness for the FastAPI server (see `python -m bench.loadtest --help`)."""
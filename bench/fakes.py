@@ -0,0 +1,379 @@
+"""
+Local stand-ins used by the load-test harness.
+
+- `ReplayGoogleSearch` replaces SerpAPI's `GoogleSearch` and replays a recorded
+  Google Flights response (or a deterministic synthetic one).
+- `FakeChatModel` replaces the `ChatOpenAI` instance in `agent.py` and answers
+  each of the agent's prompts with deterministic, well-formed JSON.
+- `SQLiteConnection` mimics the small slice of the psycopg2 API used by `db.py`
+  and `server.py` so the app can run without a Postgres server;
+  `SQLitePool` stands in for the `db.py` connection pool and
+  `AsyncSQLitePool` for the asyncpg pool in `async_db.py`.
+
+`install_fakes()` wires all of them into the already-importable app modules.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+from langchain_core.messages import AIMessage
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+# -------------------------------
+# SerpAPI
+# -------------------------------
+class ReplayGoogleSearch:
+    """Drop-in for `serpapi.google_search.GoogleSearch` that never leaves the process."""
+
+    cassette = None      # raw SerpAPI response to replay, if recorded
+    latency = 0.0        # seconds of simulated upstream latency per search
+    calls = 0
+
+    def __init__(self, params):
+        self.params = params
+
+    def get_dict(self):
+        type(self).calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.cassette is not None:
+            return self.cassette
+        return _synthetic_flights(self.params)
+
+
+def _synthetic_flights(params):
+    """Deterministic Google Flights-shaped response keyed on the search params."""
+    seed = "|".join(str(params.get(k)) for k in ("departure_id", "arrival_id", "outbound_date", "return_date"))
+    rng = random.Random(hashlib.sha1(seed.encode()).hexdigest())
+    airlines = ["KLM", "Delta", "Lufthansa", "Emirates", "easyJet", "Air France", "United", "IndiGo"]
+
+    def _flight():
+        return {
+            "airline": rng.choice(airlines),
+            "price": rng.randint(80, 1800),
+            "total_duration": rng.randint(60, 1200),
+        }
+
+    return {
+        "best_flights": [_flight() for _ in range(3)],
+        "other_flights": [_flight() for _ in range(12)],
+    }
+
+
+# -------------------------------
+# Chat model
+# -------------------------------
+_FLIGHT_LINE = re.compile(
+    r"^\d+\. Airline: (?P<airline>.*?), Price: \$(?P<price>[^,]*), Duration: (?P<duration>.*?), Route: (?P<route>.*)$",
+    re.MULTILINE,
+)
+
+
+class FakeChatModel:
+    """Deterministic replacement for `ChatOpenAI` covering the prompts used in `agent.py`."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def invoke(self, messages, *args, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = "\n".join(getattr(m, "content", str(m)) for m in messages)
+
+        if "Pick the three best flight options" in prompt:
+            flights = [m.groupdict() for m in _FLIGHT_LINE.finditer(prompt)]
+            flights.sort(key=lambda f: _to_float(f["price"]))
+            content = json.dumps([
+                {**f, "price": _to_float(f["price"]), "reason": "Cheapest option matching the preferences"}
+                for f in flights[:3]
+            ])
+        elif "meeting/event invitation" in prompt:
+            is_invitation = "invitation" in prompt.split("Email content:", 1)[-1].lower()
+            content = json.dumps({
+                "is_invitation": is_invitation,
+                "event_title": "Benchmark meeting" if is_invitation else "",
+                "event_location": "Amsterdam" if is_invitation else "",
+                "event_time": "2025-12-25" if is_invitation else "",
+            })
+        else:
+            content = json.dumps({"reasoning_steps": ["Lowest price within budget."]})
+
+        tokens_in = len(prompt) // 4
+        tokens_out = len(content) // 4
+        return AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": tokens_in, "output_tokens": tokens_out, "total_tokens": tokens_in + tokens_out},
+        )
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+# -------------------------------
+# SQLite database
+# -------------------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    userid INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    email VARCHAR(150) UNIQUE NOT NULL,
+    bookings INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS emails (
+    emailid INTEGER PRIMARY KEY AUTOINCREMENT,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    sender VARCHAR(150) NOT NULL,
+    header VARCHAR(255),
+    body TEXT,
+    is_invitation BOOLEAN DEFAULT FALSE
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    sessionid INTEGER PRIMARY KEY AUTOINCREMENT,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    emailid INTEGER REFERENCES emails(emailid) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP,
+    user_preferences TEXT DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS parsed_invitations (
+    emailid INTEGER PRIMARY KEY REFERENCES emails(emailid) ON DELETE CASCADE,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    event_title TEXT,
+    event_location TEXT,
+    event_time TEXT,
+    details TEXT DEFAULT '{}',
+    parsed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS flights (
+    flightid INTEGER PRIMARY KEY AUTOINCREMENT,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    departure VARCHAR(10),
+    arrival VARCHAR(10),
+    currency VARCHAR(10),
+    price NUMERIC(10,2),
+    airline VARCHAR(100)
+);
+"""
+
+BENCH_PASSWORD = "bench-password"
+
+
+class SQLiteCursor:
+    """psycopg2-style cursor over sqlite3: `%s` placeholders, Postgres casts stripped."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        query = re.sub(r"::\w+", "", query).replace("%s", "?")
+        return self._cursor.execute(query, tuple(params or ()))
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self, *args, **kwargs):
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLitePool:
+    """Stand-in for `db.ConnectionPool`: one short-lived SQLite connection per checkout."""
+
+    def __init__(self, path):
+        self.path = path
+        self.in_use = 0
+
+    def getconn(self):
+        self.in_use += 1
+        return SQLiteConnection(self.path)
+
+    def putconn(self, conn, close=False):
+        self.in_use -= 1
+        conn.close()
+
+    def stats(self):
+        return {"backend": "sqlite", "in_use": self.in_use}
+
+    def closeall(self):
+        pass
+
+
+class AsyncSQLiteConnection:
+    """asyncpg-style connection over sqlite3: `$n` placeholders, queries run in a worker thread."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _run(self, query, args, method):
+        order = [int(n) - 1 for n in re.findall(r"\$(\d+)", query)]
+        query = re.sub(r"\$\d+", "?", query).replace("now()", "CURRENT_TIMESTAMP")
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            cur = conn.execute(query, [args[i] for i in order])
+            result = cur.fetchall() if method == "fetch" else cur.fetchone() if method == "fetchrow" else "OK"
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    async def fetch(self, query, *args):
+        return await asyncio.to_thread(self._run, query, args, "fetch")
+
+    async def fetchrow(self, query, *args):
+        return await asyncio.to_thread(self._run, query, args, "fetchrow")
+
+    async def execute(self, query, *args):
+        return await asyncio.to_thread(self._run, query, args, "execute")
+
+
+class AsyncSQLitePool:
+    """Stand-in for the asyncpg pool used by `async_db.py`."""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def acquire(self, timeout=None):
+        return AsyncSQLiteConnection(self.path)
+
+    async def release(self, conn):
+        pass
+
+    async def close(self):
+        pass
+
+
+def create_sqlite_db(path=None, users=50, emails_per_user=20):
+    """Create and seed a throwaway SQLite database. Returns its path."""
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="aiso_bench_", suffix=".sqlite3")
+        os.close(fd)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (userid, name, password, email) VALUES (?, ?, ?, ?)",
+        [(i, f"Bench User {i}", BENCH_PASSWORD, bench_email(i)) for i in range(1, users + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO emails (userid, sender, header, body, is_invitation) VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                uid,
+                "bot@flightai.com",
+                f"Meeting Invitation #{n}" if n % 3 == 0 else f"Newsletter #{n}",
+                "Join us for a meeting in Amsterdam next week!" if n % 3 == 0 else "Nothing to see here.",
+                n % 3 == 0,
+            )
+            for uid in range(1, users + 1)
+            for n in range(emails_per_user)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def bench_email(i: int) -> str:
+    return f"bench{i}@example.com"
+
+
+# -------------------------------
+# Wiring
+# -------------------------------
+def _alias_repo_package():
+    """`agent.py` imports `AISO_Hackathon.fetch_flight_data`; make that resolvable from any checkout."""
+    try:
+        __import__("AISO_Hackathon.fetch_flight_data")
+    except ImportError:
+        pkg = types.ModuleType("AISO_Hackathon")
+        pkg.__path__ = [str(REPO_ROOT)]
+        sys.modules["AISO_Hackathon"] = pkg
+
+
+def install_fakes(db: str = "sqlite", sqlite_path=None, serpapi_cassette=None,
+                  serpapi_latency: float = 0.0, llm_latency: float = 0.0):
+    """
+    Import the app with every external dependency replaced by a local stand-in.
+
+    Args:
+        db (str): "sqlite" for a seeded throwaway database, "postgres" to use the
+            `DB_*` environment variables (schema from init_db.py must exist).
+        sqlite_path (str, optional): Existing SQLite file to reuse.
+        serpapi_cassette (str, optional): Path to a recorded SerpAPI JSON response.
+        serpapi_latency (float): Simulated upstream latency per search, in seconds.
+        llm_latency (float): Simulated model latency per call, in seconds.
+
+    Returns:
+        module: The imported `server` module (its `app` is ready to serve).
+    """
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+    if db == "sqlite":
+        # the session sweeper's DELETE ... FOR UPDATE SKIP LOCKED is Postgres-only
+        os.environ.setdefault("SESSION_SWEEP_INTERVAL", "0")
+    _alias_repo_package()
+
+    ReplayGoogleSearch.latency = serpapi_latency
+    if serpapi_cassette:
+        ReplayGoogleSearch.cassette = json.loads(Path(serpapi_cassette).read_text())
+
+    import server
+    import agent
+
+    for name, module in list(sys.modules.items()):
+        if name.endswith("fetch_flight_data") and hasattr(module, "GoogleSearch"):
+            module.GoogleSearch = ReplayGoogleSearch
+
+    agent.llm = FakeChatModel(latency=llm_latency)
+
+    if db == "sqlite":
+        import db as db_module
+
+        import async_db
+
+        path = sqlite_path or create_sqlite_db()
+        db_module._pool = SQLitePool(path)
+        async_db._pool = AsyncSQLitePool(path)
+        # search-result persistence uses execute_values, which needs a real psycopg2 cursor
+        agent.upsert_flight_results = lambda flights: 0
+
+    return server
@@ -0,0 +1,377 @@
+"""
+In-process stand-ins for Gmail and Pub/Sub, used by the ingestion benchmark.
+
+- `SyntheticMailbox` generates a deterministic mailbox: newsletters,
+  invitation-looking mail and calendar invites with inline `.ics` parts, each
+  delivery bumping the mailbox historyId like Gmail does.
+- `FakeGmailService` answers the slice of the Gmail API that `sub.py`,
+  `gmail_api.py` and `backfill.py` call (`messages.get/list`, batch requests,
+  `history.list`, `getProfile`, `attachments.get`, `watch`) from a mailbox,
+  with optional simulated latency per HTTP round trip.
+- `FakeSubscriber` replaces `pubsub_v1.SubscriberClient`: it delivers
+  published notifications to the callback through the real scheduler,
+  honours `FlowControl.max_messages` and redelivers nacked messages.
+"""
+import base64
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+_SENDERS = ["events@meetup.com", "news@airline.example", "team@company.example", "noreply@shop.example"]
+_NEWSLETTER_SUBJECTS = ["Weekly digest", "Your order has shipped", "Security alert", "Monthly newsletter"]
+_INVITE_SUBJECTS = ["Invitation: Product summit", "Workshop invitation", "Conference agenda", "Team offsite"]
+_CITIES = ["Amsterdam", "Berlin", "Lisbon", "New York", "Tokyo", "Budapest"]
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _http_error(status: int, message: str) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), json.dumps({"error": {"message": message}}).encode())
+
+
+# -------------------------------
+# Mailbox
+# -------------------------------
+class SyntheticMailbox:
+    """
+    A generated Gmail mailbox.
+
+    Args:
+        email_address (str): Address reported by getProfile and in notifications.
+        invitation_ratio (float): Share of messages that look like invitations.
+        ics_ratio (float): Share of invitations that carry a text/calendar part.
+        body_chars (int): Approximate size of each plain-text body.
+        seed (int): RNG seed; the same seed yields the same mailbox.
+    """
+
+    def __init__(self, email_address: str, invitation_ratio: float = 0.2, ics_ratio: float = 0.5,
+                 body_chars: int = 2000, seed: int = 0):
+        self.email_address = email_address
+        self.invitation_ratio = invitation_ratio
+        self.ics_ratio = ics_ratio
+        self.body_chars = body_chars
+        self.history_id = 1000
+        self.messages = {}          # id -> full message resource
+        self.order = []             # ids, oldest first
+        self.history = []           # (historyId, message id)
+        self._rng = random.Random(seed)
+        self._prefix = hashlib.sha1(f"{email_address}|{seed}".encode()).hexdigest()[:8]
+        self._lock = threading.Lock()
+
+    def deliver(self, count: int = 1) -> int:
+        """Add `count` new INBOX messages; returns the mailbox historyId afterwards."""
+        with self._lock:
+            for _ in range(count):
+                self.history_id += 1
+                message = self._generate(len(self.order))
+                self.messages[message["id"]] = message
+                self.order.append(message["id"])
+                self.history.append((self.history_id, message["id"]))
+            return self.history_id
+
+    def _generate(self, n: int):
+        rng = self._rng
+        msg_id = f"{self._prefix}{n:08x}"
+        invitation = rng.random() < self.invitation_ratio
+        city = rng.choice(_CITIES)
+        subject = f"{rng.choice(_INVITE_SUBJECTS if invitation else _NEWSLETTER_SUBJECTS)} #{n}"
+        filler = f"Join us in {city} next month. " if invitation else "Here is what happened this week. "
+        text = (filler * (self.body_chars // len(filler) + 1))[: self.body_chars]
+        headers = [
+            {"name": "From", "value": rng.choice(_SENDERS)},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": "Mon, 1 Dec 2025 09:00:00 +0000"},
+        ]
+        parts = [
+            {"mimeType": "text/plain", "filename": "", "headers": [], "body": {"data": _b64(text)}},
+            {"mimeType": "text/html", "filename": "", "headers": [], "body": {"data": _b64(f"<p>{text}</p>")}},
+        ]
+        content_type = "multipart/alternative"
+        if invitation and rng.random() < self.ics_ratio:
+            ics = (
+                "BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\n"
+                f"SUMMARY:{subject}\r\nLOCATION:{city}\r\n"
+                f"DTSTART:2025{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}T090000Z\r\n"
+                "DTEND:20251231T170000Z\r\nORGANIZER:mailto:events@meetup.com\r\n"
+                "END:VEVENT\r\nEND:VCALENDAR\r\n"
+            )
+            parts.append({"mimeType": "text/calendar", "filename": "invite.ics", "headers": [], "body": {"data": _b64(ics)}})
+            content_type = "multipart/mixed"
+        headers.append({"name": "Content-Type", "value": f'{content_type}; boundary="b{n:x}"'})
+        return {
+            "id": msg_id,
+            "threadId": msg_id,
+            "labelIds": ["INBOX", "UNREAD"],
+            "snippet": text[:120],
+            "payload": {"mimeType": content_type, "filename": "", "headers": headers, "parts": parts},
+        }
+
+
+# -------------------------------
+# Gmail API
+# -------------------------------
+class _Request:
+    """One API call; `execute()` returns the response or raises like the discovery client."""
+
+    def __init__(self, service, fn):
+        self._service = service
+        self._fn = fn
+
+    def resolve(self):
+        try:
+            return self._fn(), None
+        except HttpError as e:
+            return None, e
+
+    def execute(self):
+        self._service.round_trip()
+        response, exception = self.resolve()
+        if exception is not None:
+            raise exception
+        return response
+
+
+class _Batch:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None):
+        if len(self._requests) >= 100:
+            raise ValueError("Gmail batch requests are limited to 100 calls")
+        self._requests.append((request_id or str(len(self._requests)), request))
+
+    def execute(self):
+        self._service.round_trip()
+        for request_id, request in self._requests:
+            response, exception = request.resolve()
+            self._callback(request_id, response, exception)
+
+
+class _Resource:
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeGmailService:
+    """
+    Gmail `service` object backed by a `SyntheticMailbox`.
+
+    Args:
+        mailbox (SyntheticMailbox): Mailbox served as userId "me".
+        latency (float): Seconds slept per HTTP round trip (one per batch).
+        history_retention (int, optional): history.list answers 404 for a
+            startHistoryId older than this many records, like expired history.
+    """
+
+    def __init__(self, mailbox: SyntheticMailbox, latency: float = 0.0, history_retention: int = None):
+        self.mailbox = mailbox
+        self.latency = latency
+        self.history_retention = history_retention
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def users(self):
+        return _Resource(
+            messages=lambda: _Resource(
+                get=self._get,
+                list=self._list,
+                attachments=lambda: _Resource(get=self._attachment),
+            ),
+            history=lambda: _Resource(list=self._history),
+            getProfile=lambda userId="me": _Request(self, self._profile),
+            watch=lambda userId="me", body=None: _Request(
+                self, lambda: {"historyId": str(self.mailbox.history_id), "expiration": "0"}
+            ),
+        )
+
+    # --- users.getProfile ---
+    def _profile(self):
+        mb = self.mailbox
+        return {"emailAddress": mb.email_address, "messagesTotal": len(mb.order), "historyId": str(mb.history_id)}
+
+    # --- users.messages.get ---
+    def _get(self, userId="me", id=None, format="full", metadataHeaders=None, fields=None):
+        def _fn():
+            message = self.mailbox.messages.get(id)
+            if message is None:
+                raise _http_error(404, "Requested entity was not found.")
+            if format != "metadata":
+                return message
+            wanted = set(metadataHeaders or [])
+            headers = [h for h in message["payload"]["headers"] if not wanted or h["name"] in wanted]
+            return {
+                "id": message["id"],
+                "threadId": message["threadId"],
+                "labelIds": message["labelIds"],
+                "snippet": message["snippet"],
+                "payload": {"headers": headers},
+            }
+        return _Request(self, _fn)
+
+    # --- users.messages.list (newest first) ---
+    def _list(self, userId="me", q=None, labelIds=None, maxResults=100, pageToken=None, fields=None):
+        def _fn():
+            ids = self.mailbox.order[::-1]
+            start = int(pageToken or 0)
+            end = start + min(int(maxResults or 100), 500)
+            resp = {"messages": [{"id": m, "threadId": m} for m in ids[start:end]], "resultSizeEstimate": len(ids)}
+            if end < len(ids):
+                resp["nextPageToken"] = str(end)
+            return resp
+        return _Request(self, _fn)
+
+    # --- users.messages.attachments.get ---
+    def _attachment(self, userId="me", messageId=None, id=None, fields=None):
+        return _Request(self, lambda: {"data": ""})
+
+    # --- users.history.list ---
+    def _history(self, userId="me", startHistoryId=None, historyTypes=None, labelId=None, pageToken=None,
+                 maxResults=100):
+        def _fn():
+            mb = self.mailbox
+            start = int(startHistoryId)
+            with mb._lock:
+                # snapshot records and the reported historyId together, or a concurrent
+                # delivery could be covered by the checkpoint without being listed
+                records = [(h, m) for h, m in mb.history if h > start]
+                history_id = mb.history_id
+            if self.history_retention is not None and len(records) > self.history_retention:
+                raise _http_error(404, "Requested entity was not found.")
+            offset = int(pageToken or 0)
+            page = records[offset:offset + maxResults]
+            resp = {
+                "history": [{"id": str(h), "messagesAdded": [{"message": {"id": m, "threadId": m}}]} for h, m in page],
+                "historyId": str(history_id),
+            }
+            if offset + maxResults < len(records):
+                resp["nextPageToken"] = str(offset + maxResults)
+            return resp
+        return _Request(self, _fn)
+
+
+# -------------------------------
+# Pub/Sub
+# -------------------------------
+class FakeMessage:
+    """Subset of `pubsub_v1.subscriber.message.Message` used by `sub.py`."""
+
+    def __init__(self, subscriber, data: bytes, message_id: str):
+        self.data = data
+        self.message_id = message_id
+        self.publish_time = datetime.now(timezone.utc)
+        self.delivery_attempt = 0
+        self.leased_at = None
+        self._subscriber = subscriber
+
+    def ack(self):
+        self._subscriber._settle(self, acked=True)
+
+    def nack(self):
+        self._subscriber._settle(self, acked=False)
+
+
+class _StreamingPullFuture:
+    def __init__(self, subscriber):
+        self._subscriber = subscriber
+        self._done = threading.Event()
+
+    def cancel(self):
+        self._subscriber._stop.set()
+        self._done.set()
+
+    def result(self, timeout=None):
+        self._done.wait(timeout)
+
+
+class FakeSubscriber:
+    """
+    Stand-in for `pubsub_v1.SubscriberClient`.
+
+    `publish()` queues a notification; `subscribe()` starts a dispatcher thread
+    that leases messages up to `flow_control.max_messages` and hands them to the
+    scheduler. Nacked messages go back on the queue, as with a real subscription.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+        self._slots = None
+        self._count = 0
+        self.acked = 0
+        self.nacked = 0
+        self.handling_seconds = []   # lease-to-ack time of each acked message
+
+    def subscription_path(self, project, subscription):
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    def publish(self, payload: dict):
+        with self._lock:
+            self._count += 1
+            self._outstanding += 1
+            message = FakeMessage(self, json.dumps(payload).encode("utf-8"), str(self._count))
+        self._queue.put(message)
+        return message.message_id
+
+    def subscribe(self, subscription, callback, flow_control=None, scheduler=None):
+        max_messages = getattr(flow_control, "max_messages", None) or 1000
+        self._slots = threading.BoundedSemaphore(max_messages)
+        future = _StreamingPullFuture(self)
+
+        def _dispatch():
+            while not self._stop.is_set():
+                try:
+                    message = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                self._slots.acquire()
+                message.delivery_attempt += 1
+                message.leased_at = time.perf_counter()
+                if scheduler is not None:
+                    scheduler.schedule(callback, message)
+                else:
+                    callback(message)
+            if scheduler is not None:
+                scheduler.shutdown(await_msg_callbacks=True)
+
+        threading.Thread(target=_dispatch, name="fake-pubsub-dispatch", daemon=True).start()
+        return future
+
+    def _settle(self, message, acked: bool):
+        self._slots.release()
+        if not acked:
+            with self._lock:
+                self.nacked += 1
+            self._queue.put(message)
+            return
+        with self._idle:
+            self.acked += 1
+            self.handling_seconds.append(time.perf_counter() - message.leased_at)
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Block until every published message has been acked."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._outstanding == 0, timeout)
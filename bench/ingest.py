@@ -0,0 +1,192 @@
+"""
+Gmail ingestion throughput benchmark.
+
+Runs the real `sub.py` pipeline end to end into Postgres (`DB_*` environment
+variables, migrations applied): Pub/Sub notification, history.list, batched
+triage and full fetches, bulk insert and classification enqueue. Gmail and
+Pub/Sub are replaced by the in-process stand-ins in `bench/gmail_fakes.py`,
+so no Google project or token is needed.
+
+For each concurrency level (callback worker threads), every synthetic mailbox
+receives `--rounds` deliveries of `--batch` messages, each followed by a
+notification. The backlog is then drained and the run reports stored
+messages/second, notifications/second and notification handling latency.
+Each run uses fresh mailbox addresses and message ids, and removes its rows
+afterwards unless `--keep` is given.
+
+Examples:
+    python -m bench.ingest --concurrency 1,4,8,16
+    python -m bench.ingest --mailboxes 32 --rounds 10 --batch 20 --gmail-latency 0.15
+    python -m bench.ingest --concurrency 8 --output ingest_results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import db  # noqa: E402
+import sub  # noqa: E402
+from bench.gmail_fakes import FakeGmailService, FakeSubscriber, SyntheticMailbox  # noqa: E402
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _cleanup(addresses, msg_ids):
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM emails WHERE gmail_msg_id = ANY(%s)", (msg_ids,))
+            cur.execute("DELETE FROM gmail_sync_state WHERE email_address = ANY(%s)", (addresses,))
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def run_level(opts, concurrency: int) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    mailboxes = {}
+    for i in range(opts.mailboxes):
+        address = f"bench-{run_id}-{i}@example.com"
+        mailboxes[address] = SyntheticMailbox(
+            address, invitation_ratio=opts.invitation_ratio, ics_ratio=opts.ics_ratio,
+            body_chars=opts.body_chars, seed=opts.seed + i,
+        )
+        # baseline checkpoint, so the run measures incremental sync rather than a full resync
+        db.save_gmail_history_id(address, mailboxes[address].history_id)
+
+    services = {addr: FakeGmailService(mb, latency=opts.gmail_latency) for addr, mb in mailboxes.items()}
+    subscriber = FakeSubscriber()
+    log = io.StringIO()
+
+    with contextlib.redirect_stdout(sys.stdout if opts.verbose else log):
+        future = sub.start_subscriber(
+            subscriber, "projects/bench/subscriptions/bench", services.__getitem__,
+            workers=concurrency, max_messages=concurrency * 2,
+        )
+        start = time.perf_counter()
+        for _ in range(opts.rounds):
+            for address, mailbox in mailboxes.items():
+                history_id = mailbox.deliver(opts.batch)
+                subscriber.publish({"emailAddress": address, "historyId": history_id})
+        drained = subscriber.wait_idle(timeout=opts.timeout)
+        elapsed = time.perf_counter() - start
+        future.cancel()
+
+    msg_ids = [m for mb in mailboxes.values() for m in mb.order]
+    missing = db.filter_new_gmail_ids(msg_ids)
+    stored = len(msg_ids) - len(missing)
+    if not opts.keep:
+        _cleanup(list(mailboxes), msg_ids)
+
+    handling = sorted(subscriber.handling_seconds)
+    return {
+        "concurrency": concurrency,
+        "drained": drained,
+        "elapsed_s": round(elapsed, 3),
+        "notifications": subscriber.acked,
+        "nacks": subscriber.nacked,
+        "messages": len(msg_ids),
+        "stored": stored,
+        "messages_per_s": stored / elapsed if elapsed else 0.0,
+        "notifications_per_s": subscriber.acked / elapsed if elapsed else 0.0,
+        "gmail_round_trips": sum(s.round_trips for s in services.values()),
+        "handling_ms": {
+            "p50": _ms(_percentile(handling, 50)),
+            "p95": _ms(_percentile(handling, 95)),
+            "max": _ms(handling[-1] if handling else None),
+        },
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:,.1f}"
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_report(result):
+    meta = result["meta"]
+    print(f"\n📊 ingest | {meta['mailboxes']} mailboxes × {meta['rounds']} rounds × {meta['batch']} msgs "
+          f"| gmail latency {meta['gmail_latency_s']}s | commit {meta['git_commit']}")
+    header = f"{'workers':>7} {'stored':>8} {'msg/s':>9} {'notif/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'nacks':>6} {'RTs':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in result["levels"]:
+        flag = "" if r["drained"] and r["stored"] == r["messages"] else "  ⚠️ incomplete"
+        print(f"{r['concurrency']:>7} {r['stored']:>8} {_fmt(r['messages_per_s']):>9} {_fmt(r['notifications_per_s']):>9} "
+              f"{_fmt(r['handling_ms']['p50']):>9} {_fmt(r['handling_ms']['p95']):>9} {r['nacks']:>6} "
+              f"{r['gmail_round_trips']:>6}{flag}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--concurrency", default="1,4,8", help="Comma-separated callback worker counts to run")
+    p.add_argument("--mailboxes", type=int, default=16, help="Synthetic mailboxes (syncs of one mailbox are serialised)")
+    p.add_argument("--rounds", type=int, default=5, help="Deliveries (and notifications) per mailbox")
+    p.add_argument("--batch", type=int, default=10, help="Messages per delivery")
+    p.add_argument("--invitation-ratio", type=float, default=0.2, help="Share of invitation-looking messages")
+    p.add_argument("--ics-ratio", type=float, default=0.5, help="Share of invitations carrying a calendar part")
+    p.add_argument("--body-chars", type=int, default=2000, help="Plain-text body size per message")
+    p.add_argument("--gmail-latency", type=float, default=0.0, help="Simulated seconds per Gmail HTTP round trip")
+    p.add_argument("--timeout", type=float, default=600.0, help="Give up draining a level after this many seconds")
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--keep", action="store_true", help="Keep the benchmark's emails and sync state")
+    p.add_argument("--verbose", action="store_true", help="Show sub.py's per-notification output")
+    p.add_argument("--output", help="Where to write the JSON results")
+    opts = p.parse_args(argv)
+    opts.concurrency = [int(c) for c in opts.concurrency.split(",") if c.strip()]
+    return opts
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    levels = []
+    for concurrency in opts.concurrency:
+        print(f"⏱️ Running with {concurrency} workers...")
+        levels.append(run_level(opts, concurrency))
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "mailboxes": opts.mailboxes,
+            "rounds": opts.rounds,
+            "batch": opts.batch,
+            "gmail_latency_s": opts.gmail_latency,
+            "triage": sub.gmail_api.TRIAGE_ENABLED,
+        },
+        "levels": levels,
+    }
+    print_report(result)
+    if opts.output:
+        Path(opts.output).write_text(json.dumps(result, indent=2))
+        print(f"\n✅ Results saved to {opts.output}")
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,304 @@
+"""
+Concurrent load test for the FastAPI server.
+
+Boots `server.app` in-process against local stand-ins (see `bench/fakes.py`),
+or targets a running deployment with `--url`, drives a weighted mix of
+requests from N concurrent virtual users and reports throughput, latency
+percentiles and error rates per scenario. Results are written as JSON so
+runs can be compared with `--baseline`.
+
+Examples:
+    python -m bench.loadtest --concurrency 50 --duration 30
+    python -m bench.loadtest --scenarios search,login --serpapi-latency 0.4 --output bench_results.json
+    python -m bench.loadtest --baseline bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from bench.fakes import BENCH_PASSWORD, REPO_ROOT, bench_email, install_fakes
+
+ROUTES = ["BUD-LIN", "AMS-ATL", "AMS-JFK", "DEL-AMS", "LHR-BCN", "CDG-NRT"]
+
+
+# -------------------------------
+# Scenarios
+# -------------------------------
+def _route(rng):
+    dep, arr = rng.choice(ROUTES).split("-")
+    return {
+        "departure_airport": dep,
+        "arrival_airport": arr,
+        "date": f"2025-12-{rng.randint(1, 28):02d}",
+        "days": rng.randint(3, 14),
+        "currency": "USD",
+        "budget": rng.choice([500, 1000, 9999]),
+    }
+
+
+async def _search(client, rng, opts, headers):
+    return await client.post("/api/flights/search", json=_route(rng), headers=headers)
+
+
+async def _preferences(client, rng, opts, headers):
+    return await client.post("/api/preferences", json=_route(rng), headers=headers)
+
+
+async def _invitations(client, rng, opts, headers):
+    return await client.get("/api/invitations", params={"user_id": str(rng.randint(1, opts.users))}, headers=headers)
+
+
+async def _signup(client, rng, opts, headers):
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    return await client.post("/api/auth/signup", json={"email": email, "name": "Bench Signup", "password": BENCH_PASSWORD}, headers=headers)
+
+
+async def _login(client, rng, opts, headers):
+    email = bench_email(rng.randint(1, opts.users))
+    return await client.post("/api/auth/login", json={"email": email, "password": BENCH_PASSWORD}, headers=headers)
+
+
+SCENARIOS = {
+    "search": (_search, 5),
+    "preferences": (_preferences, 1),
+    "invitations": (_invitations, 3),
+    "signup": (_signup, 1),
+    "login": (_login, 3),
+}
+
+
+# -------------------------------
+# Driver
+# -------------------------------
+def _identity(opts, seed):
+    """
+    A signed access token per virtual user, so per-user admission limits apply
+    as in production. Against `--url` the server's JWT secret is unknown, so
+    requests go unauthenticated and admission keys them by client address.
+    """
+    if opts.url:
+        return {}
+    import auth_tokens
+
+    return {"Authorization": "Bearer " + auth_tokens.issue_access_token({"userid": seed, "name": f"bench-vu-{seed}"})}
+
+
+async def _virtual_user(client, scenarios, weights, opts, deadline, budget, samples, seed):
+    rng = random.Random(seed)
+    headers = _identity(opts, seed)
+    while time.perf_counter() < deadline:
+        if budget is not None:
+            if budget["left"] <= 0:
+                return
+            budget["left"] -= 1
+        name = rng.choices(scenarios, weights)[0]
+        start = time.perf_counter()
+        try:
+            resp = await SCENARIOS[name][0](client, rng, opts, headers)
+            ok = resp.status_code < 400
+            status = resp.status_code
+        except Exception as e:
+            ok = False
+            status = type(e).__name__
+        samples[name].append((time.perf_counter() - start, ok, status))
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _summarize(samples, elapsed):
+    latencies = sorted(s[0] for s in samples)
+    errors = [s for s in samples if not s[1]]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[2])] = statuses.get(str(s[2]), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_rate": (len(errors) / len(samples)) if samples else 0.0,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": (sum(latencies) / len(latencies) * 1000) if latencies else None,
+            "p50": _ms(_percentile(latencies, 50)),
+            "p95": _ms(_percentile(latencies, 95)),
+            "p99": _ms(_percentile(latencies, 99)),
+            "max": _ms(latencies[-1] if latencies else None),
+        },
+        "status_codes": statuses,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+async def run(opts):
+    scenarios = opts.scenarios
+    weights = [SCENARIOS[s][1] for s in scenarios]
+
+    if opts.url:
+        app = None
+        transport = None
+        base_url = opts.url
+    else:
+        server = install_fakes(
+            db=opts.db,
+            sqlite_path=opts.sqlite_path,
+            serpapi_cassette=opts.serpapi_cassette,
+            serpapi_latency=opts.serpapi_latency,
+            llm_latency=opts.llm_latency,
+        )
+        app = server.app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+
+    samples = {s: [] for s in scenarios}
+    budget = {"left": opts.requests} if opts.requests else None
+    limits = httpx.Limits(max_connections=opts.concurrency, max_keepalive_connections=opts.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=opts.timeout, limits=limits) as client:
+        lifespan = app.router.lifespan_context(app) if app is not None else None
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            if opts.warmup:
+                warm_deadline = time.perf_counter() + opts.warmup
+                await asyncio.gather(*[
+                    _virtual_user(client, scenarios, weights, opts, warm_deadline, None, {s: [] for s in scenarios}, -i)
+                    for i in range(opts.concurrency)
+                ])
+
+            start = time.perf_counter()
+            deadline = start + opts.duration
+            await asyncio.gather(*[
+                _virtual_user(client, scenarios, weights, opts, deadline, budget, samples, opts.seed + i)
+                for i in range(opts.concurrency)
+            ])
+            elapsed = time.perf_counter() - start
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    all_samples = [s for per in samples.values() for s in per]
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "target": opts.url or "in-process",
+            "db": None if opts.url else opts.db,
+            "concurrency": opts.concurrency,
+            "duration_s": round(elapsed, 3),
+            "scenarios": dict(zip(scenarios, weights)),
+            "serpapi_latency_s": opts.serpapi_latency,
+            "llm_latency_s": opts.llm_latency,
+        },
+        "overall": _summarize(all_samples, elapsed),
+        "scenarios": {name: _summarize(per, elapsed) for name, per in samples.items()},
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+# -------------------------------
+# Reporting
+# -------------------------------
+def _fmt(value, suffix=""):
+    return "-" if value is None else f"{value:,.1f}{suffix}"
+
+
+def print_report(result, baseline=None):
+    meta = result["meta"]
+    print(f"\n📊 {meta['target']} | concurrency={meta['concurrency']} | {meta['duration_s']}s | commit {meta['git_commit']}")
+    header = f"{'scenario':<12} {'reqs':>7} {'rps':>9} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = list(result["scenarios"].items()) + [("overall", result["overall"])]
+    for name, s in rows:
+        lat = s["latency_ms"]
+        print(f"{name:<12} {s['requests']:>7} {_fmt(s['throughput_rps']):>9} {s['error_rate'] * 100:>5.1f}% "
+              f"{_fmt(lat['p50']):>9} {_fmt(lat['p95']):>9} {_fmt(lat['p99']):>9}")
+
+    if baseline:
+        print("\n🔁 Compared with baseline "
+              f"({baseline['meta'].get('git_commit')}, {baseline['meta'].get('timestamp')}):")
+        for name, s in rows:
+            base = baseline["overall"] if name == "overall" else baseline["scenarios"].get(name)
+            if not base:
+                continue
+            print(f"{name:<12} rps {_delta(s['throughput_rps'], base['throughput_rps'])}  "
+                  f"p95 {_delta(s['latency_ms']['p95'], base['latency_ms']['p95'])}  "
+                  f"p99 {_delta(s['latency_ms']['p99'], base['latency_ms']['p99'])}  "
+                  f"err {s['error_rate'] * 100:.1f}% (was {base['error_rate'] * 100:.1f}%)")
+
+
+def _delta(new, old):
+    if new is None or not old:
+        return "    n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--url", help="Target a running server instead of booting the app in-process")
+    p.add_argument("--concurrency", type=int, default=20, help="Concurrent virtual users")
+    p.add_argument("--duration", type=float, default=15.0, help="Measured run length in seconds")
+    p.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = duration only)")
+    p.add_argument("--warmup", type=float, default=2.0, help="Unmeasured warm-up seconds")
+    p.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    p.add_argument("--scenarios", default=",".join(SCENARIOS),
+                   help=f"Comma-separated subset of: {', '.join(SCENARIOS)}; 'name=weight' overrides the mix")
+    p.add_argument("--users", type=int, default=50, help="Seeded users to spread invitation/login traffic over")
+    p.add_argument("--db", choices=["sqlite", "postgres"], default="sqlite",
+                   help="sqlite: seeded throwaway DB; postgres: use DB_* environment variables")
+    p.add_argument("--sqlite-path", help="Reuse an existing SQLite database file")
+    p.add_argument("--serpapi-cassette", help="Recorded SerpAPI Google Flights response (JSON) to replay")
+    p.add_argument("--serpapi-latency", type=float, default=0.0, help="Simulated SerpAPI latency in seconds")
+    p.add_argument("--llm-latency", type=float, default=0.0, help="Simulated LLM latency in seconds")
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    p.add_argument("--baseline", help="Earlier results JSON to compare against")
+    opts = p.parse_args(argv)
+
+    scenarios = []
+    for item in opts.scenarios.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in SCENARIOS:
+            p.error(f"unknown scenario {name!r}")
+        if weight:
+            SCENARIOS[name] = (SCENARIOS[name][0], float(weight))
+        scenarios.append(name)
+    opts.scenarios = scenarios
+    return opts
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    result = asyncio.run(run(opts))
+    baseline = json.loads(Path(opts.baseline).read_text()) if opts.baseline else None
+    print_report(result, baseline)
+    Path(opts.output).write_text(json.dumps(result, indent=2))
+    print(f"\n✅ Results saved to {opts.output}")
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
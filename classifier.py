@@ -0,0 +1,157 @@
+"""
+Background email classification workers.
+
+Consumes the `classification_jobs` queue (see db.py and migration 0010) that
+ingestion fills in the same transaction as it stores new mail. Each worker
+thread claims a small batch with FOR UPDATE SKIP LOCKED, so workers never
+block each other. It asks the LLM whether each email is an invitation,
+writes the invitations in one batch and marks the jobs done. A failed job
+is retried with exponential backoff. Once it runs out of attempts it is
+dead-lettered with its last error. A job whose worker dies becomes
+claimable again when its visibility timeout lapses.
+
+Usage:
+    python classifier.py                    # CLASSIFIER_WORKERS threads
+    python classifier.py --workers 8
+    python classifier.py --requeue-dead     # retry dead-lettered jobs, then exit
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import db
+import metrics
+
+CLASSIFIER_WORKERS = int(os.getenv("CLASSIFIER_WORKERS", 4))
+CLASSIFIER_BATCH = int(os.getenv("CLASSIFIER_BATCH", 10))
+CLASSIFIER_POLL_INTERVAL = float(os.getenv("CLASSIFIER_POLL_INTERVAL", 1.0))
+CLASSIFIER_RETRY_BASE = float(os.getenv("CLASSIFIER_RETRY_BASE", 5))
+CLASSIFIER_METRICS_PORT = int(os.getenv("CLASSIFIER_METRICS_PORT", 9102))  # 0 disables
+
+CLASSIFY_JOBS = metrics.Counter(
+    "classification_jobs_total", "Classification jobs by outcome (invitation, other, retry, dead).", ("outcome",)
+)
+CLASSIFY_LAG = metrics.Histogram(
+    "classification_lag_seconds", "Time from enqueue (email stored) to classification done."
+)
+CLASSIFY_QUEUE = metrics.Gauge("classification_queue_jobs", "Queued classification jobs by status.", ("status",))
+CLASSIFY_OLDEST = metrics.Gauge("classification_queue_oldest_ready_seconds", "Age of the oldest claimable job.")
+
+
+def _classify():
+    # the agent module builds the LLM client at import; load it only in worker processes
+    from agent import classify_email
+    return classify_email
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(CLASSIFIER_RETRY_BASE * 2 ** (attempts - 1), 3600)
+
+
+class ClassifierWorker(threading.Thread):
+    def __init__(self, index: int, stop: threading.Event, classify=None):
+        super().__init__(name=f"classifier-{index}", daemon=True)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        self.stop_event = stop
+        self.classify = classify or _classify()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                print(f"❌ [{self.name}] queue error: {type(e).__name__}: {e}")
+                processed = 0
+            if not processed:
+                self.stop_event.wait(CLASSIFIER_POLL_INTERVAL)
+
+    def run_once(self) -> int:
+        """Claim and process one batch; returns the number of jobs claimed."""
+        jobs = db.claim_classification_jobs(self.worker_id, limit=CLASSIFIER_BATCH)
+        if not jobs:
+            return 0
+
+        invitations, succeeded = [], []
+        for job in jobs:
+            if job["parsed"]:
+                # already parsed at ingestion (calendar invite); nothing for the LLM to do
+                succeeded.append(job)
+                continue
+            try:
+                parsed = self.classify(job)
+            except Exception as e:
+                reason = "invalid JSON from LLM" if isinstance(e, json.JSONDecodeError) else f"{type(e).__name__}: {e}"
+                status = db.fail_classification_job(self.worker_id, job["jobid"], reason, _retry_delay(job["attempts"]))
+                CLASSIFY_JOBS.inc(outcome="dead" if status == "dead" else "retry")
+                print(f"⚠️ [{self.name}] email {job['emailid']} failed ({reason}); {status}")
+                continue
+            if parsed.get("is_invitation"):
+                invitations.append((job["emailid"], parsed))
+            succeeded.append(job)
+
+        if invitations:
+            db.write_parsed_invitations_bulk(invitations)
+        db.complete_classification_jobs(self.worker_id, [job["jobid"] for job in succeeded])
+
+        now = time.time()
+        for job in succeeded:
+            CLASSIFY_LAG.observe(max(0.0, now - job["created_at"].timestamp()))
+        CLASSIFY_JOBS.inc(len(invitations), outcome="invitation")
+        CLASSIFY_JOBS.inc(len(succeeded) - len(invitations), outcome="other")
+        print(f"🏷️ [{self.name}] classified {len(succeeded)}/{len(jobs)} emails, {len(invitations)} invitations")
+        return len(jobs)
+
+
+def _report_queue(stop: threading.Event, interval: float = 15.0):
+    while not stop.is_set():
+        try:
+            stats = db.classification_queue_stats()
+            for status in ("pending", "running", "dead"):
+                CLASSIFY_QUEUE.set(stats.get(status, 0), status=status)
+            CLASSIFY_OLDEST.set(stats["oldest_ready_seconds"])
+        except Exception as e:
+            print(f"⚠️ Could not read classification queue stats: {e}")
+        stop.wait(interval)
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run background email classifier workers.")
+    parser.add_argument("--workers", type=int, default=CLASSIFIER_WORKERS)
+    parser.add_argument("--requeue-dead", action="store_true", help="Retry dead-lettered jobs and exit")
+    args = parser.parse_args(argv)
+
+    if args.requeue_dead:
+        print(f"🔁 Requeued {db.requeue_dead_classification_jobs()} dead-lettered jobs")
+        return 0
+
+    if CLASSIFIER_METRICS_PORT:
+        metrics.start_http_server(CLASSIFIER_METRICS_PORT)
+
+    stop = threading.Event()
+    classify = _classify()
+    workers = [ClassifierWorker(i, stop, classify) for i in range(args.workers)]
+    for w in workers:
+        w.start()
+    threading.Thread(target=_report_queue, args=(stop,), name="classifier-stats", daemon=True).start()
+    print(f"🏷️ {len(workers)} classifier workers running")
+
+    try:
+        while any(w.is_alive() for w in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down classifier workers...")
+        stop.set()
+        for w in workers:
+            w.join(timeout=30)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,132 +1,193 @@
 import os
+import threading
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from .db import get_db_connection
+import async_db
+import metrics
+import passwords
+from db import db_connection, TimedRealDictCursor
 
+SESSIONS_SWEPT = metrics.Counter("sessions_swept_total", "Expired sessions deleted by the background sweeper.")
 
 def init_auth_db():
     """Create users and sessions tables if they don't exist."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                userid SERIAL PRIMARY KEY,
-                name VARCHAR(100) NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                email VARCHAR(150) UNIQUE NOT NULL,
-                bookings INTEGER DEFAULT 0
-            );
-
-            CREATE TABLE IF NOT EXISTS sessions (
-                sessionid SERIAL PRIMARY KEY,
-                userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
-                expires_at TIMESTAMP WITH TIME ZONE
-            );
-            """
-        )
-        conn.commit()
-        # Ensure compatibility with other schemas: if sessions table already exists
-        # without an expires_at column (older schema), add it now and backfill
+    with db_connection() as conn:
+        cur = conn.cursor()
         try:
-            cur.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE;")
-            # backfill from session_duration if present
             cur.execute(
                 """
-                DO $$
-                BEGIN
-                    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='session_duration') THEN
-                        UPDATE sessions SET expires_at = now() + session_duration WHERE expires_at IS NULL AND session_duration IS NOT NULL;
-                    END IF;
-                END$$;
+                CREATE TABLE IF NOT EXISTS users (
+                    userid SERIAL PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    password VARCHAR(255) NOT NULL,
+                    email VARCHAR(150) UNIQUE NOT NULL,
+                    bookings INTEGER DEFAULT 0
+                );
+
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sessionid SERIAL PRIMARY KEY,
+                    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+                    expires_at TIMESTAMP WITH TIME ZONE
+                );
                 """
             )
             conn.commit()
-        except Exception:
-            # non-fatal; leave as-is and let runtime operations handle schema differences
-            conn.rollback()
-    finally:
-        cur.close()
-        conn.close()
+            # Ensure compatibility with other schemas: if sessions table already exists
+            # without an expires_at column (older schema), add it now and backfill
+            try:
+                cur.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE;")
+                # backfill from session_duration if present
+                cur.execute(
+                    """
+                    DO $$
+                    BEGIN
+                        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='session_duration') THEN
+                            UPDATE sessions SET expires_at = now() + session_duration WHERE expires_at IS NULL AND session_duration IS NOT NULL;
+                        END IF;
+                    END$$;
+                    """
+                )
+                conn.commit()
+            except Exception:
+                # non-fatal; leave as-is and let runtime operations handle schema differences
+                conn.rollback()
+        finally:
+            cur.close()
 
 
 def create_user(name: str, email: str, password: str) -> Dict[str, Any]:
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute("INSERT INTO users (name, email, password) VALUES (%s,%s,%s) RETURNING userid,name,email", (name, email, password))
-        user = cur.fetchone()
-        conn.commit()
-        return dict(user)
-    except psycopg2.errors.UniqueViolation:
-        conn.rollback()
-        return {}
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        try:
+            cur.execute(
+                "INSERT INTO users (name, email, password) VALUES (%s,%s,%s) RETURNING userid,name,email",
+                (name, email, passwords.hash_password(password)),
+            )
+            user = cur.fetchone()
+            conn.commit()
+            return dict(user)
+        except psycopg2.errors.UniqueViolation:
+            conn.rollback()
+            return {}
+        finally:
+            cur.close()
 
 
 def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute("SELECT userid,name,email FROM users WHERE email=%s AND password=%s", (email, password))
-        user = cur.fetchone()
-        return dict(user) if user else None
-    finally:
-        cur.close()
-        conn.close()
+    """
+    Check credentials against the stored bcrypt hash, upgrading legacy plaintext rows.
+
+    Hashing runs in the calling thread; async callers should use
+    `passwords.verify_password_async` instead.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        try:
+            cur.execute("SELECT userid,name,email,password FROM users WHERE email=%s", (email,))
+            user = cur.fetchone()
+            ok, needs_rehash = passwords.verify_password(password, user["password"] if user else None)
+            if not ok:
+                return None
+            if needs_rehash:
+                cur.execute(
+                    "UPDATE users SET password=%s WHERE userid=%s AND password=%s",
+                    (passwords.hash_password(password), user["userid"], user["password"]),
+                )
+                conn.commit()
+            return {"userid": user["userid"], "name": user["name"], "email": user["email"]}
+        finally:
+            cur.close()
 
 
 def create_session(userid: int, duration_minutes: int = 60) -> int:
     expires = datetime.utcnow() + timedelta(minutes=duration_minutes)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT INTO sessions (userid, expires_at) VALUES (%s,%s) RETURNING sessionid", (userid, expires))
-        sid = cur.fetchone()[0]
-        conn.commit()
-        return sid
-    finally:
-        cur.close()
-        conn.close()
-
-
-def get_user_by_session(sessionid: int) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute(
-            "SELECT u.userid,u.name,u.email,s.expires_at FROM sessions s JOIN users u ON s.userid = u.userid WHERE s.sessionid = %s",
-            (sessionid,)
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        # check expiry
-        if row.get("expires_at") and row["expires_at"] < datetime.utcnow():
-            # session expired: delete it
-            cur2 = conn.cursor()
-            cur2.execute("DELETE FROM sessions WHERE sessionid=%s", (sessionid,))
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("INSERT INTO sessions (userid, expires_at) VALUES (%s,%s) RETURNING sessionid", (userid, expires))
+            sid = cur.fetchone()[0]
             conn.commit()
-            cur2.close()
-            return None
-        return dict(row)
-    finally:
-        cur.close()
-        conn.close()
+            return sid
+        finally:
+            cur.close()
 
 
 def delete_session(sessionid: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("DELETE FROM sessions WHERE sessionid=%s", (sessionid,))
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    async_db.invalidate_session(sessionid)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM sessions WHERE sessionid=%s", (sessionid,))
+            conn.commit()
+        finally:
+            cur.close()
+
+
+# -------------------------------
+# Expired session sweeper
+# -------------------------------
+def sweep_expired_sessions(batch_size: int = 1000) -> int:
+    """Delete expired sessions in batches of `batch_size`; returns how many were removed."""
+    total = 0
+    while True:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    DELETE FROM sessions
+                    WHERE sessionid IN (
+                        SELECT sessionid FROM sessions
+                        WHERE expires_at IS NOT NULL AND expires_at < now()
+                        ORDER BY expires_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING sessionid
+                    """,
+                    (batch_size,)
+                )
+                deleted = [r[0] for r in cur.fetchall()]
+                conn.commit()
+            finally:
+                cur.close()
+        for sessionid in deleted:
+            async_db.invalidate_session(sessionid)
+        total += len(deleted)
+        SESSIONS_SWEPT.inc(len(deleted))
+        if len(deleted) < batch_size:
+            return total
+
+
+_sweeper_stop = threading.Event()
+_sweeper_thread = None
+
+
+def start_session_sweeper(interval: float = None, batch_size: int = None):
+    """Run `sweep_expired_sessions` every `interval` seconds on a daemon thread (0 disables)."""
+    global _sweeper_thread
+    interval = float(os.getenv("SESSION_SWEEP_INTERVAL", 60)) if interval is None else interval
+    batch_size = batch_size or int(os.getenv("SESSION_SWEEP_BATCH", 1000))
+    if interval <= 0 or (_sweeper_thread and _sweeper_thread.is_alive()):
+        return
+
+    def _loop():
+        while not _sweeper_stop.wait(interval):
+            try:
+                removed = sweep_expired_sessions(batch_size)
+                if removed:
+                    print(f"🧹 Removed {removed} expired sessions")
+            except Exception as e:
+                print(f"❌ Session sweep failed: {e}")
+
+    _sweeper_stop.clear()
+    _sweeper_thread = threading.Thread(target=_loop, name="session-sweeper", daemon=True)
+    _sweeper_thread.start()
+
+
+def stop_session_sweeper():
+    _sweeper_stop.set()
+    if _sweeper_thread:
+        _sweeper_thread.join(timeout=5)
@@ -1,6 +1,8 @@
 -- ===========================================
 -- Flight Assistant Database Setup
 -- ===========================================
+-- Schema changes after this initial setup (is_invitation, indexes, ...) live in
+-- databases/migrations/ and are applied with `python -m databases.migrate`.
 
 -- 1️⃣ Create database
 -- (Skip this if you already created it via CLI)
@@ -0,0 +1,190 @@
+"""
+Versioned schema migrations.
+
+Applies `databases/migrations/NNNN_<name>.sql` in order, each in its own
+transaction, and records them in `schema_migrations`. Every migration is
+written to be idempotent, so running against a fresh database, an init_db.py
+database or one set up from flight_assistant.sql converges on the same schema.
+A Postgres advisory lock keeps concurrent runners (e.g. several app replicas
+starting at once) from applying the same migration twice.
+
+Usage:
+    python -m databases.migrate                 # apply pending migrations
+    python -m databases.migrate --status        # list applied / pending
+    python -m databases.migrate --check-plans   # verify hot-path queries use their indexes
+"""
+import argparse
+import hashlib
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import db
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+_LOCK_ID = 7_420_311  # arbitrary, shared by every runner
+
+
+def _migration_files():
+    files = sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9][0-9]_*.sql"))
+    return [(f.name.split("_", 1)[0], f.stem, f) for f in files]
+
+
+def _checksum(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _ensure_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(16) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        );
+        """
+    )
+
+
+def _applied(cur) -> dict:
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cur.fetchall())
+
+
+def migrate(conn=None) -> list:
+    """
+    Apply every pending migration.
+
+    Args:
+        conn: Optional psycopg2 connection; a dedicated one is opened otherwise.
+
+    Returns:
+        list: Names of the migrations applied by this call.
+    """
+    own_conn = conn is None
+    conn = conn or db.get_db_connection()
+    applied_now = []
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s)", (_LOCK_ID,))
+        _ensure_table(cur)
+        conn.commit()
+        applied = _applied(cur)
+
+        for version, name, path in _migration_files():
+            if version in applied:
+                if applied[version] != _checksum(path):
+                    print(f"⚠️ Migration {name} changed after it was applied; not re-running it")
+                continue
+            print(f"🛠️ Applying migration {name}...")
+            try:
+                cur.execute(path.read_text())
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                    (version, name, _checksum(path)),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f"❌ Migration {name} failed; schema left at the previous version")
+                raise
+            applied_now.append(name)
+
+        print(f"✅ Schema up to date ({len(applied_now)} migration(s) applied).")
+        return applied_now
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_ID,))
+        conn.commit()
+        cur.close()
+        if own_conn:
+            conn.close()
+
+
+def status(conn=None) -> list:
+    """Return (name, applied) for every migration file."""
+    own_conn = conn is None
+    conn = conn or db.get_db_connection()
+    cur = conn.cursor()
+    try:
+        _ensure_table(cur)
+        conn.commit()
+        applied = _applied(cur)
+        return [(name, version in applied) for version, name, _ in _migration_files()]
+    finally:
+        cur.close()
+        if own_conn:
+            conn.close()
+
+
+# -------------------------------
+# Query plan checks
+# -------------------------------
+# (helper, query, sample params, index the plan must use)
+PLAN_CHECKS = [
+    ("fetch_user_emails_from_db", db.USER_EMAILS_QUERY, ("pratham@example.com",), "emails_userid_idx"),
+    ("fetch_parsed_invitations_from_db", db.PARSED_INVITATIONS_QUERY, (3,), "emails_invitations_by_user_idx"),
+    ("fetch_recent_flights", db.RECENT_FLIGHTS_QUERY, ("AMS", "JFK", "2025-12-25", 3600, 50), "flights_route_date_idx"),
+]
+
+
+def check_query_plans(conn=None, checks=None) -> list:
+    """
+    EXPLAIN each hot-path query and confirm it can use its index.
+
+    Sequential scans are disabled for the check (`enable_seqscan = off`) so the
+    result does not depend on table size: on a near-empty dev database the
+    planner would otherwise rightly prefer a seq scan. Nothing is executed;
+    each EXPLAIN runs in a transaction that is rolled back.
+
+    Returns:
+        list: (helper, index, ok, plan_text) per check.
+    """
+    own_conn = conn is None
+    conn = conn or db.get_db_connection()
+    results = []
+    cur = conn.cursor()
+    try:
+        for helper, query, params, index in checks or PLAN_CHECKS:
+            try:
+                cur.execute("SET LOCAL enable_seqscan = off")
+                cur.execute("EXPLAIN " + query.strip().rstrip(";"), params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+                results.append((helper, index, index in plan, plan))
+            finally:
+                conn.rollback()
+        return results
+    finally:
+        cur.close()
+        if own_conn:
+            conn.close()
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations.")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    parser.add_argument("--check-plans", action="store_true", help="Verify hot-path queries use their indexes")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        for name, applied in status():
+            print(f"{'✅' if applied else '⏳'} {name}")
+        return 0
+
+    if args.check_plans:
+        failed = 0
+        for helper, index, ok, plan in check_query_plans():
+            print(f"{'✅' if ok else '❌'} {helper} → {index}")
+            if not ok:
+                failed += 1
+                print(plan)
+        return 1 if failed else 0
+
+    migrate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+-- Bring any existing deployment (init_db.py, flight_assistant.sql or
+-- databases/auth.py schema) to the same baseline. Safe to run on all of them.
+
+CREATE TABLE IF NOT EXISTS users (
+    userid SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    email VARCHAR(150) UNIQUE NOT NULL,
+    sessionids INTEGER[],
+    flightid INTEGER,
+    bookings INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS emails (
+    emailid SERIAL PRIMARY KEY,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    sender VARCHAR(150) NOT NULL,
+    header VARCHAR(255),
+    body TEXT
+);
+
+-- init_db.py created emails without an owner and nothing created is_invitation
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS userid INTEGER REFERENCES users(userid) ON DELETE CASCADE;
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS is_invitation BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    sessionid SERIAL PRIMARY KEY,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    emailid INTEGER REFERENCES emails(emailid) ON DELETE SET NULL,
+    session_duration INTERVAL,
+    context_window_length INTEGER,
+    user_preferences JSONB DEFAULT '{}'
+);
+
+-- columns used by databases/auth.py
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE DEFAULT now();
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE;
+-- columns used by db.write_parsed_email_to_db, absent from the auth.py schema
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS emailid INTEGER REFERENCES emails(emailid) ON DELETE SET NULL;
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS user_preferences JSONB DEFAULT '{}';
+
+UPDATE sessions
+SET expires_at = created_at + session_duration
+WHERE expires_at IS NULL AND session_duration IS NOT NULL AND created_at IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS flights (
+    flightid SERIAL PRIMARY KEY,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    departure VARCHAR(10),
+    arrival VARCHAR(10),
+    currency VARCHAR(10),
+    price NUMERIC(10,2),
+    airline VARCHAR(100)
+);
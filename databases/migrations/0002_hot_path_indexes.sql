@@ -0,0 +1,18 @@
+-- Indexes matched to the hot-path queries in db.py.
+
+-- fetch_user_emails_from_db: emails JOIN users ON userid WHERE users.email = ?
+-- (users.email already has a unique index); also serves ON DELETE CASCADE from users.
+CREATE INDEX IF NOT EXISTS emails_userid_idx ON emails (userid);
+
+-- fetch_parsed_invitations_from_db: WHERE userid = ? AND is_invitation
+-- Partial: only invitations are indexed, so the index stays small as mail piles up.
+CREATE INDEX IF NOT EXISTS emails_invitations_by_user_idx ON emails (userid, emailid) WHERE is_invitation;
+
+-- write_parsed_email_to_db: UPDATE sessions ... WHERE emailid = ?
+CREATE INDEX IF NOT EXISTS sessions_emailid_idx ON sessions (emailid) WHERE emailid IS NOT NULL;
+
+-- session lookups per user and ON DELETE CASCADE from users
+CREATE INDEX IF NOT EXISTS sessions_userid_idx ON sessions (userid);
+
+-- per-user flight history and ON DELETE CASCADE from users
+CREATE INDEX IF NOT EXISTS flights_userid_idx ON flights (userid);
@@ -0,0 +1,29 @@
+-- De-duplication key for bulk email ingestion (db.insert_emails_bulk).
+-- content_hash = sha256(sender || 0x1f || header || 0x1f || body), hex encoded;
+-- db.email_content_hash computes the same value client-side.
+
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+-- Backfill only the oldest copy of each existing duplicate; later copies keep a
+-- NULL hash so the unique index can be built without deleting any mail.
+UPDATE emails e
+SET content_hash = d.hash
+FROM (
+    SELECT DISTINCT ON (userid, hash) emailid, hash
+    FROM (
+        SELECT emailid, userid,
+               encode(sha256(convert_to(
+                   coalesce(sender, '') || chr(31) || coalesce(header, '') || chr(31) || coalesce(body, ''),
+                   'UTF8')), 'hex') AS hash
+        FROM emails
+        WHERE content_hash IS NULL
+    ) h
+    ORDER BY userid, hash, emailid
+) d
+WHERE e.emailid = d.emailid
+  AND NOT EXISTS (
+      SELECT 1 FROM emails x
+      WHERE x.userid IS NOT DISTINCT FROM e.userid AND x.content_hash = d.hash
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS emails_user_content_hash_key ON emails (userid, content_hash);
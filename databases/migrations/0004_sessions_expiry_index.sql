@@ -0,0 +1,3 @@
+-- Lets the background session sweeper (databases/auth.py) find expired rows
+-- without scanning live sessions.
+CREATE INDEX IF NOT EXISTS sessions_expires_at_idx ON sessions (expires_at) WHERE expires_at IS NOT NULL;
@@ -0,0 +1,17 @@
+-- Persisted search results (db.upsert_flight_results / db.fetch_recent_flights).
+-- Search-result rows have userid NULL; existing per-user rows are untouched.
+-- offer_key = sha256 of route, dates, currency, airline, duration, flight numbers
+-- and departure time (see 0013), hex encoded (db.flight_offer_key); re-fetching
+-- the same offer updates price and fetched_at.
+
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS departure_date DATE;
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS return_date DATE;
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS duration INTEGER;
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP WITH TIME ZONE DEFAULT now();
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS offer_key CHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS flights_offer_key_key ON flights (offer_key);
+
+-- Route lookups, newest first.
+CREATE INDEX IF NOT EXISTS flights_route_date_idx
+    ON flights (departure, arrival, departure_date, fetched_at DESC);
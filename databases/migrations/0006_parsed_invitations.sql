@@ -0,0 +1,32 @@
+-- Parsed invitation details, one row per email (db.write_parsed_invitations_bulk).
+-- Replaces merging every parse into sessions.user_preferences.
+
+CREATE TABLE IF NOT EXISTS parsed_invitations (
+    emailid INTEGER PRIMARY KEY REFERENCES emails(emailid) ON DELETE CASCADE,
+    userid INTEGER REFERENCES users(userid) ON DELETE CASCADE,
+    event_title TEXT,
+    event_location TEXT,
+    event_time TEXT,
+    details JSONB NOT NULL DEFAULT '{}',
+    parsed_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS parsed_invitations_userid_idx ON parsed_invitations (userid, parsed_at DESC);
+
+-- Carry over what the old writer left in sessions.user_preferences (latest session per email).
+INSERT INTO parsed_invitations (emailid, userid, event_title, event_location, event_time, details)
+SELECT DISTINCT ON (s.emailid)
+       s.emailid, e.userid,
+       s.user_preferences->>'event_title',
+       s.user_preferences->>'event_location',
+       s.user_preferences->>'event_time',
+       s.user_preferences
+FROM sessions s
+JOIN emails e ON e.emailid = s.emailid
+WHERE s.user_preferences->>'is_invitation' = 'true'
+ORDER BY s.emailid, s.sessionid DESC
+ON CONFLICT (emailid) DO NOTHING;
+
+UPDATE emails e SET is_invitation = true
+FROM parsed_invitations p
+WHERE p.emailid = e.emailid AND NOT e.is_invitation;
@@ -0,0 +1,12 @@
+-- Full-text search over stored mail (db.search_emails, /api/emails/search).
+-- Subject terms weigh more than body terms when ranking. Adding a stored
+-- generated column rewrites the emails table once (Postgres 12+).
+
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(header, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(body, '')), 'B')
+    ) STORED;
+
+-- Combined with emails_userid_idx via a BitmapAnd for per-user searches.
+CREATE INDEX IF NOT EXISTS emails_search_idx ON emails USING GIN (search_vector);
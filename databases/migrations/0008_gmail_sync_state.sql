@@ -0,0 +1,7 @@
+-- Last Gmail historyId processed per mailbox (sub.py incremental sync).
+
+CREATE TABLE IF NOT EXISTS gmail_sync_state (
+    email_address VARCHAR(150) PRIMARY KEY,
+    history_id BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
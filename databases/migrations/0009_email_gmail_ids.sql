@@ -0,0 +1,8 @@
+-- Gmail identity of ingested mail (sub.py). A message is stored at most once per
+-- mailbox owner; rows not from Gmail keep NULL ids and are not constrained.
+
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS gmail_msg_id VARCHAR(64);
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS gmail_thread_id VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS emails_user_gmail_msg_key ON emails (userid, gmail_msg_id);
+CREATE INDEX IF NOT EXISTS emails_gmail_thread_idx ON emails (userid, gmail_thread_id) WHERE gmail_thread_id IS NOT NULL;
@@ -0,0 +1,30 @@
+-- Durable ingestion -> classification work queue (classifier.py).
+-- One job per email. Workers claim ready jobs with FOR UPDATE SKIP LOCKED;
+-- a claimed job becomes visible again once available_at (its visibility
+-- timeout) passes without completion. Jobs out of attempts are parked as 'dead'.
+
+CREATE TABLE IF NOT EXISTS classification_jobs (
+    jobid BIGSERIAL PRIMARY KEY,
+    emailid INTEGER NOT NULL UNIQUE REFERENCES emails(emailid) ON DELETE CASCADE,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'running', 'done', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    locked_by VARCHAR(64),
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Claim path: only live jobs are indexed, so finished history never slows it down.
+CREATE INDEX IF NOT EXISTS classification_jobs_ready_idx
+    ON classification_jobs (available_at) WHERE status IN ('pending', 'running');
+
+CREATE INDEX IF NOT EXISTS classification_jobs_dead_idx
+    ON classification_jobs (updated_at) WHERE status = 'dead';
+
+-- Queue mail that arrived before the queue existed and has not been parsed yet.
+INSERT INTO classification_jobs (emailid)
+SELECT e.emailid FROM emails e
+WHERE NOT EXISTS (SELECT 1 FROM parsed_invitations p WHERE p.emailid = e.emailid)
+ON CONFLICT (emailid) DO NOTHING;
@@ -0,0 +1,15 @@
+-- Resumable mailbox backfills (backfill.py). One row per (mailbox, query, labels);
+-- page_token is where listing resumes: every page before it has been stored.
+
+CREATE TABLE IF NOT EXISTS gmail_backfill_state (
+    job_key VARCHAR(64) PRIMARY KEY,
+    email_address VARCHAR(150) NOT NULL,
+    query TEXT NOT NULL DEFAULT '',
+    label_ids TEXT NOT NULL DEFAULT '',
+    page_token TEXT,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    messages_done BIGINT NOT NULL DEFAULT 0,
+    completed BOOLEAN NOT NULL DEFAULT FALSE,
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
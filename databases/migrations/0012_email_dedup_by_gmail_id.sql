@@ -0,0 +1,9 @@
+-- Gmail mail is de-duplicated on (userid, gmail_msg_id) alone (see 0009). Two
+-- distinct messages with identical sender/subject/body, e.g. a recurring
+-- reminder, must both be stored, so the content-hash key only covers mail that
+-- did not come from Gmail.
+
+DROP INDEX IF EXISTS emails_user_content_hash_key;
+CREATE UNIQUE INDEX IF NOT EXISTS emails_user_content_hash_key
+    ON emails (userid, content_hash)
+    WHERE gmail_msg_id IS NULL;
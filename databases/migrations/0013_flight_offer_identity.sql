@@ -0,0 +1,8 @@
+-- Distinguish offers that share route, dates, airline and duration.
+-- offer_key (db.flight_offer_key) now also covers the flight numbers and first
+-- departure time, so different itineraries are stored as separate rows instead
+-- of overwriting each other; a re-fetched itinerary still updates its price.
+-- Both fields are kept for display.
+
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS flight_numbers VARCHAR(100);
+ALTER TABLE flights ADD COLUMN IF NOT EXISTS departure_time VARCHAR(32);
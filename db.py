@@ -1,110 +1,1067 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
+import abc
+import hashlib
 import json
 import re
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import metrics
+
+DB_POOL_SIZE = metrics.Gauge("db_pool_connections", "Open connections held by the pool.")
+DB_POOL_IN_USE = metrics.Gauge("db_pool_in_use", "Pool connections currently borrowed.")
+DB_POOL_WAITING = metrics.Gauge("db_pool_waiting", "Threads waiting for a pool connection.")
+DB_POOL_TIMEOUTS = metrics.Counter("db_pool_timeouts_total", "Pool acquisitions that timed out.")
+DB_POOL_DISCARDED = metrics.Counter("db_pool_discarded_total", "Broken connections dropped by health checks.")
+
+
+class _TimedExecute:
+    """Cursor mixin that records the latency of every statement it executes."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            op = metrics.sql_operation(query) if isinstance(query, str) else "COMPOSED"
+            metrics.DB_QUERIES.inc(operation=op)
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - start, operation=op)
+
+
+class TimedCursor(_TimedExecute, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedExecute, RealDictCursor):
+    pass
+
+
+def _connect_kwargs():
+    return dict(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        dbname=os.getenv("DB_NAME"),
+        port=os.getenv("DB_PORT", 5432),
+        cursor_factory=TimedCursor,
+    )
+
 
 def get_db_connection():
+    """Open a dedicated (unpooled) connection. Prefer `db_connection()` for queries."""
+    start = time.perf_counter()
     try:
-        return psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            dbname=os.getenv("DB_NAME"),
-            port=os.getenv("DB_PORT", 5432)
-        )
+        return psycopg2.connect(**_connect_kwargs())
     except Exception as e:
+        metrics.DB_CONNECT_ERRORS.inc()
         print(f"❌ Error connecting to database: {e}")
         return None
+    finally:
+        metrics.DB_CONNECT_LATENCY.observe(time.perf_counter() - start)
+
+
+# -------------------------------
+# Connection pool
+# -------------------------------
+class PoolTimeout(Exception):
+    """No pooled connection became available within the acquisition timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with bounded waiting and health checks.
+
+    Wraps `psycopg2.pool.ThreadedConnectionPool` (which fails immediately when
+    exhausted) with a semaphore so callers wait up to `timeout` seconds for a
+    connection. Connections idle for longer than `check_idle` seconds are
+    probed with `SELECT 1` before being handed out, and broken ones are replaced.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 5.0, check_idle: float = 30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiting = 0
+        self.timeouts = 0
+        self._publish()
+
+    def _publish(self):
+        DB_POOL_SIZE.set(len(self._pool._pool) + len(self._pool._used))
+        DB_POOL_IN_USE.set(self._in_use)
+        DB_POOL_WAITING.set(self._waiting)
+
+    def stats(self) -> dict:
+        return {
+            "min": self.minconn,
+            "max": self.maxconn,
+            "open": len(self._pool._pool) + len(self._pool._used),
+            "idle": len(self._pool._pool),
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "timeouts": self.timeouts,
+        }
+
+    def getconn(self):
+        start = time.perf_counter()
+        with self._lock:
+            self._waiting += 1
+            self._publish()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self.timeouts += 1
+                DB_POOL_TIMEOUTS.inc()
+                self._publish()
+        if not acquired:
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            metrics.DB_CONNECT_ERRORS.inc()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._publish()
+        metrics.DB_CONNECT_LATENCY.observe(time.perf_counter() - start)
+        return conn
+
+    def _checkout(self):
+        # a slot is held, so the underlying pool always has room for one more connection
+        while True:
+            conn = self._pool.getconn()
+            if not conn.closed and self._healthy(conn):
+                return conn
+            DB_POOL_DISCARDED.inc()
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+
+    def _healthy(self, conn) -> bool:
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            if not close and not conn.closed:
+                # never hand out a connection with an open or failed transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+        except psycopg2.Error:
+            close = True
+        close = close or bool(conn.closed)
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=close)
+        with self._lock:
+            self._in_use -= 1
+            self._publish()
+        self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._last_used.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.getenv("DB_POOL_MIN", 1)),
+                    maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+                    check_idle=float(os.getenv("DB_POOL_CHECK_IDLE", 30)),
+                    **_connect_kwargs(),
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a connection from the pool for the duration of a `with` block.
+
+    The transaction is rolled back if the block raises (or leaves it open
+    without committing) before the connection is returned to the pool.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+# -------------------------------
+# Hot-path queries (index coverage is checked by `python -m databases.migrate --check-plans`)
+# -------------------------------
+USER_EMAILS_QUERY = """
+    SELECT e.emailid, e.sender, e.header, e.body, p.details, c.status AS job_status
+    FROM emails e
+    JOIN users u ON e.userid = u.userid
+    LEFT JOIN parsed_invitations p ON p.emailid = e.emailid
+    LEFT JOIN classification_jobs c ON c.emailid = e.emailid
+    WHERE u.email = %s;
+"""
+
+PARSED_INVITATIONS_QUERY = """
+    SELECT e.emailid, e.sender, e.header, e.body, p.event_title, p.event_location, p.event_time
+    FROM emails e
+    LEFT JOIN parsed_invitations p ON p.emailid = e.emailid
+    WHERE e.userid = %s AND e.is_invitation = true;
+"""
+
 
 def fetch_user_emails_from_db(user_email: str):
     """Fetches all emails linked to a user based on their email address."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    query = """
-        SELECT e.emailid, e.sender, e.header, e.body
-        FROM emails e
-        JOIN users u ON e.userid = u.userid
-        WHERE u.email = %s;
-    """
-    cur.execute(query, (user_email,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(USER_EMAILS_QUERY, (user_email,))
+        rows = cur.fetchall()
+        cur.close()
     return [
         {"emailid": r[0], "sender": r[1], "header": r[2], "body": r[3]}
         for r in rows
     ]
 
+EMAIL_ITERSIZE = int(os.getenv("EMAIL_ITERSIZE", 200))
+
+
+def iter_user_emails_from_db(user_email: str, itersize: int = None):
+    """
+    Lazily yields a user's emails through a named (server-side) cursor.
+
+    Only `itersize` rows are held in memory at a time, regardless of mailbox
+    size. The pooled connection stays checked out until the generator is
+    exhausted or closed, so consume it promptly.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor(name=f"user_emails_{uuid.uuid4().hex}")
+        cur.itersize = itersize or EMAIL_ITERSIZE
+        try:
+            cur.execute(USER_EMAILS_QUERY, (user_email,))
+            for r in cur:
+                # `parsed`: invitation details already known (e.g. from a calendar invite), else None;
+                # `classified`: the background classifier has processed this email;
+                # `queued`: its classification job is waiting or running
+                yield {"emailid": r[0], "sender": r[1], "header": r[2], "body": r[3],
+                       "parsed": r[4], "classified": r[5] == "done", "queued": r[5] in ("pending", "running")}
+        finally:
+            cur.close()
+            conn.rollback()
+
 def write_parsed_email_to_db(emailid: int, parsed_data: dict):
-    """Stores parsed invitation data into a JSONB column (for now we can reuse sessions.user_preferences)."""
-    conn = get_db_connection()
-    cur = conn.cursor()
+    """Stores parsed invitation data in `parsed_invitations` and flags the email as an invitation."""
     try:
-        # For demo, just write into sessions.user_preferences JSONB
-        query = """
-            UPDATE sessions
-            SET user_preferences = user_preferences || %s::jsonb
-            WHERE emailid = %s;
-        """
-        cur.execute(query, (json.dumps(parsed_data), emailid))
-        conn.commit()
+        write_parsed_invitations_bulk([(emailid, parsed_data)])
         print(f"✅ Parsed data written for email ID {emailid}")
     except Exception as e:
         print("❌ Failed to write parsed email data:", e)
-    finally:
-        cur.close()
-        conn.close()
 
-def insert_email(sender: str, header: str, body: str, date=None):
+def insert_email(sender: str, header: str, body: str, date=None, gmail_msg_id=None, gmail_thread_id=None,
+                 event=None):
     """
     Inserts a new email into the emails table.
     Optionally, you could store the date if you add a column later.
+    The same Gmail message (or, without a Gmail id, an identical email) already
+    stored for the user is not inserted again; its id is returned. `event` is a
+    parsed calendar invite, stored with the email (see insert_emails_bulk).
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        query = """
-            INSERT INTO emails (sender, header, body, userid)
-            VALUES (%s, %s, %s, 3)
-            RETURNING emailid;
-        """
-        cur.execute(query, (sender, header, body))
-        emailid = cur.fetchone()[0]
-        conn.commit()
+        emailid = insert_emails_bulk([{
+            "sender": sender, "header": header, "body": body,
+            "gmail_msg_id": gmail_msg_id, "gmail_thread_id": gmail_thread_id, "event": event,
+        }])[0]
         print(f"✅ Email stored with ID: {emailid}")
         return emailid
     except Exception as e:
         print(f"❌ Failed to insert email: {e}")
-    finally:
-        cur.close()
-        conn.close()
+
+
+# -------------------------------
+# Bulk ingestion
+# -------------------------------
+DEFAULT_EMAIL_USERID = 3  # single-mailbox demo owner, as used by insert_email
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 500))
+EMAIL_FLUSH_INTERVAL = float(os.getenv("EMAIL_FLUSH_INTERVAL", 1.0))
+
+
+def email_content_hash(sender: str, header: str, body: str) -> str:
+    """De-duplication key; matches the SQL backfill in migration 0003."""
+    raw = "\x1f".join([sender or "", header or "", body or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _email_row(email: dict):
+    userid = email.get("userid") or DEFAULT_EMAIL_USERID
+    sender = email.get("sender") or "Unknown"
+    header = email.get("header")
+    body = email.get("body")
+    return (sender, header, body, userid, email_content_hash(sender, header, body),
+            email.get("gmail_msg_id"), email.get("gmail_thread_id"))
+
+
+def _insert_deduplicated(cur, rows, conflict: str, key: str, pos: int, key_type: str, where: str = "") -> dict:
+    """Insert `rows` with ON CONFLICT `conflict` DO NOTHING; returns (userid, key) -> emailid for every row."""
+    if not rows:
+        return {}
+    inserted = execute_values(
+        cur,
+        f"""
+        INSERT INTO emails (sender, header, body, userid, content_hash, gmail_msg_id, gmail_thread_id)
+        VALUES %s
+        ON CONFLICT {conflict} DO NOTHING
+        RETURNING userid, {key}, emailid
+        """,
+        rows,
+        page_size=len(rows),
+        fetch=True,
+    )
+    ids = {(userid, k): emailid for userid, k, emailid in inserted}
+    if inserted:
+        # queue new mail for background classification in the same transaction
+        enqueue_classification(cur, [emailid for _, _, emailid in inserted])
+
+    # duplicates (of stored mail or within the batch) resolve to the existing row
+    missing = list({(r[3], r[pos]) for r in rows if (r[3], r[pos]) not in ids})
+    if missing:
+        cur.execute(
+            f"""
+            SELECT userid, {key}, emailid
+            FROM emails
+            WHERE (userid, {key}) IN (SELECT * FROM unnest(%s::int[], %s::{key_type}[])){where}
+            """,
+            ([m[0] for m in missing], [m[1] for m in missing]),
+        )
+        ids.update({(userid, k): emailid for userid, k, emailid in cur.fetchall()})
+    return ids
+
+
+def _insert_email_batch(cur, rows) -> list:
+    """
+    Insert one batch, skipping mail already stored; returns ids aligned with `rows`.
+
+    Gmail rows are keyed on (userid, gmail_msg_id) only, so two messages with
+    identical content (a recurring reminder) are both stored under their own ids.
+    Other rows are keyed on (userid, content_hash), see migration 0012.
+    """
+    by_msg = _insert_deduplicated(
+        cur, [r for r in rows if r[5]], "(userid, gmail_msg_id)", "gmail_msg_id", 5, "varchar",
+    )
+    by_hash = _insert_deduplicated(
+        cur, [r for r in rows if not r[5]], "(userid, content_hash) WHERE gmail_msg_id IS NULL",
+        "content_hash", 4, "char(64)", where=" AND gmail_msg_id IS NULL",
+    )
+    return [by_msg.get((r[3], r[5])) if r[5] else by_hash.get((r[3], r[4])) for r in rows]
+
+
+def _store_email_batch(cur, emails) -> list:
+    """Insert one batch of email dicts and their parsed calendar events on `cur`; returns ids."""
+    ids = _insert_email_batch(cur, [_email_row(e) for e in emails])
+    events = {emailid: _invitation_row(emailid, e["event"])
+              for emailid, e in zip(ids, emails) if emailid and e.get("event")}
+    if events:
+        _write_invitation_batch(cur, list(events.values()))
+    return ids
+
+
+def filter_new_gmail_ids(msg_ids, userid: int = None) -> list:
+    """Of `msg_ids`, those not yet stored for the mailbox owner (input order kept)."""
+    msg_ids = list(msg_ids)
+    if not msg_ids:
+        return []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT gmail_msg_id FROM emails WHERE userid = %s AND gmail_msg_id = ANY(%s)",
+                (userid or DEFAULT_EMAIL_USERID, msg_ids),
+            )
+            stored = {r[0] for r in cur.fetchall()}
+        finally:
+            cur.close()
+    return [m for m in msg_ids if m not in stored]
+
+
+def insert_emails_bulk(emails, batch_size: int = None) -> list:
+    """
+    Insert many emails with one round trip and one commit per batch.
+
+    Args:
+        emails (iterable): Dicts with `sender`, `header`, `body` and optional `userid`
+            (defaults to the demo mailbox owner), `gmail_msg_id`, `gmail_thread_id`
+            and `event` (invitation fields parsed from a calendar invite). Events
+            are written in the same transaction as the emails and their
+            classification jobs, so a worker never claims the job before the
+            parse is visible and asks the LLM to guess it.
+        batch_size (int, optional): Rows per INSERT statement (default EMAIL_BATCH_SIZE).
+
+    Returns:
+        list: Email ids in input order. Emails already stored for the same user
+        (the same Gmail message, or for non-Gmail mail the same sender, subject
+        and body) are not duplicated; their existing id is returned.
+    """
+    batch_size = batch_size or EMAIL_BATCH_SIZE
+    ids = []
+    batch = []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for email in emails:
+                batch.append(email)
+                if len(batch) >= batch_size:
+                    ids.extend(_store_email_batch(cur, batch))
+                    conn.commit()
+                    batch = []
+            if batch:
+                ids.extend(_store_email_batch(cur, batch))
+                conn.commit()
+        finally:
+            cur.close()
+    return ids
+
+
+class _BulkWriter(abc.ABC):
+    """
+    Buffers items from many producers and writes them in batches on a background thread.
+
+    A batch is flushed when it reaches `batch_size` items or when the oldest
+    buffered item has waited `flush_interval` seconds, whichever comes first.
+    `add()` returns a Future resolving to the item's result from `_write_batch`.
+    """
+
+    label = "items"
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None):
+        self.batch_size = batch_size or EMAIL_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else EMAIL_FLUSH_INTERVAL
+        self._buffer = []  # (item, future)
+        self._first_added = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}", daemon=True)
+        self._thread.start()
+
+    @abc.abstractmethod
+    def _write_batch(self, items) -> list:
+        """Write `items`; returns one result per item, in order."""
+
+    def add(self, item) -> Future:
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{type(self).__name__} is closed")
+            self._buffer.append((item, future))
+            if self._first_added is None:
+                self._first_added = time.monotonic()
+            self._cond.notify()
+        return future
+
+    def flush(self):
+        with self._cond:
+            pending, self._buffer, self._first_added = self._buffer, [], None
+        if not pending:
+            return
+        try:
+            results = self._write_batch([item for item, _ in pending])
+        except Exception as e:
+            print(f"❌ Failed to bulk write {len(pending)} {self.label}: {e}")
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+        print(f"✅ Stored {len(pending)} {self.label} in one batch")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._first_added is not None:
+                        timeout = max(0.0, self._first_added + self.flush_interval - time.monotonic())
+                    self._cond.wait(timeout)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def _due(self) -> bool:
+        if not self._buffer:
+            return False
+        return (len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._first_added >= self.flush_interval)
+
+    def close(self):
+        """Flush what is buffered and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+class EmailBulkWriter(_BulkWriter):
+    """Batches emails into `insert_emails_bulk`; futures resolve to the stored email id."""
+
+    label = "emails"
+
+    def _write_batch(self, emails) -> list:
+        return insert_emails_bulk(emails, batch_size=self.batch_size)
+
+
+def get_gmail_backfill_state(job_key: str):
+    """Checkpoint of a backfill job (dict), or None if it never ran."""
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        try:
+            cur.execute("SELECT * FROM gmail_backfill_state WHERE job_key = %s", (job_key,))
+            row = cur.fetchone()
+        finally:
+            cur.close()
+    return dict(row) if row else None
+
+
+def save_gmail_backfill_state(job_key: str, email_address: str, query: str, label_ids: str,
+                              page_token, pages_done: int, messages_done: int, completed: bool = False):
+    """Upsert a backfill checkpoint."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO gmail_backfill_state
+                    (job_key, email_address, query, label_ids, page_token, pages_done, messages_done, completed)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (job_key) DO UPDATE
+                SET page_token = EXCLUDED.page_token,
+                    pages_done = EXCLUDED.pages_done,
+                    messages_done = EXCLUDED.messages_done,
+                    completed = EXCLUDED.completed,
+                    updated_at = now()
+                """,
+                (job_key, email_address, query, label_ids, page_token, pages_done, messages_done, completed),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def delete_gmail_backfill_state(job_key: str):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM gmail_backfill_state WHERE job_key = %s", (job_key,))
+            conn.commit()
+        finally:
+            cur.close()
+
+
+# -------------------------------
+# Classification queue
+# -------------------------------
+CLASSIFY_MAX_ATTEMPTS = int(os.getenv("CLASSIFY_MAX_ATTEMPTS", 5))
+CLASSIFY_VISIBILITY_TIMEOUT = float(os.getenv("CLASSIFY_VISIBILITY_TIMEOUT", 120))
+
+CLAIM_JOBS_QUERY = """
+    WITH next AS (
+        SELECT jobid FROM classification_jobs
+        WHERE status IN ('pending', 'running') AND available_at <= now() AND attempts < %s
+        ORDER BY available_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE classification_jobs j
+    SET status = 'running',
+        attempts = j.attempts + 1,
+        available_at = now() + make_interval(secs => %s),
+        locked_by = %s,
+        updated_at = now()
+    FROM next, emails e
+    WHERE j.jobid = next.jobid AND e.emailid = j.emailid
+    RETURNING j.jobid, j.emailid, j.attempts, j.created_at, e.sender, e.header, e.body,
+              EXISTS (SELECT 1 FROM parsed_invitations p WHERE p.emailid = j.emailid) AS parsed;
+"""
+
+
+def enqueue_classification(cur, emailids):
+    """Queue emails for classification on an open cursor (joins the caller's transaction)."""
+    execute_values(
+        cur,
+        "INSERT INTO classification_jobs (emailid) VALUES %s ON CONFLICT (emailid) DO NOTHING",
+        [(e,) for e in emailids],
+    )
+
+
+def claim_classification_jobs(worker: str, limit: int = 10, visibility_timeout: float = None) -> list:
+    """
+    Claim up to `limit` ready jobs for `worker`.
+
+    Claimed jobs stay invisible to other workers for `visibility_timeout` seconds;
+    if the worker dies they become claimable again. Jobs that used up
+    CLASSIFY_MAX_ATTEMPTS without completing are dead-lettered first.
+    """
+    visibility_timeout = visibility_timeout or CLASSIFY_VISIBILITY_TIMEOUT
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        try:
+            cur.execute(
+                """
+                UPDATE classification_jobs
+                SET status = 'dead', last_error = coalesce(last_error, 'visibility timeout expired'), updated_at = now()
+                WHERE status IN ('pending', 'running') AND available_at <= now() AND attempts >= %s
+                """,
+                (CLASSIFY_MAX_ATTEMPTS,),
+            )
+            cur.execute(CLAIM_JOBS_QUERY, (CLASSIFY_MAX_ATTEMPTS, limit, visibility_timeout, worker))
+            jobs = [dict(r) for r in cur.fetchall()]
+            conn.commit()
+        finally:
+            cur.close()
+    return jobs
+
+
+def complete_classification_jobs(worker: str, jobids) -> int:
+    """Mark jobs done; jobs whose claim expired and moved to another worker are left alone."""
+    jobids = list(jobids)
+    if not jobids:
+        return 0
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                UPDATE classification_jobs
+                SET status = 'done', locked_by = NULL, last_error = NULL, updated_at = now()
+                WHERE jobid = ANY(%s) AND locked_by = %s AND status = 'running'
+                """,
+                (jobids, worker),
+            )
+            done = cur.rowcount
+            conn.commit()
+        finally:
+            cur.close()
+    return done
+
+
+def fail_classification_job(worker: str, jobid: int, error: str, retry_delay: float) -> str:
+    """Record a failed attempt: retry after `retry_delay` seconds, or dead-letter when out of attempts."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                UPDATE classification_jobs
+                SET status = CASE WHEN attempts >= %s THEN 'dead' ELSE 'pending' END,
+                    available_at = now() + make_interval(secs => %s),
+                    locked_by = NULL,
+                    last_error = %s,
+                    updated_at = now()
+                WHERE jobid = %s AND locked_by = %s
+                RETURNING status
+                """,
+                (CLASSIFY_MAX_ATTEMPTS, retry_delay, error[:2000], jobid, worker),
+            )
+            row = cur.fetchone()
+            conn.commit()
+        finally:
+            cur.close()
+    return row[0] if row else "lost"
+
+
+def requeue_dead_classification_jobs(limit: int = 1000) -> int:
+    """Give dead-lettered jobs a fresh set of attempts (e.g. after an LLM outage)."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                UPDATE classification_jobs
+                SET status = 'pending', attempts = 0, available_at = now(), updated_at = now()
+                WHERE jobid IN (SELECT jobid FROM classification_jobs WHERE status = 'dead' ORDER BY updated_at LIMIT %s)
+                """,
+                (limit,),
+            )
+            n = cur.rowcount
+            conn.commit()
+        finally:
+            cur.close()
+    return n
+
+
+def classification_queue_stats() -> dict:
+    """Live and dead job counts by status, plus the age in seconds of the oldest ready job."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # 'done' rows are history; leaving them out keeps this on the partial indexes
+            cur.execute(
+                "SELECT status, count(*) FROM classification_jobs "
+                "WHERE status IN ('pending', 'running', 'dead') GROUP BY status"
+            )
+            stats = {status: count for status, count in cur.fetchall()}
+            cur.execute(
+                """
+                SELECT extract(epoch FROM now() - min(available_at))
+                FROM classification_jobs
+                WHERE status IN ('pending', 'running') AND available_at <= now()
+                """
+            )
+            stats["oldest_ready_seconds"] = float(cur.fetchone()[0] or 0)
+        finally:
+            cur.close()
+    return stats
+
+
+# -------------------------------
+# Gmail sync state
+# -------------------------------
+def get_gmail_history_id(email_address: str):
+    """Last Gmail historyId fully processed for a mailbox, or None before its first sync."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT history_id FROM gmail_sync_state WHERE email_address = %s", (email_address,))
+            row = cur.fetchone()
+        finally:
+            cur.close()
+    return row[0] if row else None
+
+
+def save_gmail_history_id(email_address: str, history_id: int):
+    """Advance a mailbox's checkpoint; a stale (lower) historyId never moves it back."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO gmail_sync_state (email_address, history_id)
+                VALUES (%s, %s)
+                ON CONFLICT (email_address) DO UPDATE
+                SET history_id = GREATEST(gmail_sync_state.history_id, EXCLUDED.history_id),
+                    updated_at = now()
+                """,
+                (email_address, int(history_id)),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+# -------------------------------
+# Parsed invitations
+# -------------------------------
+def _invitation_row(emailid: int, parsed: dict):
+    return (
+        emailid,
+        parsed.get("event_title"),
+        parsed.get("event_location"),
+        parsed.get("event_time"),
+        json.dumps(parsed),
+    )
+
+
+def write_parsed_invitations_bulk(items, batch_size: int = None) -> int:
+    """
+    Store many parsed invitations with one statement per batch.
+
+    Each batch flags its emails as invitations (`UPDATE emails ... FROM (VALUES ...)`)
+    and upserts one `parsed_invitations` row per email, so re-parsing an email
+    replaces its details instead of accumulating them.
+
+    Args:
+        items (iterable): (emailid, parsed dict) pairs.
+        batch_size (int, optional): Rows per statement (default EMAIL_BATCH_SIZE).
+
+    Returns:
+        int: Number of invitations written (emails that no longer exist are skipped).
+    """
+    batch_size = batch_size or EMAIL_BATCH_SIZE
+    # an upsert may not touch the same row twice in one statement; the latest parse wins
+    rows = list({emailid: _invitation_row(emailid, parsed) for emailid, parsed in items if emailid is not None}.values())
+    written = 0
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for i in range(0, len(rows), batch_size):
+                written += _write_invitation_batch(cur, rows[i:i + batch_size])
+                conn.commit()
+        finally:
+            cur.close()
+    return written
+
+
+def _write_invitation_batch(cur, batch) -> int:
+    """Flag and upsert one batch of `_invitation_row` tuples on `cur` (caller commits)."""
+    return len(execute_values(
+        cur,
+        """
+        WITH v (emailid, event_title, event_location, event_time, details) AS (VALUES %s),
+        flagged AS (
+            UPDATE emails e SET is_invitation = true
+            FROM v WHERE e.emailid = v.emailid
+            RETURNING e.emailid, e.userid
+        )
+        INSERT INTO parsed_invitations (emailid, userid, event_title, event_location, event_time, details)
+        SELECT v.emailid, f.userid, v.event_title, v.event_location, v.event_time, v.details
+        FROM v JOIN flagged f ON f.emailid = v.emailid
+        ON CONFLICT (emailid) DO UPDATE
+        SET event_title = EXCLUDED.event_title,
+            event_location = EXCLUDED.event_location,
+            event_time = EXCLUDED.event_time,
+            details = EXCLUDED.details,
+            parsed_at = now()
+        RETURNING emailid
+        """,
+        batch,
+        template="(%s::int, %s, %s, %s, %s::jsonb)",
+        page_size=len(batch),
+        fetch=True,
+    ))
+
+
+class ParsedInvitationWriter(_BulkWriter):
+    """Batches (emailid, parsed) pairs into `write_parsed_invitations_bulk`."""
+
+    label = "parsed invitations"
+
+    def _write_batch(self, items) -> list:
+        write_parsed_invitations_bulk(items, batch_size=self.batch_size)
+        return [emailid for emailid, _ in items]
+
+
+# -------------------------------
+# Email search
+# -------------------------------
+EMAIL_SEARCH_MAX_PAGE = int(os.getenv("EMAIL_SEARCH_MAX_PAGE", 100))
+
+# websearch_to_tsquery accepts user input ("amsterdam -newsletter", quoted phrases, or)
+# without raising on syntax. Headlines are built only for the returned page.
+EMAIL_SEARCH_QUERY = """
+    SELECT m.emailid, m.sender, m.header, m.is_invitation, m.rank,
+           ts_headline('english', coalesce(m.body, ''), m.q, 'MaxFragments=2, MaxWords=20, MinWords=5') AS snippet
+    FROM (
+        SELECT e.emailid, e.sender, e.header, e.body, e.is_invitation, q,
+               ts_rank_cd(e.search_vector, q) AS rank
+        FROM emails e, websearch_to_tsquery('english', %s) AS q
+        WHERE e.userid = %s AND e.search_vector @@ q AND (NOT %s OR e.is_invitation)
+        ORDER BY rank DESC, e.emailid DESC
+        LIMIT %s OFFSET %s
+    ) m
+    ORDER BY m.rank DESC, m.emailid DESC;
+"""
+
+
+def search_emails(userid: int, query: str, limit: int = 20, offset: int = 0,
+                  invitations_only: bool = False) -> dict:
+    """
+    Ranked full-text search over one user's mail (subject and body).
+
+    Args:
+        userid (int): Mailbox owner.
+        query (str): Search terms in web-search syntax.
+        limit (int): Page size, capped at EMAIL_SEARCH_MAX_PAGE.
+        offset (int): Rows to skip.
+        invitations_only (bool): Restrict to emails flagged as invitations.
+
+    Returns:
+        dict: `results` (emailid, sender, header, is_invitation, rank, snippet)
+        and `has_more`.
+    """
+    limit = max(1, min(int(limit), EMAIL_SEARCH_MAX_PAGE))
+    offset = max(0, int(offset))
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        try:
+            # one extra row tells whether another page exists without a COUNT(*)
+            cur.execute(EMAIL_SEARCH_QUERY, (query, userid, invitations_only, limit + 1, offset))
+            rows = [dict(r) for r in cur.fetchall()]
+        finally:
+            cur.close()
+    return {"results": rows[:limit], "has_more": len(rows) > limit}
+
+
+# -------------------------------
+# Flight search results
+# -------------------------------
+FLIGHT_CACHE_MAX_AGE = float(os.getenv("FLIGHT_CACHE_MAX_AGE", 6 * 3600))
+
+RECENT_FLIGHTS_QUERY = """
+    SELECT airline, price, currency, duration, departure, arrival,
+           departure_date, return_date, flight_numbers, departure_time, fetched_at
+    FROM flights
+    WHERE departure = %s AND arrival = %s AND departure_date = %s
+      AND fetched_at > now() - make_interval(secs => %s)
+    ORDER BY fetched_at DESC
+    LIMIT %s;
+"""
+
+
+_OFFER_KEY_FIELDS = ("departure", "arrival", "departure_date", "return_date", "currency", "airline", "duration",
+                     "flight_numbers", "departure_time")
+
+
+def flight_offer_key(flight: dict) -> str:
+    """
+    Identity of a fetched offer: the same itinerary seen again updates one row
+    (price and fetched_at), while different flights get rows of their own.
+    """
+    parts = [flight.get(k) for k in _OFFER_KEY_FIELDS]
+    raw = "\x1f".join("" if p is None else str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flight_row(flight: dict):
+    return (
+        flight.get("departure"),
+        flight.get("arrival"),
+        flight.get("departure_date") or None,
+        flight.get("return_date") or None,
+        flight.get("currency"),
+        flight.get("price"),
+        flight.get("airline"),
+        _as_int(flight.get("duration")),
+        flight.get("flight_numbers"),
+        flight.get("departure_time"),
+        flight_offer_key(flight),
+    )
+
+
+def upsert_flight_results(flights) -> int:
+    """
+    Bulk-upsert parsed search results (the dicts built by `_parse_essentials`).
+
+    One INSERT ... ON CONFLICT per call; an offer already stored gets its
+    price and fetched_at refreshed. Returns the number of rows written.
+    """
+    # ON CONFLICT DO UPDATE may not touch the same row twice in one statement
+    rows = {}
+    for f in flights:
+        if f.get("departure") and f.get("arrival") and f.get("price") is not None:
+            row = _flight_row(f)
+            rows[row[-1]] = row
+    if not rows:
+        return 0
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            execute_values(
+                cur,
+                """
+                INSERT INTO flights (departure, arrival, departure_date, return_date, currency, price, airline, duration,
+                                     flight_numbers, departure_time, offer_key)
+                VALUES %s
+                ON CONFLICT (offer_key) DO UPDATE
+                SET price = EXCLUDED.price, fetched_at = now()
+                """,
+                list(rows.values()),
+                page_size=len(rows),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+    return len(rows)
+
+
+def fetch_recent_flights(departure: str, arrival: str, departure_date: str,
+                         max_age: float = None, limit: int = 50) -> list:
+    """
+    Stored results for a route and outbound date fetched within `max_age` seconds
+    (default FLIGHT_CACHE_MAX_AGE), shaped like freshly parsed flights.
+    """
+    max_age = FLIGHT_CACHE_MAX_AGE if max_age is None else max_age
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        try:
+            cur.execute(RECENT_FLIGHTS_QUERY, (departure, arrival, departure_date, max_age, limit))
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    return [
+        {
+            "airline": r["airline"],
+            "price": float(r["price"]) if r["price"] is not None else None,
+            "currency": r["currency"],
+            "duration": r["duration"],
+            "route": f"{r['departure']} → {r['arrival']}",
+            "departure": r["departure"],
+            "arrival": r["arrival"],
+            "departure_date": str(r["departure_date"]) if r["departure_date"] else None,
+            "return_date": str(r["return_date"]) if r["return_date"] else None,
+            "flight_numbers": r["flight_numbers"],
+            "departure_time": r["departure_time"],
+            "fetched_at": r["fetched_at"].isoformat() if r["fetched_at"] else None,
+        }
+        for r in rows
+    ]
+
 
 def fetch_parsed_invitations_from_db(user_email: str):
     """
     Return all invitations for the given user from parsed emails table.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
     try:
-        query = """
-            SELECT *
-            FROM emails
-            WHERE userid = 3 AND is_invitation = true;
-        """
-        cur.execute(query)
-        rows = cur.fetchall()
-        print(rows)
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(PARSED_INVITATIONS_QUERY, (3,))
+            rows = cur.fetchall()
+            cur.close()
         return [
-            {"emailid": r[0], "sender": r[1], "header": r[2], "body": r[3]}
+            {"emailid": r[0], "sender": r[1], "header": r[2], "body": r[3],
+             "event_title": r[4], "event_location": r[5], "event_time": r[6]}
             for r in rows
         ]
     except Exception as e:
         print(f"❌ Failed to fetch parsed emails: {e}") 
         return []
-
-    finally:
-        cur.close()
-        conn.close()
@@ -0,0 +1,231 @@
+"""
+Body extraction for Gmail message payloads.
+
+`extract_body` walks the MIME tree recursively. It prefers text/plain at any
+depth (multipart/alternative, multipart/mixed, forwarded message/rfc822) and
+falls back to HTML converted to text. The HTML is fed to the converter in
+chunks, and conversion stops once EMAIL_BODY_MAX_CHARS characters have been
+produced, so a huge newsletter never materialises in full.
+
+`find_calendar_event` reads a text/calendar part (inline or attachment) and
+returns the invitation fields the LLM would otherwise be asked to guess. Mail
+that carries one is stored as a parsed invitation at ingestion time.
+"""
+import base64
+import os
+import re
+from datetime import datetime
+from html.parser import HTMLParser
+
+EMAIL_BODY_MAX_CHARS = int(os.getenv("EMAIL_BODY_MAX_CHARS", 20000))
+_HTML_CHUNK = 16 * 1024
+
+_CALENDAR_TYPES = {"text/calendar", "application/ics"}
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def walk_parts(payload):
+    """Depth-first iteration over every part of a Gmail payload, including the root."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        stack.extend(reversed(part.get("parts", [])))
+
+
+def _charset(part) -> str:
+    for h in part.get("headers", []):
+        if h.get("name", "").lower() == "content-type":
+            m = re.search(r'charset="?([\w-]+)', h.get("value", ""), re.IGNORECASE)
+            if m:
+                return m.group(1)
+    return "utf-8"
+
+
+def _part_text(part) -> str:
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+    try:
+        return _decode(data).decode(_charset(part), errors="replace")
+    except LookupError:
+        return _decode(data).decode("utf-8", errors="replace")
+
+
+def _is_attachment(part) -> bool:
+    return bool(part.get("filename"))
+
+
+class _HTMLToText(HTMLParser):
+    """Collects visible text, one line per block element, until `limit` characters."""
+
+    _BLOCK = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "table", "section", "article"}
+    _SKIP = {"script", "style", "head", "title"}
+
+    def __init__(self, limit: int):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.size = 0
+        self.chunks = []
+        self._skip_depth = 0
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.limit
+
+    def _emit(self, text):
+        if self.full:
+            return
+        text = text[: self.limit - self.size]
+        self.chunks.append(text)
+        self.size += len(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip_depth += 1
+        elif tag in self._BLOCK:
+            self._emit("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self._BLOCK:
+            self._emit("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._emit(re.sub(r"\s+", " ", data))
+
+    def text(self) -> str:
+        return re.sub(r"\n\s*\n+", "\n\n", "".join(self.chunks)).strip()
+
+
+def html_to_text(html: str, limit: int = None) -> str:
+    """Visible text of an HTML document, parsed incrementally and cut at `limit` characters."""
+    parser = _HTMLToText(limit or EMAIL_BODY_MAX_CHARS)
+    for i in range(0, len(html), _HTML_CHUNK):
+        parser.feed(html[i:i + _HTML_CHUNK])
+        if parser.full:
+            break
+    return parser.text()
+
+
+def extract_body(payload, limit: int = None) -> str:
+    """Plain-text body of a message: text/plain parts, else HTML converted to text; truncated to `limit`."""
+    limit = limit or EMAIL_BODY_MAX_CHARS
+    plain, html = [], None
+    for part in walk_parts(payload):
+        if _is_attachment(part):
+            continue
+        mime = part.get("mimeType", "")
+        if mime == "text/plain":
+            plain.append(_part_text(part))
+            if sum(len(p) for p in plain) >= limit:
+                break
+        elif mime == "text/html" and html is None:
+            html = part
+    if plain:
+        return "\n".join(p for p in plain if p)[:limit]
+    if html is not None:
+        return html_to_text(_part_text(html), limit)
+    return ""
+
+
+# -------------------------------
+# iCalendar
+# -------------------------------
+def _ics_unescape(value: str) -> str:
+    return (value.replace("\\n", "\n").replace("\\N", "\n")
+            .replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\"))
+
+
+def _ics_datetime(value: str) -> str:
+    """DTSTART/DTEND value to ISO 8601 (UTC 'Z' suffix kept as +00:00)."""
+    for fmt, utc in (("%Y%m%dT%H%M%SZ", True), ("%Y%m%dT%H%M%S", False), ("%Y%m%d", False)):
+        try:
+            dt = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y%m%d":
+            return dt.date().isoformat()
+        return dt.isoformat() + ("+00:00" if utc else "")
+    return value
+
+
+def parse_ics(text: str):
+    """
+    First VEVENT of an iCalendar document; properties of components nested in
+    it (VALARM) are ignored.
+
+    Returns:
+        dict | None: event_title, event_location, event_time (start), event_end,
+        event_timezone and organizer; None if there is no VEVENT.
+    """
+    # unfold continuation lines (RFC 5545 §3.1)
+    lines = re.sub(r"\r?\n[ \t]", "", text).splitlines()
+    # depth 0: outside the VEVENT; 1: its own properties; >1: a sub-component such
+    # as VALARM, whose SUMMARY/DESCRIPTION/LOCATION must not override the event's
+    event, depth = {}, 0
+    for line in lines:
+        marker = line.strip().upper()
+        if depth == 0:
+            if marker == "BEGIN:VEVENT":
+                depth = 1
+            continue
+        if marker.startswith("BEGIN:"):
+            depth += 1
+            continue
+        if marker.startswith("END:"):
+            depth -= 1
+            if depth == 0:
+                break
+            continue
+        if depth > 1 or ":" not in line:
+            continue
+        name_params, value = line.split(":", 1)
+        name, *params = name_params.split(";")
+        name = name.upper()
+        if name == "SUMMARY":
+            event["event_title"] = _ics_unescape(value)
+        elif name == "LOCATION":
+            event["event_location"] = _ics_unescape(value)
+        elif name in ("DTSTART", "DTEND"):
+            key = "event_time" if name == "DTSTART" else "event_end"
+            event[key] = _ics_datetime(value.strip())
+            for p in params:
+                if p.upper().startswith("TZID="):
+                    event.setdefault("event_timezone", p.split("=", 1)[1])
+        elif name == "ORGANIZER":
+            event["organizer"] = value.split(":", 1)[-1] if value.lower().startswith("mailto:") else value
+    return event or None
+
+
+def find_calendar_event(payload, fetch_attachment=None):
+    """
+    Parse the first calendar part of a message into invitation fields.
+
+    Args:
+        payload (dict): Gmail message payload.
+        fetch_attachment (callable, optional): attachmentId -> base64url data,
+            for calendar files Gmail did not inline.
+
+    Returns:
+        dict | None: Fields shaped like the LLM's invitation parse
+        (`is_invitation`, `event_title`, ...) with `source` = "ics".
+    """
+    for part in walk_parts(payload):
+        if part.get("mimeType", "").lower() not in _CALENDAR_TYPES and not part.get("filename", "").lower().endswith(".ics"):
+            continue
+        body = part.get("body", {})
+        data = body.get("data")
+        if not data and body.get("attachmentId") and fetch_attachment:
+            data = fetch_attachment(body["attachmentId"])
+        if not data:
+            continue
+        event = parse_ics(_decode(data).decode("utf-8", errors="replace"))
+        if event:
+            return {"is_invitation": True, "source": "ics", **event}
+    return None
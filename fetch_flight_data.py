@@ -2,6 +2,9 @@ from serpapi.google_search import GoogleSearch
 from dotenv import load_dotenv
 import os
 import json
+import time
+
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -54,6 +57,20 @@ def _parse_flight_data(flights_raw):
     return parsed_flights
 
 
+def _serpapi_search(params):
+    """Run one SerpApi search, recording its latency and outcome."""
+    start = time.perf_counter()
+    try:
+        results = GoogleSearch(params).get_dict()
+    except Exception:
+        metrics.SERPAPI_REQUESTS.inc(outcome="error")
+        raise
+    finally:
+        metrics.SERPAPI_LATENCY.observe(time.perf_counter() - start)
+    metrics.SERPAPI_REQUESTS.inc(outcome="error" if results.get("error") else "ok")
+    return results
+
+
 def fetch_flight_data_from_serpapi(
     departure_id: str,
     arrival_id: str,
@@ -96,8 +113,7 @@ def fetch_flight_data_from_serpapi(
     print(f"🔍 Fetching flights {departure_id} → {arrival_id} ({outbound_date} → {return_date})...")
 
     # Perform the API request
-    search = GoogleSearch(params)
-    results = search.get_dict()
+    results = _serpapi_search(params)
 
     # Extract best_flights and other_flights from the response
     best_flights = results.get("best_flights", [])
@@ -110,26 +126,96 @@ def fetch_flight_data_from_serpapi(
     
     # Parse and return essential attributes if requested
     if parse_only_essentials:
-        parsed_flights = []
-        for flight in all_flights:
-            try:
-                parsed_flights.append({
-                    "airline": flight.get("airline", "Unknown"),
-                    "price": flight.get("price", {}).get("amount") if isinstance(flight.get("price"), dict) else flight.get("price"),
-                    "currency": currency,
-                    "duration": flight.get("total_duration") or flight.get("duration"),
-                    "route": f"{departure_id} → {arrival_id}",
-                    "departure": departure_id,
-                    "arrival": arrival_id,
-                    "departure_date": outbound_date,
-                    "return_date": return_date
-                })
-            except Exception as e:
-                print(f"⚠️ Skipping invalid flight entry: {e}")
+        parsed_flights = _parse_essentials(all_flights, departure_id, arrival_id, outbound_date, return_date, currency)
         print(f"✈️ Parsed {len(parsed_flights)} flights with essential attributes.")
         return parsed_flights
 
 
+def _parse_essentials(flights, departure_id, arrival_id, outbound_date, return_date, currency):
+    """
+    Reduce raw SerpApi flight entries to the essential attributes used by the agent.
+
+    Args:
+        flights (list): Raw `best_flights` / `other_flights` entries.
+        departure_id (str): IATA code the search was made from.
+        arrival_id (str): IATA code the search was made to.
+        outbound_date (str): Outbound date of the search (YYYY-MM-DD).
+        return_date (str): Return date of the search (YYYY-MM-DD).
+        currency (str): Currency code the prices are expressed in.
+
+    Returns:
+        list: Parsed flights; invalid entries are skipped.
+    """
+    parsed_flights = []
+    for flight in flights:
+        try:
+            legs = flight.get("flights") or []
+            parsed_flights.append({
+                "airline": flight.get("airline", "Unknown"),
+                "price": flight.get("price", {}).get("amount") if isinstance(flight.get("price"), dict) else flight.get("price"),
+                "currency": currency,
+                "duration": flight.get("total_duration") or flight.get("duration"),
+                "route": f"{departure_id} → {arrival_id}",
+                "departure": departure_id,
+                "arrival": arrival_id,
+                "departure_date": outbound_date,
+                "return_date": return_date,
+                # per-leg details tell apart offers with the same airline and duration
+                "flight_numbers": ",".join(leg["flight_number"] for leg in legs if leg.get("flight_number")) or None,
+                "departure_time": (legs[0].get("departure_airport") or {}).get("time") if legs else None,
+            })
+        except Exception as e:
+            print(f"⚠️ Skipping invalid flight entry: {e}")
+    return parsed_flights
+
+
+def iter_flight_batches_from_serpapi(
+    searches,
+    currency: str,
+    sort_by: int,
+):
+    """
+    Fetch several SerpApi Google Flights searches and yield parsed flights batch by batch.
+
+    Each upstream response produces two batches (`best_flights`, then `other_flights`)
+    so callers can forward results before the remaining searches have finished.
+
+    Args:
+        searches (iterable): (departure_id, arrival_id, outbound_date, return_date) tuples,
+            e.g. every airport pair / date combination of a flexible search.
+        currency (str): Currency code.
+        sort_by (int): Sorting method (1 = best flights, 2 = price).
+
+    Yields:
+        list: Parsed flights with essential attributes for one upstream batch.
+    """
+    for departure_id, arrival_id, outbound_date, return_date in searches:
+        params = {
+            "engine": "google_flights",
+            "departure_id": departure_id,
+            "arrival_id": arrival_id,
+            "outbound_date": outbound_date,
+            "return_date": return_date,
+            "currency": currency,
+            "hl": "en",
+            "api_key": api_key,
+            "sort_by": sort_by,
+        }
+
+        print(f"🔍 Fetching flights {departure_id} → {arrival_id} ({outbound_date} → {return_date})...")
+
+        try:
+            results = _serpapi_search(params)
+        except Exception as e:
+            print(f"❌ Flight data fetch failed for {departure_id} → {arrival_id} ({outbound_date}): {e}")
+            continue
+
+        for key in ("best_flights", "other_flights"):
+            batch = _parse_essentials(results.get(key, []), departure_id, arrival_id, outbound_date, return_date, currency)
+            if batch:
+                yield batch
+
+
 # Example usage:
 if __name__ == "__main__":
     # Fetch and parse flight data (returns list of flights with essential attributes)
@@ -1,7 +1,9 @@
 
 from __future__ import print_function
 import os.path
-from datetime import datetime, timedelta
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
@@ -164,50 +166,100 @@ def get_flights():
     )
     print(flights)
     return flights
-# filter the flights which not conflicts with the event start and end time
-def filter_flights(events, flights):
-    # filter the flights which not conflicts with the event start and end time
-    filtered_flights = []
-    for flight in flights:
-        departure_dt = _parse_flight_date(flight.get('departure_date'))
-        return_dt = _parse_flight_date(flight.get('return_date'))
-
-        if not departure_dt or not return_dt:
-            print(f"⚠️ Skipping flight {flight.get('airline', 'Unknown')} due to invalid dates.")
-            continue
+def _event_days(event):
+    """
+    Inclusive (first, last) day ordinals an event occupies, or None if its times can't be parsed.
+    """
+    event_start_dt, start_all_day = _parse_event_time(event.get('start'))
+    event_end_dt, end_all_day = _parse_event_time(event.get('end'))
 
-        flight_start = departure_dt.date()
-        flight_end = return_dt.date()
+    if not event_start_dt or not event_end_dt:
+        return None
+
+    event_end = event_end_dt
+    # Google Calendar all-day events use exclusive end date; adjust to inclusive range.
+    if start_all_day or end_all_day:
+        event_end = event_end_dt - timedelta(days=1)
 
-        conflicts = False
+    first, last = event_start_dt.date().toordinal(), event_end.date().toordinal()
+    # an end before the start occupies no day
+    return (first, last) if last >= first else None
 
-        for event in events:
-            event_start_raw = event.get('start')
-            event_end_raw = event.get('end')
 
-            event_start_dt, start_all_day = _parse_event_time(event_start_raw)
-            event_end_dt, end_all_day = _parse_event_time(event_end_raw)
+class BusyIndex:
+    """
+    Calendar events pre-parsed into sorted, merged busy day ranges.
 
-            if not event_start_dt or not event_end_dt:
+    Events are parsed once; overlapping or back-to-back ranges are merged so the
+    ranges are disjoint and both their starts and ends are ascending. A trip
+    conflicts iff the last range starting on or before its return day ends on or
+    after its departure day, which is one bisect: O(log E) per trip.
+    """
+
+    def __init__(self, events):
+        days = sorted(filter(None, (_event_days(e) for e in events or [])))
+        self.starts, self.ends = [], []
+        for first, last in days:
+            if self.ends and first <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], last)
+            else:
+                self.starts.append(first)
+                self.ends.append(last)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def conflicts(self, first_day: date, last_day: date) -> bool:
+        """Whether any event falls on a day in [first_day, last_day] (inclusive)."""
+        return self._conflicts(first_day.toordinal(), last_day.toordinal())
+
+    def _conflicts(self, first: int, last: int) -> bool:
+        i = bisect_right(self.starts, last) - 1
+        return i >= 0 and self.ends[i] >= first
+
+    def free(self, windows) -> list:
+        """Batch check: for each (first_day, last_day) pair, True if no event falls inside it."""
+        return [not self._conflicts(a.toordinal(), b.toordinal()) for a, b in windows]
+
+    def filter_flights(self, flights) -> list:
+        """Flights whose departure-to-return days are free; flights with unparseable dates are dropped."""
+        kept, invalid = [], 0
+        for flight in flights:
+            first = _flight_day(flight.get('departure_date'))
+            last = _flight_day(flight.get('return_date'))
+            if first is None or last is None:
+                invalid += 1
                 continue
+            if not self._conflicts(first, last):
+                kept.append(flight)
+        if invalid:
+            print(f"⚠️ Skipped {invalid} flights with invalid dates.")
+        return kept
+
 
-            event_start_date = event_start_dt.date()
-            event_end_date = event_end_dt.date()
+@lru_cache(maxsize=4096)
+def _flight_day(date_str):
+    # candidate flights share a handful of dates; parse each string once
+    parsed = _parse_flight_date(date_str)
+    return parsed.date().toordinal() if parsed else None
 
-            # Google Calendar all-day events use exclusive end date; adjust to inclusive range.
-            if start_all_day or end_all_day:
-                event_end_date = (event_end_dt - timedelta(days=1)).date()
 
-            overlaps = flight_start <= event_end_date and flight_end >= event_start_date
+# filter the flights which not conflicts with the event start and end time
+def filter_flights(events, flights):
+    """
+    Keep the flights whose trip (departure day to return day) overlaps no calendar event.
 
-            if overlaps:
-                conflicts = True
-                print(f"❌ Flight {flight['airline']} conflicts with event {event['summary']} ({event_start_raw} → {event_end_raw})")
-                break
+    Args:
+        events (list | BusyIndex): Calendar events as returned by get_recent_events,
+            or an index built from them once and reused across calls.
+        flights (list): Flight dicts with departure_date/return_date.
 
-        if not conflicts:
-            filtered_flights.append(flight)
-            print(f"✅ Flight {flight['airline']} does not conflict with any events.")
+    Returns:
+        list: Non-conflicting flights, in input order.
+    """
+    index = events if isinstance(events, BusyIndex) else BusyIndex(events)
+    filtered_flights = index.filter_flights(flights)
+    print(f"✅ {len(filtered_flights)}/{len(flights)} flights fit around {len(index)} busy periods.")
     return filtered_flights
 
 def main():
@@ -1,5 +1,6 @@
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from gmail_api import BatchFetchError, batch_get
 
 creds = Credentials.from_authorized_user_file("token.json")
 service = build("gmail", "v1", credentials=creds)
@@ -9,11 +10,12 @@ def get_event_emails():
         userId='me', q="subject:Invitation OR subject:Event", maxResults=5
     ).execute()
     messages = results.get('messages', [])
-    emails = []
-    for msg in messages:
-        email = service.users().messages().get(userId='me', id=msg['id']).execute()
-        emails.append(email['snippet'])
-    return emails
+    # snippets come with the metadata format; one batched round trip for all of them
+    try:
+        fetched = batch_get(service, [msg['id'] for msg in messages], "metadata")
+    except BatchFetchError as e:
+        fetched = e.results
+    return [fetched[msg['id']]['snippet'] for msg in messages if msg['id'] in fetched]
 
 # Test
 for email in get_event_emails():
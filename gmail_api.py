@@ -0,0 +1,258 @@
+"""
+Gmail message retrieval in batches.
+
+`batch_get` sends up to GMAIL_BATCH_SIZE (max 100) `messages.get` calls per
+HTTP round trip through the Gmail batch endpoint. It always passes a `fields`
+mask so only the attributes we read are transferred.
+
+Ingestion uses two stages. Triage fetches `format=metadata` (From, Subject,
+Date, Content-Type and the snippet) for every new message. Only the
+candidates that `is_candidate` selects are then fetched with full bodies.
+"""
+import os
+import re
+import threading
+import time
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+import email_parsing
+
+BATCH_SIZE = min(100, int(os.getenv("GMAIL_BATCH_SIZE", 100)))
+BATCH_RETRIES = int(os.getenv("GMAIL_BATCH_RETRIES", 3))
+
+METADATA_HEADERS = ["From", "Subject", "Date", "Content-Type"]
+METADATA_FIELDS = "id,threadId,labelIds,snippet,payload/headers"
+FULL_FIELDS = "id,threadId,labelIds,snippet,payload(mimeType,filename,headers,body(data,attachmentId),parts)"
+
+# Subjects/snippets worth a full download; everything else is stored from metadata alone
+TRIAGE_PATTERN = re.compile(
+    os.getenv(
+        "GMAIL_TRIAGE_PATTERN",
+        r"invit|event|meeting|conference|summit|workshop|webinar|calendar|rsvp|agenda|itinerary|flight|travel|trip",
+    ),
+    re.IGNORECASE,
+)
+# Content-Type prefixes that are always fetched in full, whatever the subject: a calendar
+# invite's ICS part sits inside a multipart message and is only visible in the full body.
+# Narrowing this to "text/calendar" saves full fetches but misses invites with plain subjects.
+TRIAGE_CONTENT_TYPES = tuple(
+    t.strip().lower() for t in os.getenv("GMAIL_TRIAGE_CONTENT_TYPES", "text/calendar,multipart/").split(",") if t.strip()
+)
+TRIAGE_ENABLED = os.getenv("GMAIL_TRIAGE", "1") != "0"
+_SKIP_LABELS = {"SPAM", "TRASH", "CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL"}
+
+_RETRYABLE = {429, 500, 502, 503, 504}
+
+# Gmail per-user quota: 250 units/s; messages.get and messages.list cost 5 units each
+GET_QUOTA_UNITS = 5
+LIST_QUOTA_UNITS = 5
+
+
+# -------------------------------
+# Clients
+# -------------------------------
+_creds = None
+_creds_lock = threading.Lock()
+_local = threading.local()
+
+
+def _credentials(token_path: str):
+    """Shared OAuth credentials, loaded once and refreshed under a lock."""
+    global _creds
+    with _creds_lock:
+        if _creds is None:
+            _creds = Credentials.from_authorized_user_file(token_path)
+        if not _creds.valid and _creds.refresh_token:
+            _creds.refresh(Request())
+        return _creds
+
+
+def get_service(token_path: str = "token.json"):
+    """Gmail service for the calling thread (httplib2 transports are not thread-safe), built once per thread."""
+    service = getattr(_local, "service", None)
+    if service is None:
+        service = _local.service = build("gmail", "v1", credentials=_credentials(token_path), cache_discovery=False)
+    return service
+
+
+class QuotaLimiter:
+    """
+    Token bucket over Gmail quota units, shared by every thread of a process.
+
+    A charge larger than what is in the bucket (a 100-message batch is 500 units)
+    is taken in full and puts the bucket into debt; the caller then waits until
+    the debt is paid back, so the long-run rate never exceeds `units_per_second`.
+    """
+
+    def __init__(self, units_per_second: float, burst: float = None):
+        self.rate = float(units_per_second)
+        self.capacity = float(burst or units_per_second)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= float(units)
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class BatchFetchError(Exception):
+    """
+    Some messages could not be downloaded (not deleted: 404s are simply left out).
+
+    `failed` maps each message id to its last error; `results` holds the
+    messages that were fetched, so callers can keep them while retrying the rest.
+    """
+
+    def __init__(self, failed: dict, results: dict):
+        super().__init__(f"{len(failed)} Gmail messages could not be fetched")
+        self.failed = failed
+        self.results = results
+
+
+def _get_request(service, msg_id, fmt):
+    if fmt == "metadata":
+        return service.users().messages().get(
+            userId="me", id=msg_id, format="metadata", metadataHeaders=METADATA_HEADERS, fields=METADATA_FIELDS
+        )
+    return service.users().messages().get(userId="me", id=msg_id, format=fmt, fields=FULL_FIELDS)
+
+
+def batch_get(service, msg_ids, fmt="full", limiter=None):
+    """
+    Fetch many messages with batched HTTP requests.
+
+    Args:
+        service: Gmail API service.
+        msg_ids (iterable): Message ids.
+        fmt (str): "metadata" for triage, "full" for bodies.
+        limiter (QuotaLimiter, optional): Charged GET_QUOTA_UNITS per message before each batch.
+
+    Returns:
+        dict: msg_id -> message resource. Deleted messages (404) are left out.
+
+    Raises:
+        BatchFetchError: Some gets failed with another error, or were still
+            rate-limited after BATCH_RETRIES retries with backoff.
+    """
+    pending = list(dict.fromkeys(msg_ids))
+    results = {}
+    failed = {}
+    for attempt in range(BATCH_RETRIES + 1):
+        retry = []
+        for i in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[i:i + BATCH_SIZE]
+
+            def _collect(request_id, response, exception):
+                failed.pop(request_id, None)  # only the latest attempt's outcome counts
+                if exception is None:
+                    results[request_id] = response
+                elif isinstance(exception, HttpError) and exception.resp.status in _RETRYABLE:
+                    retry.append(request_id)
+                    failed[request_id] = exception
+                elif not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                    print(f"❌ Error fetching message {request_id}: {exception}")
+                    failed[request_id] = exception
+
+            if limiter is not None:
+                limiter.acquire(len(chunk) * GET_QUOTA_UNITS)
+            batch = service.new_batch_http_request(callback=_collect)
+            for msg_id in chunk:
+                batch.add(_get_request(service, msg_id, fmt), request_id=msg_id)
+            batch.execute()
+        if not retry:
+            break
+        if attempt == BATCH_RETRIES:
+            print(f"⚠️ Giving up on {len(retry)} Gmail messages after {BATCH_RETRIES} retries")
+            break
+        time.sleep(min(2 ** attempt, 30))
+        pending = retry
+    if failed:
+        raise BatchFetchError(failed, results)
+    return results
+
+
+def headers_of(message) -> dict:
+    return {h["name"]: h["value"] for h in message.get("payload", {}).get("headers", [])}
+
+
+def is_candidate(metadata) -> bool:
+    """Triage on metadata: does this message deserve a full download?"""
+    if not TRIAGE_ENABLED:
+        return True
+    if _SKIP_LABELS & set(metadata.get("labelIds", [])):
+        return False
+    headers = headers_of(metadata)
+    content_type = headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+    if content_type and content_type.startswith(TRIAGE_CONTENT_TYPES):
+        return True
+    return bool(TRIAGE_PATTERN.search(f"{headers.get('Subject', '')} {metadata.get('snippet', '')}"))
+
+
+def to_email_row(message, full=True, service=None) -> dict:
+    """
+    Shape a Gmail message resource into an emails-table row dict.
+
+    Full messages get their body from the MIME walker; a calendar part is parsed
+    into `event` (invitation fields) so the message can skip LLM classification.
+    `service` is only needed to download calendar files Gmail did not inline.
+    """
+    headers = headers_of(message)
+    row = {
+        "sender": headers.get("From", "Unknown"),
+        "header": headers.get("Subject", "No Subject"),
+        "body": message.get("snippet", ""),
+        "date": headers.get("Date"),
+        "gmail_msg_id": message.get("id"),
+        "gmail_thread_id": message.get("threadId"),
+    }
+    if full:
+        payload = message.get("payload", {})
+        row["body"] = email_parsing.extract_body(payload)
+
+        def _attachment(attachment_id):
+            return service.users().messages().attachments().get(
+                userId="me", messageId=message["id"], id=attachment_id, fields="data"
+            ).execute().get("data")
+
+        event = email_parsing.find_calendar_event(payload, _attachment if service else None)
+        if event:
+            row["event"] = event
+    return row
+
+
+def fetch_email_rows(service, msg_ids, limiter=None) -> list:
+    """
+    Two-stage fetch: metadata for every message, full bodies for triage candidates only.
+    Non-candidates are stored with their snippet as body. Input order is kept.
+    Raises BatchFetchError (see batch_get) if any message failed to download.
+    """
+    msg_ids = list(msg_ids)
+    if not msg_ids:
+        return []
+    if not TRIAGE_ENABLED:
+        full = batch_get(service, msg_ids, "full", limiter)
+        return [to_email_row(full[m], service=service) for m in msg_ids if m in full]
+
+    metadata = batch_get(service, msg_ids, "metadata", limiter)
+    candidates = [m for m in msg_ids if m in metadata and is_candidate(metadata[m])]
+    full = batch_get(service, candidates, "full", limiter)
+    print(f"🔎 Triage: {len(candidates)}/{len(metadata)} messages fetched in full")
+
+    rows = []
+    for m in msg_ids:
+        if m in full:
+            rows.append(to_email_row(full[m], service=service))
+        elif m in metadata:
+            rows.append(to_email_row(metadata[m], full=False))
+    return rows
@@ -1,21 +1,27 @@
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 import os
 from dotenv import load_dotenv
 
+import gmail_api
+
 load_dotenv()
 
-service_account_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+GMAIL_WATCH_TOPIC = os.getenv("GMAIL_WATCH_TOPIC", "projects/aiso-477615/topics/gmail-updates")
+
+
+def start_watch(service, topic=GMAIL_WATCH_TOPIC, label_ids=("INBOX",)):
+    """Ask Gmail to publish mailbox changes to `topic`; returns the watch response (historyId, expiration)."""
+    watch_request = {
+        "labelIds": list(label_ids),     # Only watch inbox
+        "topicName": topic,
+    }
+    return service.users().watch(userId="me", body=watch_request).execute()
+
 
-# Load OAuth credentials
-creds = Credentials.from_authorized_user_file("token.json")
-service = build("gmail", "v1", credentials=creds)
+def main(service=None):
+    response = start_watch(service or gmail_api.get_service())
+    print("✅ Gmail watch started:", response)
+    return response
 
-# Start watching the mailbox
-watch_request = {
-    "labelIds": ["INBOX"],           # Only watch inbox
-    "topicName": "projects/aiso-477615/topics/gmail-updates"
-}
 
-response = service.users().watch(userId="me", body=watch_request).execute()
-print("✅ Gmail watch started:", response)
+if __name__ == "__main__":
+    main()
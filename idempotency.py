@@ -0,0 +1,158 @@
+"""
+Idempotency-Key support for non-idempotent POST routes.
+
+A retried request carrying the same `Idempotency-Key` gets the stored response
+of the first request instead of doing the work again. Concurrent duplicates
+block until the first request finishes and then share its response. Failed
+requests are not stored, so the client can retry them. Entries expire after a
+short TTL, and the store is bounded with oldest-first eviction.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+
+import metrics
+
+
+class IdempotencyError(Exception):
+    """Base class for idempotency key misuse."""
+
+
+class IdempotencyKeyReused(IdempotencyError):
+    """The key was already used with a different request body."""
+
+
+class IdempotencyInProgress(IdempotencyError):
+    """The original request is still running and did not finish within the wait timeout."""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "done", "response", "expires_at")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+        self.expires_at = None  # set once the response is stored
+
+
+def fingerprint(payload) -> str:
+    """Stable hash of a JSON-serializable request body."""
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+class IdempotencyStore:
+    """Thread-safe, TTL-bounded store of responses keyed by (scope, Idempotency-Key)."""
+
+    def __init__(self, name: str = "idempotency", ttl_seconds: float = 300, max_entries: int = 10000,
+                 wait_timeout: float = 30):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def run(self, scope: str, key: str, payload, fn):
+        """
+        Run `fn()` at most once per (scope, key) within the TTL.
+
+        Args:
+            scope (str): Namespace for the key, typically the route.
+            key (str): Client-supplied Idempotency-Key.
+            payload: Request body; reusing a key with a different body is rejected.
+            fn (callable): Produces the response on first use.
+
+        Returns:
+            tuple: (response, replayed) where `replayed` is True for a stored response.
+
+        Raises:
+            IdempotencyKeyReused: The key was used with a different body.
+            IdempotencyInProgress: The original request did not finish in time.
+        """
+        full_key = (scope, key)
+        fp = fingerprint(payload)
+
+        while True:
+            with self._lock:
+                self._expire(time.monotonic())
+                entry = self._entries.get(full_key)
+                if entry is None:
+                    entry = self._entries[full_key] = _Entry(fp)
+                    self._evict()
+                    owner = True
+                else:
+                    owner = False
+                    if entry.fingerprint != fp:
+                        raise IdempotencyKeyReused(f"Idempotency-Key {key!r} was already used with a different request")
+
+            if owner:
+                metrics.record_cache(self.name, hit=False)
+                return self._execute(full_key, entry, fn), False
+
+            if not entry.done.wait(self.wait_timeout):
+                raise IdempotencyInProgress(f"Request with Idempotency-Key {key!r} is still in progress")
+            if entry.expires_at is not None:
+                metrics.record_cache(self.name, hit=True)
+                return entry.response, True
+            # the original request failed and was dropped; try again as the owner
+
+    def _execute(self, full_key, entry, fn):
+        try:
+            response = fn()
+        except BaseException:
+            with self._lock:
+                if self._entries.get(full_key) is entry:
+                    del self._entries[full_key]
+            entry.done.set()
+            raise
+
+        with self._lock:
+            entry.response = response
+            entry.expires_at = time.monotonic() + self.ttl_seconds
+            if full_key in self._entries:
+                self._entries.move_to_end(full_key)
+        entry.done.set()
+        return response
+
+    def _expire(self, now: float):
+        # completed entries are moved to the end on completion, so they expire front to back;
+        # running entries (bounded by request concurrency) are skipped
+        expired = []
+        for key, entry in self._entries.items():
+            if entry.expires_at is None:
+                continue
+            if entry.expires_at > now:
+                break
+            expired.append(key)
+        for key in expired:
+            del self._entries[key]
+
+    def _evict(self):
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        victims = []
+        for key, entry in self._entries.items():
+            if len(victims) >= excess:
+                break
+            # never drop a running request: its duplicates are waiting on it
+            if entry.expires_at is not None:
+                victims.append(key)
+        for key in victims:
+            del self._entries[key]
+        metrics.CACHE_EVICTIONS.inc(len(victims), cache=self.name)
+
+
+booking_store = IdempotencyStore(
+    name="idempotency",
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 300)),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000)),
+)
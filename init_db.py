@@ -180,6 +180,11 @@ if __name__ == "__main__":
     create_database()
     create_tables()
     insert_dummy_data()
+    # bring the schema up to date (is_invitation, indexes, ...)
+    from databases.migrate import migrate
+    migrate_conn = get_connection(DB_NAME)
+    migrate(migrate_conn)
+    migrate_conn.close()
     print("✅ Database initialization complete!")
     cur.execute("SELECT * FROM emails")
     print(cur.fetchall())
@@ -0,0 +1,125 @@
+"""
+bcrypt password hashing off the event loop.
+
+A cost-12 bcrypt hash is a few hundred milliseconds of pure CPU. Running it
+in a request handler would stall the loop, and running it in the threadpool
+would serialise on the GIL, so hashing and verification run in a dedicated
+process pool. Admission to the pool is bounded (`PASSWORD_HASH_MAX_PENDING`);
+callers past that wait for a slot instead of piling work into the pool's
+unbounded internal queue.
+
+Rows written before bcrypt was introduced hold the plaintext password. Those
+still verify, and `verify_password` reports that they need re-hashing so
+login can upgrade them in place.
+"""
+import asyncio
+import functools
+import hmac
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+
+import metrics
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", HASH_WORKERS * 4))
+
+PASSWORD_HASH_LATENCY = metrics.Histogram(
+    "password_hash_seconds",
+    "Time to hash or verify a password, including queueing for a worker.",
+    ("operation",),
+)
+PASSWORD_HASH_PENDING = metrics.Gauge("password_hash_pending", "Password operations queued or running in the pool.")
+
+_executor = None
+_slots = None
+
+
+def _encode(password: str) -> bytes:
+    # bcrypt only looks at the first 72 bytes; bcrypt>=5 raises instead of truncating
+    return password.encode("utf-8")[:72]
+
+
+def is_hashed(stored: Optional[str]) -> bool:
+    return bool(stored) and stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode("ascii")
+
+
+def needs_rehash(stored: str, rounds: int = BCRYPT_ROUNDS) -> bool:
+    if not is_hashed(stored):
+        return True
+    try:
+        return int(stored.split("$")[2]) < rounds
+    except (IndexError, ValueError):
+        return True
+
+
+def verify_password(password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    """
+    Check a password against a stored bcrypt hash or legacy plaintext value.
+
+    Returns:
+        tuple: (matches, needs_rehash)
+    """
+    if not stored:
+        # still pay for one bcrypt check so unknown emails cost the same as wrong passwords
+        bcrypt.checkpw(_encode(password), _dummy_hash())
+        return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), True
+    try:
+        ok = bcrypt.checkpw(_encode(password), stored.encode("ascii"))
+    except ValueError:
+        return False, False
+    return ok, ok and needs_rehash(stored)
+
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash() -> bytes:
+    return hash_password("not-a-real-password").encode("ascii")
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the parent runs threads (pool sweepers, writers) that fork would copy mid-flight
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown():
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    _slots = None
+
+
+async def _submit(operation: str, fn, *args):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_PENDING)
+    start = time.perf_counter()
+    async with _slots:
+        PASSWORD_HASH_PENDING.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(get_executor(), fn, *args)
+        finally:
+            PASSWORD_HASH_PENDING.dec()
+            PASSWORD_HASH_LATENCY.observe(time.perf_counter() - start, operation=operation)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _submit("hash", hash_password, password)
+
+
+async def verify_password_async(password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    return await _submit("verify", verify_password, password, stored)
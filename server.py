@@ -1,18 +1,28 @@
 # server.py
-from fastapi import FastAPI, HTTPException, Depends, Cookie, Response, Path, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Cookie, Header, Response, Path, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import metrics
+import idempotency
+import admission
+import auth_tokens
+import passwords
 from importlib import import_module
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import orjson
 import traceback
 import uuid
 from pathlib import Path
 from typing import Tuple
-from db import fetch_parsed_invitations_from_db
 
-from db import get_db_connection
+import db
+from db import close_pool, get_pool
+import async_db
+from databases import auth as session_store
 from dotenv import load_dotenv
 from agent import run_flight_finder_agent_with_preferences
 
@@ -28,6 +38,20 @@ origins = [
 
 app = FastAPI()
 
+# Per-user and global concurrency caps on agent and search routes; excess load is
+# queued (bounded) and then shed with 429 + Retry-After. Registered before CORS so
+# rejections still carry CORS headers.
+app.add_middleware(
+    admission.AdmissionMiddleware,
+    rules={
+        ("POST", "/api/preferences"): admission.agent_controller,
+        ("POST", "/api/agent/search_flights"): admission.agent_controller,
+        ("POST", "/api/agent/rag"): admission.agent_controller,
+        ("POST", "/api/flights/search"): admission.search_controller,
+        ("POST", "/api/flights/search/stream"): admission.search_controller,
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -35,6 +59,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.PrometheusMiddleware)
 
 
 class Preferences(BaseModel):
@@ -69,6 +94,42 @@ def read_root():
     return {"message": "Hello, AISO!"}
 
 
+@app.get("/api/admission")
+def get_admission_stats():
+    """Current in-flight, queued and shed counts for each admission pool."""
+    return [admission.agent_controller.stats(), admission.search_controller.stats()]
+
+
+@app.on_event("startup")
+async def _open_async_db_pool():
+    try:
+        await async_db.init_pool()
+    except Exception as e:
+        # keep serving mock/agent routes; DB-backed routes will report the error
+        print(f"❌ Error creating async database pool: {e}")
+    session_store.start_session_sweeper()
+
+
+@app.on_event("shutdown")
+async def _close_db_pools():
+    session_store.stop_session_sweeper()
+    await async_db.close_pool()
+    close_pool()
+    passwords.shutdown()
+
+
+@app.get("/api/db/pool")
+def get_db_pool_stats():
+    """Connection pool sizing and utilisation."""
+    return get_pool().stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 def _lazy_import_agent():
     """Lazy import of the agent module. Returns module or raises ImportError.
 
@@ -79,8 +140,9 @@ def _lazy_import_agent():
     try:
         agent = import_module("agent.agent")
         return agent
-    except Exception:
-        raise
+    except ModuleNotFoundError:
+        # agent.py lives next to this file as a plain module
+        return import_module("agent")
 
 
 # ----------------------------
@@ -202,20 +264,40 @@ def confirm_essential(meeting_id: str, payload: Dict[str, Any], background_tasks
     task_id = _rand("task_")
     return {"taskId": task_id, "meetingId": meeting_id, "status": "accepted", "message": "Essential info updated"}
 
+@app.get("/api/emails/search")
+def search_emails(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    invitations_only: bool = False,
+    user: Dict[str, Any] = Depends(auth_tokens.current_user),
+):
+    """
+    Ranked full-text search over the signed-in user's emails.
+    `q` uses web-search syntax: words, "quoted phrases", `or`, `-excluded`.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty search query")
+    page = db.search_emails(user["userid"], q, limit=limit, offset=offset, invitations_only=invitations_only)
+    for r in page["results"]:
+        r["rank"] = float(r["rank"])
+    return {"query": q, "offset": offset, **page}
+
+
 @app.get("/api/invitations")
-def get_invitations(user_id: str):
+async def get_invitations(user_id: str):
     """
     Fetch all parsed invitations for a given user from the database.
     """
     try:
-        invitations = fetch_parsed_invitations_from_db(user_id)
+        invitations = await async_db.fetch_parsed_invitations(int(user_id))
         # Transform to frontend-friendly structure
         formatted = [
             {
                 "id": inv.get("emailid"),
-                "title": inv.get("header"),
-                "location": inv.get("location", "Amsterdam"),
-                "start": inv.get("event_time", ""),
+                "title": inv.get("event_title") or inv.get("header"),
+                "location": inv.get("event_location"),
+                "start": inv.get("event_time") or "",
             }
             for inv in invitations
         ]
@@ -236,7 +318,8 @@ class UserPreferences(BaseModel):
 async def set_user_preferences(preferences: UserPreferences):
     try:
         pref_dict = preferences.dict()
-        result = run_flight_finder_agent_with_preferences(pref_dict)
+        # the agent run blocks on SerpAPI/LLM calls; keep it off the event loop
+        result = await run_in_threadpool(run_flight_finder_agent_with_preferences, pref_dict)
         return {"status": "success", "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -258,15 +341,7 @@ def flights_search(body: Dict[str, Any]):
             flights = agent.fetch_flight_data_wrapper(prefs)
             # build response
             sid = _rand("s_")
-            candidates = []
-            for i, f in enumerate(flights or []):
-                candidates.append({
-                    "id": f.get("id") or f"f_{i}",
-                    "price": f.get("price"),
-                    "itinerary": f.get("route"),
-                    "provider": f.get("airline") or f.get("provider"),
-                    "details": f,
-                })
+            candidates = [_to_candidate(i, f) for i, f in enumerate(flights or [])]
             resp = {"searchId": sid, "status": "completed", "candidates": candidates}
             _mock["searches"][sid] = resp
             return resp
@@ -290,6 +365,71 @@ def flights_search(body: Dict[str, Any]):
     return resp
 
 
+def _to_candidate(i: int, f: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a parsed flight into the frontend's FlightCandidate structure."""
+    return {
+        "id": f.get("id") or f"f_{i}",
+        "price": f.get("price"),
+        "itinerary": f.get("route"),
+        "provider": f.get("airline") or f.get("provider"),
+        "details": f,
+    }
+
+
+def _ndjson(record: Dict[str, Any]) -> bytes:
+    return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE, default=str)
+
+
+def _price_key(candidate: Dict[str, Any]) -> float:
+    try:
+        return float(candidate.get("price"))
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+@app.post("/api/flights/search/stream")
+def flights_search_stream(body: Dict[str, Any]):
+    """Streaming variant of `/api/flights/search`.
+
+    Emits newline-delimited JSON: one `{"type": "candidate", ...}` record per flight
+    as soon as its upstream batch has been parsed, then a final `{"type": "summary"}`
+    record holding every candidate ranked by price. Accepts the same body as
+    `/api/flights/search`, plus comma-separated / list airports and a `dates` list.
+    """
+    try:
+        agent = _lazy_import_agent()
+    except Exception:
+        agent = None
+
+    sid = _rand("s_")
+
+    def _batches():
+        if agent and hasattr(agent, "iter_flight_data_wrapper"):
+            yield from agent.iter_flight_data_wrapper(body or {})
+        else:
+            yield (PARSED_FLIGHTS or TOP_3_FLIGHTS)[:5]
+
+    def _stream():
+        candidates = []
+        status = "completed"
+        try:
+            for batch in _batches():
+                for f in batch:
+                    candidate = _to_candidate(len(candidates), f)
+                    candidates.append(candidate)
+                    yield _ndjson({"type": "candidate", "searchId": sid, "candidate": candidate})
+        except Exception:
+            status = "failed"
+            yield _ndjson({"type": "error", "searchId": sid, "error": "agent search failed", "trace": traceback.format_exc()})
+
+        ranked = sorted(candidates, key=_price_key)
+        resp = {"searchId": sid, "status": status, "candidates": ranked}
+        _mock["searches"][sid] = resp
+        yield _ndjson({"type": "summary", **resp})
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
 @app.get("/api/agent/reasoning/{meeting_id}")
 def get_reasoning(meeting_id: str):
     # TODO: recieve the result from the getflight, get the reason part
@@ -304,16 +444,35 @@ def get_booking(booking_id: str):
     raise HTTPException(status_code=404, detail="booking not found")
 
 
+def _idempotent(scope: str, key: Optional[str], payload: Any, response: Response, fn):
+    """Run `fn` once per Idempotency-Key; retries replay the first response."""
+    if not key:
+        return fn()
+    try:
+        result, replayed = idempotency.booking_store.run(scope, key, payload, fn)
+    except idempotency.IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotency.IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
 @app.post("/api/bookings")
-def post_booking(body: Dict[str, Any]):
-    # body may contain candidate_id, meeting_id, user_info
-    candidate_id = body.get("candidate_id") or body.get("candidateId")
-    meeting_id = body.get("meeting_id") or body.get("meetingId")
-    b_id = _rand("b_")
-    confirmation = _rand("C-")
-    booking = {"bookingId": b_id, "status": "confirmed", "confirmationNumber": confirmation, "itinerary": {"candidate_id": candidate_id}, "meeting_id": meeting_id}
-    _mock["bookings"][b_id] = booking
-    return booking
+def post_booking(body: Dict[str, Any], response: Response,
+                 idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    def _book():
+        # body may contain candidate_id, meeting_id, user_info
+        candidate_id = body.get("candidate_id") or body.get("candidateId")
+        meeting_id = body.get("meeting_id") or body.get("meetingId")
+        b_id = _rand("b_")
+        confirmation = _rand("C-")
+        booking = {"bookingId": b_id, "status": "confirmed", "confirmationNumber": confirmation, "itinerary": {"candidate_id": candidate_id}, "meeting_id": meeting_id}
+        _mock["bookings"][b_id] = booking
+        return booking
+
+    return _idempotent("/api/bookings", idempotency_key, body, response, _book)
 
 
 
@@ -338,21 +497,26 @@ def rag_lookup(payload: Dict[str, Any]):
 
 
 @app.post("/api/agent/book")
-def create_booking(req: BookingRequest):
+def create_booking(req: BookingRequest, response: Response,
+                   idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """Placeholder booking endpoint.
 
     The agent/booking flow is application-specific. This endpoint simply echoes
     a confirmation and would be the place to insert DB persistence or calls to
-    downstream booking/procurement services.
+    downstream booking/procurement services. Honors `Idempotency-Key` so that
+    work added here is not repeated for client retries.
     """
-    # In a real app you'd persist booking and return the record ID.
-    return {
-        "status": "ok",
-        "booking_id": f"bk_{req.candidate_id}_{req.meeting_id or 'nomtg'}",
-        "candidate_id": req.candidate_id,
-        "meeting_id": req.meeting_id,
-        "user_info": req.user_info,
-    }
+    def _book():
+        # In a real app you'd persist booking and return the record ID.
+        return {
+            "status": "ok",
+            "booking_id": f"bk_{req.candidate_id}_{req.meeting_id or 'nomtg'}",
+            "candidate_id": req.candidate_id,
+            "meeting_id": req.meeting_id,
+            "user_info": req.user_info,
+        }
+
+    return _idempotent("/api/agent/book", idempotency_key, req.dict(), response, _book)
   
   
 class SignupRequest(BaseModel):
@@ -364,48 +528,104 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
-def get_user_by_email(email: str = 'dummy@gmail.com'):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        print("Fetching user by email:", email)
-        cur.execute("SELECT userid, email, name, password FROM users WHERE email = %s", (email,))
-        row = cur.fetchone()
-        if row:
-            return {"userid": row[0], "email": row[1], "name": row[2], "password": row[3]}
-        return None
-    finally:
-        cur.close()
-        conn.close()
-
-def create_user(email: str, name: str, password: str):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "INSERT INTO users (email, name, password) VALUES (%s, %s, %s) RETURNING userid",
-            (email, name, password)
-        )
-        user_id = cur.fetchone()[0]
-        conn.commit()
-        return user_id
-    finally:
-        cur.close()
-        conn.close()
-
 @app.post("/api/auth/signup")
-def signup(req: SignupRequest, response: Response):
-    existing_user = get_user_by_email(req.email)
-    if existing_user:
+async def signup(req: SignupRequest, response: Response):
+    # ON CONFLICT DO NOTHING: a taken email yields no id, without a separate lookup
+    password_hash = await passwords.hash_password_async(req.password)
+    user_id = await async_db.create_user(req.email, req.name, password_hash)
+    if user_id is None:
         raise HTTPException(status_code=400, detail="User with this email already exists")
-    
-    user_id = create_user(req.email, req.name, req.password)
+
     return {"message": "Signup successful", "user": {"userid": user_id, "email": req.email, "name": req.name}}
 
 @app.post("/api/auth/login")
-def login(req: LoginRequest, response: Response):
-    user = get_user_by_email(req.email)
-    if not user or user["password"] != req.password:
+async def login(req: LoginRequest, response: Response, background_tasks: BackgroundTasks):
+    user = await async_db.get_user_by_email(req.email)
+    ok, needs_rehash = await passwords.verify_password_async(req.password, user["password"] if user else None)
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    if needs_rehash:
+        # legacy plaintext (or lower-cost) row: upgrade after the response is sent
+        background_tasks.add_task(_upgrade_password_hash, user["userid"], req.password, user["password"])
 
-    return {"message": "Login successful", "user": {"userid": user["userid"], "email": user["email"], "name": user["name"]}}
+    user = {"userid": user["userid"], "email": user["email"], "name": user["name"]}
+    tokens = await _issue_tokens(user)
+    _set_auth_cookies(response, tokens)
+    return {"message": "Login successful", "user": user, **tokens}
+
+
+async def _upgrade_password_hash(userid: int, password: str, old_value: str):
+    try:
+        await async_db.update_password(userid, await passwords.hash_password_async(password), old_value)
+    except Exception as e:
+        print(f"⚠️ Could not upgrade password hash for user {userid}: {e}")
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+
+def _refresh_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=auth_tokens.REFRESH_TOKEN_TTL)
+
+
+async def _issue_tokens(user: Dict[str, Any], sessionid: Optional[int] = None) -> Dict[str, Any]:
+    # both tokens reference a sessions row so they can be revoked; routes check
+    # the access token's session through async_db's session cache
+    if sessionid is None:
+        sessionid = await async_db.create_session(user["userid"], _refresh_expiry())
+    return {
+        "access_token": auth_tokens.issue_access_token(user, sessionid),
+        "refresh_token": auth_tokens.issue_refresh_token(user["userid"], sessionid),
+        "token_type": "bearer",
+        "expires_in": auth_tokens.ACCESS_TOKEN_TTL,
+    }
+
+
+def _set_auth_cookies(response: Response, tokens: Dict[str, Any]):
+    response.set_cookie("access_token", tokens["access_token"], max_age=auth_tokens.ACCESS_TOKEN_TTL,
+                        httponly=True, samesite="lax")
+    response.set_cookie("refresh_token", tokens["refresh_token"], max_age=auth_tokens.REFRESH_TOKEN_TTL,
+                        httponly=True, samesite="lax", path="/api/auth")
+
+
+@app.post("/api/auth/refresh")
+async def refresh_tokens(response: Response, req: Optional[RefreshRequest] = None, refresh_token: Optional[str] = Cookie(None)):
+    token = (req.refresh_token if req else None) or refresh_token
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing refresh token")
+    try:
+        claims = auth_tokens.decode_token(token, "refresh")
+    except auth_tokens.TokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid refresh token: {e}")
+
+    # the user comes back from the rotation itself, so a concurrent logout or
+    # account deletion yields None here instead of a half-resolved session
+    session = await async_db.rotate_session(claims["sid"], int(claims["sub"]), _refresh_expiry())
+    if session is None:
+        raise HTTPException(status_code=401, detail="Session expired or revoked")
+
+    user = {"userid": session["userid"], "email": session["email"], "name": session["name"]}
+    tokens = await _issue_tokens(user, session["sessionid"])
+    _set_auth_cookies(response, tokens)
+    return {"user": user, **tokens}
+
+
+@app.post("/api/auth/logout")
+async def logout(response: Response, req: Optional[RefreshRequest] = None, refresh_token: Optional[str] = Cookie(None)):
+    token = (req.refresh_token if req else None) or refresh_token
+    if token:
+        try:
+            claims = auth_tokens.decode_token(token, "refresh")
+        except auth_tokens.TokenError:
+            claims = None
+        if claims:
+            await async_db.delete_session(claims["sid"])
+    response.delete_cookie("access_token")
+    response.delete_cookie("refresh_token", path="/api/auth")
+    return {"message": "Logged out"}
+
+
+@app.get("/api/auth/me")
+async def me(user: Dict[str, Any] = Depends(auth_tokens.current_user)):
+    return {"user": user}
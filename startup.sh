@@ -8,6 +8,9 @@ PORT=8000
 # Activate virtual environment if needed
 # source /path/to/your/venv/bin/activate
 
+echo "Applying database migrations..."
+python3 -m databases.migrate || exit 1
+
 echo "Starting gmail_main.py..."
 python3 gmail_main.py &
 GMAIL_PID=$!
@@ -16,6 +19,10 @@ echo "Starting sub.py..."
 python3 sub.py &
 SUB_PID=$!
 
+echo "Starting classifier workers..."
+python3 classifier.py &
+CLASSIFIER_PID=$!
+
 # Wait a little to ensure scripts are running
 sleep 2
 
@@ -23,4 +30,4 @@ echo "Starting FastAPI server on port $PORT..."
 uvicorn server:app --reload --port $PORT
 
 # Optional: kill background scripts when uvicorn stops
-kill $GMAIL_PID $SUB_PID
+kill $GMAIL_PID $SUB_PID $CLASSIFIER_PID
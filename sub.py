@@ -2,91 +2,323 @@ from dotenv import load_dotenv
 import os
 import json
 import time
-import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
 from google.cloud import pubsub_v1
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from db import insert_email
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+from googleapiclient.errors import HttpError
+import gmail_api
+import metrics
+from db import insert_email, insert_emails_bulk, get_gmail_history_id, save_gmail_history_id, filter_new_gmail_ids
 
 load_dotenv()
 
 # --- Pub/Sub Setup ---
-project_id = "aiso-477615"
-subscription_id = "GmailTopic-sub"
+project_id = os.getenv("PUBSUB_PROJECT_ID", "aiso-477615")
+subscription_id = os.getenv("PUBSUB_SUBSCRIPTION_ID", "GmailTopic-sub")
+subscription_path = f"projects/{project_id}/subscriptions/{subscription_id}"
 
-subscriber = pubsub_v1.SubscriberClient()
-subscription_path = subscriber.subscription_path(project_id, subscription_id)
+# Upper bound on INBOX messages pulled by a full resync (first run or expired history)
+RESYNC_MAX_MESSAGES = int(os.getenv("GMAIL_RESYNC_MAX_MESSAGES", 100))
+
+# --- Consumer sizing ---
+# Workers each hold a Gmail client and at most one DB connection at a time, so stay
+# within the DB pool. Flow control caps what is leased but not yet processed.
+PUBSUB_WORKERS = int(os.getenv("PUBSUB_WORKERS", min(8, int(os.getenv("DB_POOL_MAX", 10)))))
+PUBSUB_MAX_MESSAGES = int(os.getenv("PUBSUB_MAX_MESSAGES", PUBSUB_WORKERS * 2))
+PUBSUB_MAX_BYTES = int(os.getenv("PUBSUB_MAX_BYTES", 10 * 1024 * 1024))
+# The client keeps extending ack deadlines of messages still being processed, each
+# extension at least PUBSUB_MIN_LEASE_EXTENSION seconds, up to PUBSUB_MAX_LEASE_SECONDS.
+PUBSUB_MAX_LEASE = int(os.getenv("PUBSUB_MAX_LEASE_SECONDS", 600))
+PUBSUB_MIN_LEASE_EXTENSION = int(os.getenv("PUBSUB_MIN_LEASE_EXTENSION", 60))
+SUB_METRICS_PORT = int(os.getenv("SUB_METRICS_PORT", 9101))  # 0 disables the /metrics listener
+
+PUBSUB_MESSAGES = metrics.Counter("pubsub_messages_total", "Gmail notifications handled, by outcome.", ("outcome",))
+PUBSUB_PROCESSING = metrics.Histogram("pubsub_processing_seconds", "Time to process one Gmail notification.")
+PUBSUB_IN_PROGRESS = metrics.Gauge("pubsub_messages_in_progress", "Notifications being processed by workers.")
+PUBSUB_DELIVERY_LAG = metrics.Histogram(
+    "pubsub_delivery_lag_seconds", "Publish-to-processing-start delay (subscription backlog age)."
+)
+GMAIL_EMAILS_STORED = metrics.Counter("gmail_emails_stored_total", "Emails stored from Gmail sync.")
 
 # --- Gmail API ---
-def get_gmail_service():
-    """Create a fresh Gmail service instance"""
-    creds = Credentials.from_authorized_user_file("token.json")
-    return build("gmail", "v1", credentials=creds)
+def get_gmail_service(email_address=None):
+    """
+    Gmail service for the calling worker thread; credentials and clients are reused.
+    This deployment holds one OAuth token, so `email_address` is accepted but unused.
+    """
+    return gmail_api.get_service()
+
+# --- Fetch a single message ---
+def fetch_message(service, msg_id):
+    """Download one Gmail message and return it as an emails-table row dict (None on failure)."""
+    try:
+        email = gmail_api.batch_get(service, [msg_id], "full").get(msg_id)
+        if email is None:
+            return None
+        row = gmail_api.to_email_row(email, service=service)
+        print(f"📬 New Email from {row['sender']}: {row['header']}")
+        return row
+
+    except Exception as e:
+        print(f"❌ Error fetching message {msg_id}: {e}")
+        return None
+
+# --- Recently stored message ids ---
+# Checked before any messages.get call, so redelivered notifications and overlapping
+# history ranges cost neither a Gmail fetch nor downstream classification.
+_recent_ids = LRUCache(maxsize=int(os.getenv("GMAIL_SEEN_CACHE_SIZE", 50000)))
+_recent_ids_lock = threading.Lock()
+
+
+def _remember(msg_ids):
+    with _recent_ids_lock:
+        for msg_id in msg_ids:
+            _recent_ids[msg_id] = True
+
+
+def unseen_message_ids(msg_ids):
+    """Drop ids stored before: the in-process LRU first, then one lookup in the emails table."""
+    with _recent_ids_lock:
+        candidates = [m for m in msg_ids if m not in _recent_ids]
+    if not candidates:
+        return []
+    new_ids = filter_new_gmail_ids(candidates)
+    _remember(set(candidates) - set(new_ids))
+    return new_ids
+
 
 # --- Process a single message ---
 def process_new_message(service, msg_id):
-    try:
-        email = service.users().messages().get(
-            userId="me",
-            id=msg_id,
-            format="full"
+    email = fetch_message(service, msg_id)
+    if email:
+        # a calendar invite is stored as a parsed invitation along with the email, no LLM needed
+        insert_email(email["sender"], email["header"], email["body"], email["date"],
+                     email["gmail_msg_id"], email["gmail_thread_id"], email.get("event"))
+        _remember([msg_id])
+        print("✅ Stored in PostgreSQL")
+
+# --- Incremental sync ---
+_mailbox_locks = {}
+_mailbox_locks_guard = threading.Lock()
+
+
+def _mailbox_lock(email_address):
+    """One sync at a time per mailbox, so concurrent notifications don't fetch the same history twice."""
+    with _mailbox_locks_guard:
+        return _mailbox_locks.setdefault(email_address, threading.Lock())
+
+
+class HistoryExpired(Exception):
+    """The stored startHistoryId is too old for users.history.list (HTTP 404)."""
+
+
+def list_added_message_ids(service, start_history_id):
+    """
+    Page through users.history.list from `start_history_id`.
+
+    Returns:
+        tuple: (ids of INBOX messages added since then, in order; mailbox's current historyId)
+    """
+    ids, seen = [], set()
+    page_token = None
+    latest = start_history_id
+    while True:
+        try:
+            resp = service.users().history().list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                labelId="INBOX",
+                pageToken=page_token,
+            ).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpired(start_history_id) from e
+            raise
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = added["message"]["id"]
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    ids.append(msg_id)
+        latest = max(int(latest), int(resp.get("historyId", latest)))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return ids, latest
+
+
+def list_inbox_message_ids(service, limit=RESYNC_MAX_MESSAGES):
+    """Ids of the newest `limit` INBOX messages."""
+    ids, page_token = [], None
+    while len(ids) < limit:
+        resp = service.users().messages().list(
+            userId="me", labelIds=["INBOX"], maxResults=min(500, limit - len(ids)), pageToken=page_token
         ).execute()
+        ids.extend(m["id"] for m in resp.get("messages", []))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+    return ids
 
-        headers = {h["name"]: h["value"] for h in email.get("payload", {}).get("headers", [])}
-        sender = headers.get("From", "Unknown")
-        subject = headers.get("Subject", "No Subject")
-        date = headers.get("Date")
 
-        # Extract plain text body
-        body = ""
-        parts = email.get("payload", {}).get("parts", [])
-        for part in parts:
-            if part.get("mimeType") == "text/plain":
-                data = part.get("body", {}).get("data")
-                if data:
-                    body = base64.urlsafe_b64decode(data).decode("utf-8")
-                    break
+def store_messages(service, msg_ids):
+    """
+    Fetch messages not stored yet and store them with one bulk insert; returns the number stored.
 
-        print(f"📬 New Email from {sender}: {subject}")
+    Raises gmail_api.BatchFetchError, storing nothing, if any message failed to
+    download, so the caller keeps its checkpoint and the range is retried.
+    """
+    msg_ids = unseen_message_ids(msg_ids)
+    # batched metadata triage, then full bodies for candidates only
+    emails = gmail_api.fetch_email_rows(service, msg_ids)
+    if not emails:
+        return 0
+    # one round trip and one commit for the whole notification; calendar invites are
+    # stored as parsed invitations in the same transaction, bypassing LLM classification
+    ids = insert_emails_bulk(emails)
+    _remember(e["gmail_msg_id"] for e in emails)
+    return len(ids)
 
-        insert_email(sender, subject, body, date)
-        print("✅ Stored in PostgreSQL")
 
-    except Exception as e:
-        print(f"❌ Error fetching message {msg_id}: {e}")
+def full_resync(service, email_address):
+    """Baseline sync: newest INBOX messages, then checkpoint at the profile's historyId."""
+    # read the checkpoint before listing, so mail arriving meanwhile is picked up by the next incremental sync
+    history_id = int(service.users().getProfile(userId="me").execute()["historyId"])
+    stored = store_messages(service, list_inbox_message_ids(service))
+    GMAIL_EMAILS_STORED.inc(stored)
+    save_gmail_history_id(email_address, history_id)
+    print(f"🔄 Full resync of {email_address}: {stored} emails stored, checkpoint {history_id}")
+    return stored
+
+
+def sync_mailbox(service, email_address, notified_history_id=None):
+    """
+    Store INBOX messages added since the mailbox's last checkpoint.
+
+    The checkpoint only advances after every message is stored. A failure,
+    including a message Gmail would not return (BatchFetchError), leaves it in
+    place; the notification is nacked and its redelivery retries the same range.
+    Falls back to `full_resync` on the first run or when history has expired.
+    """
+    with _mailbox_lock(email_address):
+        start = get_gmail_history_id(email_address)
+        if start is None:
+            return full_resync(service, email_address)
+        if notified_history_id is not None and int(notified_history_id) <= start:
+            print(f"⏭️ {email_address} already synced past historyId {notified_history_id}")
+            return 0
+        try:
+            msg_ids, latest = list_added_message_ids(service, start)
+        except HistoryExpired:
+            print(f"⚠️ History for {email_address} expired at {start}; falling back to full resync")
+            return full_resync(service, email_address)
+        try:
+            stored = store_messages(service, msg_ids)
+        except gmail_api.BatchFetchError as e:
+            print(f"⚠️ {len(e.failed)} messages for {email_address} failed to download; "
+                  f"keeping checkpoint {start} for retry")
+            raise
+        GMAIL_EMAILS_STORED.inc(stored)
+        save_gmail_history_id(email_address, latest)
+        print(f"✅ Stored {stored} new emails for {email_address} (historyId {start} → {latest})")
+        return stored
+
 
 # --- Pub/Sub Callback ---
-def callback(message):
+def make_callback(service_factory=get_gmail_service):
+    """
+    Build the Pub/Sub message handler.
+
+    Args:
+        service_factory (callable): email_address -> Gmail service (or a stand-in
+            exposing the same calls, see bench/gmail_fakes.py).
+    """
+    def callback(message):
+        handle_notification(message, service_factory)
+    return callback
+
+
+def handle_notification(message, service_factory=get_gmail_service):
+    start = time.perf_counter()
+    if message.publish_time:
+        PUBSUB_DELIVERY_LAG.observe(max(0.0, time.time() - message.publish_time.timestamp()))
+    PUBSUB_IN_PROGRESS.inc()
     try:
         data = json.loads(message.data.decode("utf-8"))
         print(f"\n📧 Notification received at {time.strftime('%H:%M:%S')}")
 
-        service = get_gmail_service()
-
-        # Fetch recent messages from INBOX (latest first)
-        result = service.users().messages().list(userId="me", labelIds=["INBOX"], maxResults=5).execute()
-        messages = result.get("messages", [])
-
-        if messages:
-            for msg in messages:
-                process_new_message(service, msg["id"])
+        email_address = data.get("emailAddress", "me")
+        service = service_factory(email_address)
+        sync_mailbox(service, email_address, data.get("historyId"))
 
         message.ack()
+        PUBSUB_MESSAGES.inc(outcome="ack")
     except Exception as e:
         print(f"❌ Error: {type(e).__name__}: {e}")
         if "ssl" in str(e).lower():
             message.ack()
+            PUBSUB_MESSAGES.inc(outcome="ack_error")
         else:
             message.nack()
+            PUBSUB_MESSAGES.inc(outcome="nack")
+    finally:
+        PUBSUB_IN_PROGRESS.dec()
+        PUBSUB_PROCESSING.observe(time.perf_counter() - start)
+
+
+callback = make_callback()
+
 
 # --- Start Listening ---
-print(f"🎧 Listening on: {subscription_path}")
-print(f"⏰ Started at: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+def start_subscriber(subscriber=None, subscription=subscription_path, service_factory=get_gmail_service,
+                     workers=PUBSUB_WORKERS, max_messages=None):
+    """
+    Start the streaming pull; returns its future.
+
+    Args:
+        subscriber: Pub/Sub `SubscriberClient` (created if omitted) or a stand-in
+            with the same `subscribe` signature.
+        subscription (str): Subscription path.
+        service_factory (callable): email_address -> Gmail service.
+        workers (int): Callback threads.
+        max_messages (int, optional): Outstanding (leased, unacked) message cap.
+    """
+    if subscriber is None:
+        subscriber = pubsub_v1.SubscriberClient()
+    flow_control = pubsub_v1.types.FlowControl(
+        max_messages=max_messages or workers * 2,
+        max_bytes=PUBSUB_MAX_BYTES,
+        max_lease_duration=PUBSUB_MAX_LEASE,
+        min_duration_per_lease_extension=PUBSUB_MIN_LEASE_EXTENSION,
+    )
+    scheduler = ThreadScheduler(
+        executor=ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pubsub-worker")
+    )
+    return subscriber.subscribe(
+        subscription, callback=make_callback(service_factory), flow_control=flow_control, scheduler=scheduler
+    )
+
+
+def main():
+    if SUB_METRICS_PORT:
+        metrics.start_http_server(SUB_METRICS_PORT)
+        print(f"📈 Metrics on :{SUB_METRICS_PORT}/metrics")
+
+    print(f"🎧 Listening on: {subscription_path} "
+          f"({PUBSUB_WORKERS} workers, ≤{PUBSUB_MAX_MESSAGES} outstanding messages)")
+    print(f"⏰ Started at: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+    streaming_pull_future = start_subscriber(max_messages=PUBSUB_MAX_MESSAGES)
+
+    try:
+        streaming_pull_future.result()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down...")
+        streaming_pull_future.cancel()
+        streaming_pull_future.result(timeout=30)
 
-streaming_pull_future = subscriber.subscribe(subscription_path, callback=callback)
 
-try:
-    streaming_pull_future.result()
-except KeyboardInterrupt:
-    print("\n👋 Shutting down...")
-    streaming_pull_future.cancel()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Metadata triage must send calendar invites for a full fetch whatever their subject."""
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+pytest.importorskip("googleapiclient")
+
+import gmail_api  # noqa: E402
+
+
+def _metadata(subject, content_type=None, labels=("INBOX",)):
+    headers = [{"name": "Subject", "value": subject}]
+    if content_type:
+        headers.append({"name": "Content-Type", "value": content_type})
+    return {"id": "m1", "labelIds": list(labels), "snippet": "", "payload": {"headers": headers}}
+
+
+@pytest.mark.parametrize("content_type", [
+    'multipart/alternative; boundary="x"',  # Outlook: text/calendar as an alternative part
+    'multipart/mixed; boundary="x"',        # Google: invite.ics attached
+    "text/calendar; method=REQUEST",
+])
+def test_invite_with_plain_subject_is_candidate(content_type):
+    assert gmail_api.is_candidate(_metadata("Q3 planning", content_type))
+
+
+def test_plain_text_without_keywords_is_not_candidate():
+    assert not gmail_api.is_candidate(_metadata("Q3 planning", "text/plain; charset=utf-8"))
+
+
+def test_skipped_labels_win_over_content_type():
+    assert not gmail_api.is_candidate(_metadata("Q3 planning", "multipart/mixed", labels=("SPAM",)))
@@ -0,0 +1,39 @@
+"""
+Hot-path queries must be able to use their indexes (same checks as
+`python -m databases.migrate --check-plans`).
+
+Needs a migrated Postgres reachable through the `DB_*` environment variables;
+skipped otherwise.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+if not (os.getenv("DB_HOST") and os.getenv("DB_NAME")):
+    pytest.skip("no database configured (DB_HOST / DB_NAME unset)", allow_module_level=True)
+pytest.importorskip("psycopg2")
+
+import db  # noqa: E402
+from databases import migrate  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def conn():
+    try:
+        connection = db.get_db_connection()
+    except Exception as e:
+        pytest.skip(f"database unreachable: {e}")
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize("check", migrate.PLAN_CHECKS, ids=[c[0] for c in migrate.PLAN_CHECKS])
+def test_query_uses_index(conn, check):
+    [(helper, index, ok, plan)] = migrate.check_query_plans(conn, [check])
+    assert ok, f"{helper} does not use {index}:\n{plan}"